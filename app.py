@@ -3,19 +3,29 @@
 
 import streamlit as st
 import os
+import io
+import json
+import time
 import model      # Mengimpor modul model
 import controller # Mengimpor modul controller
 import config     # Mengimpor modul config
+import model_registry # Mengimpor registry model tingkat proses
+import result_cache # Mengimpor cache hasil ekstraksi
+import profiling  # Mengimpor instrumentasi waktu per stage
+import job_queue  # Mengimpor antrian job ekstraksi
+import result_records # Mengimpor record hasil ringkas
 
 # --- UI Streamlit ---
 st.set_page_config(page_title="Ekstraksi Data Kuesioner", layout="wide")
 st.title("📄 Aplikasi Ekstraksi Data dari Kuesioner PDF")
 st.markdown("Aplikasi ini menggunakan AI untuk mendeteksi area pertanyaan dan mengenali karakter dari PDF kuesioner.")
 
-# Muat model di awal aplikasi (akan di-cache)
+# Ambil model dari registry proses (dimuat dan di-warmup sekali, dipakai ulang antar rerun)
 # Pesan error akan ditampilkan di konsol/log jika gagal, dan di UI saat proses berjalan.
-model_ssd_loaded_global = model.load_ssd_model(config.SSD_MODEL_PATH, config.SSD_NUM_CLASSES, config.DEVICE)
-model_char_classifier_loaded_global = model.load_char_classifier_model(config.CHAR_CLASSIFIER_MODEL_PATH, config.CHAR_NUM_CLASSES, config.DEVICE)
+model_ssd_loaded_global, model_char_classifier_loaded_global = model_registry.get_models(config.DEVICE)
+
+# Bersihkan workspace sementara sisa proses yang sudah mati (workspace yang masih dipakai dilewati)
+model.cleanup_stale_workspaces()
 
 
 # Inisialisasi session state
@@ -24,6 +34,13 @@ if 'all_results_data' not in st.session_state: st.session_state.all_results_data
 if 'excel_buffer_data' not in st.session_state: st.session_state.excel_buffer_data = None
 if 'processed_pdf_name' not in st.session_state: st.session_state.processed_pdf_name = ""
 if 'processed_gender' not in st.session_state: st.session_state.processed_gender = ""
+if 'profile_data' not in st.session_state: st.session_state.profile_data = None
+if 'active_job_id' not in st.session_state: st.session_state.active_job_id = None
+if 'job_stats' not in st.session_state: st.session_state.job_stats = None
+
+# Worker antrian di dalam proses ini (sekali per proses, memakai model dari registry yang sama)
+if config.JOB_QUEUE_ENABLED and config.JOB_QUEUE_EMBEDDED_WORKERS > 0 and model_ssd_loaded_global and model_char_classifier_loaded_global:
+    job_queue.ensure_embedded_workers(config.DEVICE)
 
 
 # --- Sidebar UI ---
@@ -33,6 +50,18 @@ with st.sidebar:
     
     gender_options = ["pria", "perempuan"]
     selected_gender_ui_val = st.selectbox("2. Pilih Jenis Kelamin (untuk anotasi area)", gender_options, index=0, key="gender_selector_widget_main" )
+
+    extraction_mode_labels = {"page": "Halaman penuh", "region": "Hanya area anotasi (lebih hemat)"}
+    selected_mode_ui_val = st.selectbox(
+        "3. Mode Render PDF", config.EXTRACTION_MODES,
+        index=config.EXTRACTION_MODES.index(config.EXTRACTION_MODE),
+        format_func=lambda mode: extraction_mode_labels.get(mode, mode), key="extraction_mode_widget_main"
+    )
+    use_pipeline_ui_val = st.checkbox(
+        "Jalankan tahap secara tumpang tindih (pipeline)", value=config.PIPELINE_ENABLED,
+        disabled=(selected_mode_ui_val != "page"), key="pipeline_toggle_widget_main"
+    )
+    enable_profiling_ui_val = st.checkbox("Tampilkan profil waktu per stage", value=False, key="profiling_toggle_widget_main")
     
     process_button_ui_val = st.button("🚀 Mulai Proses Ekstraksi", type="primary", disabled=(not uploaded_pdf_file_obj_ui))
 
@@ -40,27 +69,43 @@ with st.sidebar:
 if process_button_ui_val and uploaded_pdf_file_obj_ui:
     if not model_ssd_loaded_global or not model_char_classifier_loaded_global:
         st.error("Model AI tidak berhasil dimuat. Proses tidak dapat dilanjutkan. Periksa pesan error di konsol atau di atas saat aplikasi pertama kali dimuat.")
+    elif config.JOB_QUEUE_ENABLED:
+        # Upload langsung dikembalikan sebagai ID job; hasil diambil lewat polling di bawah
+        st.session_state.active_job_id = job_queue.submit_job(
+            uploaded_pdf_file_obj_ui.getvalue(), uploaded_pdf_file_obj_ui.name, selected_gender_ui_val,
+            extraction_mode=selected_mode_ui_val, use_pipeline=use_pipeline_ui_val, profile=enable_profiling_ui_val
+        )
+        st.session_state.processed_pdf_name = uploaded_pdf_file_obj_ui.name
+        st.session_state.processed_gender = selected_gender_ui_val
+        st.rerun()
     else:
         with st.container(): 
             st.info("Memulai proses ekstraksi... Mohon tunggu.")
             
             pdf_bytes_data_main = uploaded_pdf_file_obj_ui.getvalue() 
             
+            profiler_main = profiling.ExtractionProfiler(label=uploaded_pdf_file_obj_ui.name) if enable_profiling_ui_val else None
+
             # Panggil fungsi controller
             results_main, excel_buf_main = controller.run_extraction_workflow(
                 pdf_bytes_data_main, 
                 selected_gender_ui_val,
                 model_ssd_loaded_global,
                 model_char_classifier_loaded_global,
-                config.DEVICE
+                config.DEVICE,
+                extraction_mode=selected_mode_ui_val,
+                use_pipeline=use_pipeline_ui_val,
+                profiler=profiler_main
             )
             
-            # Simpan hasil ke session state untuk ditampilkan oleh View
-            st.session_state.all_results_data = results_main
+            # Simpan hasil ke session state untuk ditampilkan oleh View (hanya teks + thumbnail; crop penuh ada di Excel)
+            st.session_state.all_results_data = result_records.compact_results(results_main)
             st.session_state.excel_buffer_data = excel_buf_main
             st.session_state.current_page = 1 
             st.session_state.processed_pdf_name = uploaded_pdf_file_obj_ui.name
             st.session_state.processed_gender = selected_gender_ui_val
+            st.session_state.profile_data = profiler_main.to_dict() if profiler_main is not None else None
+            st.session_state.job_stats = None
             
             if results_main:
                 st.success("🎉 Proses ekstraksi selesai!")
@@ -68,6 +113,39 @@ if process_button_ui_val and uploaded_pdf_file_obj_ui:
                 st.warning("Proses ekstraksi selesai, namun tidak ada hasil yang ditemukan atau terjadi error saat pemrosesan.")
             st.rerun() # Rerun untuk membersihkan spinner dan menampilkan bagian hasil
 
+# --- Polling Job Antrian ---
+if st.session_state.active_job_id:
+    active_job = job_queue.get_job(st.session_state.active_job_id)
+    if active_job is None:
+        st.session_state.active_job_id = None
+        st.error("Job ekstraksi tidak ditemukan di antrian.")
+    elif active_job["status"] in ("queued", "running"):
+        if active_job["status"] == "queued":
+            st.info(f"Job `{active_job['id']}` menunggu di antrian (posisi {active_job.get('queue_position', 1)}).")
+        st.progress(active_job["progress"] or 0.0, text=active_job["progress_text"] or "Memproses...")
+        if st.button("Batalkan job", key="cancel_job_button_main"):
+            job_queue.cancel_job(active_job["id"])
+        time.sleep(config.JOB_UI_POLL_INTERVAL_S)
+        st.rerun()
+    else:
+        st.session_state.active_job_id = None
+        if active_job["status"] == "done":
+            job_result = job_queue.get_job_result(active_job["id"])
+            results_main, excel_bytes_main = job_result if job_result is not None else ([], None)
+            st.session_state.all_results_data = result_records.compact_results(results_main)
+            st.session_state.excel_buffer_data = io.BytesIO(excel_bytes_main) if excel_bytes_main else None
+            st.session_state.current_page = 1
+            st.session_state.profile_data = active_job["profile_data"]
+            st.session_state.job_stats = active_job["stats"]
+            if results_main:
+                st.success("🎉 Proses ekstraksi selesai!")
+            else:
+                st.warning("Proses ekstraksi selesai, namun tidak ada hasil yang ditemukan.")
+        elif active_job["status"] == "failed":
+            st.error(active_job["error"] or "Job ekstraksi gagal.")
+        else:
+            st.warning("Job ekstraksi dibatalkan.")
+
 
 # --- Tampilan Hasil dan Paginasi ---
 if st.session_state.all_results_data:
@@ -82,8 +160,38 @@ if st.session_state.all_results_data:
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
             key="download_excel_button_top_view_main" 
         )
+        st.download_button(
+            label="📥 Unduh Teks Hasil (CSV, tanpa gambar)",
+            data=model.create_tabular_report(st.session_state.all_results_data, "csv").getvalue(),
+            file_name=f"hasil_ekstraksi_{st.session_state.processed_gender}_{st.session_state.processed_pdf_name}.csv",
+            mime="text/csv",
+            key="download_csv_button_top_view_main"
+        )
         st.markdown("---") 
 
+    if st.session_state.job_stats:
+        if st.session_state.job_stats.get("from_cache"):
+            st.caption("Hasil diambil dari cache (PDF ini sudah pernah diproses dengan pengaturan yang sama).")
+        else:
+            controller.show_document_stats(st.session_state.job_stats)
+
+    if st.session_state.profile_data:
+        with st.expander("⏱️ Profil Waktu Ekstraksi"):
+            profile_data_main = st.session_state.profile_data
+            st.write(f"**Total:** {profile_data_main['total_s']:.2f} detik")
+            st.table([
+                {"Stage": stage_name, "Waktu (s)": f"{stage_info['total_s']:.3f}",
+                 "Panggilan": stage_info["calls"], "% Total": f"{stage_info['pct_of_total']:.1f}"}
+                for stage_name, stage_info in profile_data_main["stages"].items()
+            ])
+            st.write("**Penghitung:**")
+            st.json(profile_data_main["counters"])
+            st.download_button(
+                label="📥 Unduh Profil (JSON)", data=json.dumps(profile_data_main, indent=2, default=str),
+                file_name=f"profil_{st.session_state.processed_pdf_name}.json", mime="application/json",
+                key="download_profile_button_main"
+            )
+
     total_items_main = len(st.session_state.all_results_data)
     total_pages_main = (total_items_main + config.ITEMS_PER_PAGE - 1) // config.ITEMS_PER_PAGE
 
@@ -114,7 +222,8 @@ if st.session_state.all_results_data:
             st.markdown(f"**Data ke-{start_idx_main + res_idx_main + 1}**")
             col1_view_main, col2_view_main = st.columns([1,2]) 
             with col1_view_main:
-                st.image(res_data_item_main["Image_PIL"], width=200, caption=f"Pertanyaan (ID): {res_data_item_main['ID_Pertanyaan']}") 
+                if res_data_item_main.get("Thumbnail_PNG") is not None:
+                    st.image(res_data_item_main["Thumbnail_PNG"], width=200, caption=f"Pertanyaan (ID): {res_data_item_main['ID_Pertanyaan']}") 
             with col2_view_main:
                 st.write(f"**ID Pertanyaan:** {res_data_item_main['ID_Pertanyaan']}") 
                 st.write(f"**Halaman:** {res_data_item_main['Halaman']}")
@@ -135,4 +244,18 @@ elif process_button_ui_val and not uploaded_pdf_file_obj_ui:
 
 
 st.sidebar.markdown("---")
+with st.sidebar.expander("ℹ️ Status Model"):
+    for model_key, model_stats in model_registry.get_registry_stats().items():
+        st.caption(f"{model_key} ({model_stats['backend']}): muat {model_stats['load_time_s']:.2f}s, warmup {model_stats['warmup_time_s']:.2f}s")
+with st.sidebar.expander("🗄️ Cache Hasil"):
+    cache_stats_ui = result_cache.get_cache_stats()
+    st.caption(f"Dokumen: {cache_stats_ui['documents']['entries']} ({cache_stats_ui['documents']['bytes'] / 1024 ** 2:.1f} MB), "
+               f"area: {cache_stats_ui['fields']['entries']}")
+    if st.button("Bersihkan cache", key="clear_cache_button_main"):
+        result_cache.clear_cache()
+        st.rerun()
+if config.JOB_QUEUE_ENABLED:
+    with st.sidebar.expander("📋 Antrian Job"):
+        queue_stats_ui = job_queue.get_queue_stats()
+        st.caption(", ".join(f"{status}: {queue_stats_ui[status]}" for status in job_queue.JOB_STATUSES))
 st.sidebar.info("Aplikasi ini dibuat untuk mendemonstrasikan ekstraksi data dari kuesioner menggunakan AI.")
@@ -0,0 +1,395 @@
+# backends.py
+# Backend inferensi alternatif untuk CPU: kuantisasi int8 (dinamis/statis),
+# TorchScript, dan ONNX Runtime untuk model SSD maupun klasifikasi karakter.
+# Artefak disimpan di BACKEND_ARTIFACT_DIR dan dimuat lewat model_registry.
+#
+# Contoh:
+#   python backends.py build --backend static_int8 --pdf data/contoh/*.pdf --gender pria
+#   python backends.py compare --pdf data/contoh/*.pdf --gender pria --backends dynamic_int8 static_int8 onnx
+
+import os
+import sys
+import copy
+import json
+import time
+import argparse
+import warnings
+import torch
+import torch.nn as nn
+import model
+import result_cache
+import config # Import file config
+
+MODEL_NAMES = ("ssd", "char_classifier")
+# Backend yang membutuhkan file artefak (selain eager dan dynamic_int8 yang dibuat saat dimuat)
+ARTIFACT_BACKENDS = ("static_int8", "torchscript", "onnx")
+
+class SSDCore(nn.Module):
+    """Backbone + head SSD (bagian terberat) dengan output tensor, agar bisa di-trace, dikuantisasi, atau diekspor."""
+    def __init__(self, model_ssd):
+        super().__init__()
+        self.backbone = model_ssd.backbone
+        self.head = model_ssd.head
+
+    def forward(self, images_tensor):
+        features = list(self.backbone(images_tensor).values())
+        head_outputs = self.head(features)
+        return head_outputs["bbox_regression"], head_outputs["cls_logits"]
+
+class SSDRunner(nn.Module):
+    """
+    Pengganti model SSD dengan antarmuka yang sama (list tensor -> list dict kotak).
+    Transformasi, anchor, dan post-processing tetap memakai modul torchvision fp32;
+    hanya `core` (backbone + head) yang diganti versi int8/TorchScript/ONNX.
+    """
+    def __init__(self, model_ssd, core):
+        super().__init__()
+        self.model_ssd = model_ssd
+        self.core = core
+        # Ukuran feature map selalu sama karena input di-resize ke SSD_INPUT_SIZE
+        with torch.no_grad():
+            dummy_input = torch.zeros(1, 3, *config.SSD_INPUT_SIZE, device=next(model_ssd.parameters()).device)
+            self._feature_shapes = [tuple(f.shape[-2:]) for f in model_ssd.backbone(dummy_input).values()]
+
+    def forward(self, images):
+        original_image_sizes = [tuple(img.shape[-2:]) for img in images]
+        image_list, _ = self.model_ssd.transform(images)
+        bbox_regression, cls_logits = self.core(image_list.tensors)
+        # Anchor generator hanya membutuhkan ukuran, dtype, dan device feature map
+        feature_stubs = [image_list.tensors.new_empty((1, 0, h, w)) for h, w in self._feature_shapes]
+        anchors = self.model_ssd.anchor_generator(image_list, feature_stubs)
+        detections = self.model_ssd.postprocess_detections(
+            {"bbox_regression": bbox_regression, "cls_logits": cls_logits}, anchors, image_list.image_sizes
+        )
+        return self.model_ssd.transform.postprocess(detections, image_list.image_sizes, original_image_sizes)
+
+class OnnxModule(nn.Module):
+    """Sesi ONNX Runtime (CPU) yang bisa dipanggil seperti modul torch: tensor masuk, tensor keluar."""
+    def __init__(self, onnx_path):
+        super().__init__()
+        import onnxruntime as ort
+        session_options = ort.SessionOptions()
+        # Ikuti jumlah thread torch agar --torch-threads di CLI batch juga berlaku di sini
+        session_options.intra_op_num_threads = torch.get_num_threads()
+        self.session = ort.InferenceSession(onnx_path, session_options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def forward(self, input_tensor):
+        outputs = self.session.run(None, {self.input_name: input_tensor.detach().cpu().numpy()})
+        output_tensors = tuple(torch.from_numpy(output) for output in outputs)
+        return output_tensors[0] if len(output_tensors) == 1 else output_tensors
+
+def _select_quantized_engine():
+    # x86/fbgemm untuk CPU Intel/AMD, qnnpack untuk ARM
+    for engine in ("x86", "fbgemm", "qnnpack"):
+        if engine in torch.backends.quantized.supported_engines:
+            torch.backends.quantized.engine = engine
+            return engine
+    raise RuntimeError("Tidak ada engine kuantisasi yang didukung di platform ini.")
+
+def get_artifact_path(model_name, backend):
+    # Nama file memuat hash bobot fp32 sehingga artefak lama tidak terpakai setelah model dilatih ulang
+    weights_path = config.SSD_MODEL_PATH if model_name == "ssd" else config.CHAR_CLASSIFIER_MODEL_PATH
+    weights_hash = result_cache.file_sha256(weights_path)[:12]
+    extension = ".onnx" if backend == "onnx" else ".pt"
+    return os.path.join(config.BACKEND_ARTIFACT_DIR, f"{model_name}_{backend}_{weights_hash}{extension}")
+
+def get_backend_fingerprint(backend=None, device_obj=None):
+    # Identitas backend untuk kunci cache hasil: backend yang benar-benar dipakai tiap model
+    # (apply_backend bisa jatuh ke eager) + hash artefaknya
+    import model_registry # Import lokal: model_registry mengimpor modul ini
+    if backend is None: backend = config.INFERENCE_BACKEND
+    effective_backends = model_registry.get_effective_backends(device_obj, backend)
+    if None in effective_backends:
+        # Model belum dimuat di proses ini; muat dulu agar backend efektifnya diketahui
+        model_registry.get_models(device_obj, backend)
+        effective_backends = model_registry.get_effective_backends(device_obj, backend)
+    model_fingerprints = []
+    for model_name, effective_backend in zip(MODEL_NAMES, effective_backends):
+        if effective_backend in ARTIFACT_BACKENDS:
+            artifact_hash = result_cache.file_sha256(get_artifact_path(model_name, effective_backend))[:12]
+            model_fingerprints.append(f"{model_name}={effective_backend}:{artifact_hash}")
+        else:
+            model_fingerprints.append(f"{model_name}={effective_backend}")
+    return ",".join(model_fingerprints)
+
+def _inference_core(model_name, fp32_model):
+    return SSDCore(fp32_model).eval() if model_name == "ssd" else fp32_model.eval()
+
+def _wrap_core(model_name, fp32_model, core):
+    return SSDRunner(fp32_model, core).eval() if model_name == "ssd" else core
+
+def _example_input(model_name, batch_size=2):
+    input_size = config.SSD_INPUT_SIZE if model_name == "ssd" else config.CHAR_IMAGE_SIZE
+    return torch.zeros(batch_size, 3, *input_size)
+
+def build_torchscript(model_name, fp32_model):
+    core = _inference_core(model_name, copy.deepcopy(fp32_model).cpu())
+    with warnings.catch_warnings(), torch.no_grad():
+        warnings.simplefilter("ignore")
+        return torch.jit.trace(core, _example_input(model_name), check_trace=False)
+
+def build_static_int8(model_name, fp32_model, calibration_batches):
+    """
+    Kuantisasi statis int8 (FX graph mode): observer dipasang, batch kalibrasi
+    dijalankan untuk mengukur rentang aktivasi, lalu model dikonversi dan di-trace.
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+    engine = _select_quantized_engine()
+    core = _inference_core(model_name, copy.deepcopy(fp32_model).cpu())
+    example_input = _example_input(model_name)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        prepared = prepare_fx(core, get_default_qconfig_mapping(engine), (example_input,))
+        num_batches = 0
+        with torch.no_grad():
+            for calibration_batch in calibration_batches:
+                prepared(calibration_batch)
+                num_batches += 1
+        if num_batches == 0: raise ValueError(f"Tidak ada data kalibrasi untuk model '{model_name}'.")
+        quantized = convert_fx(prepared)
+        with torch.no_grad():
+            return torch.jit.trace(quantized, example_input, check_trace=False)
+
+def export_onnx(model_name, fp32_model, output_path):
+    core = _inference_core(model_name, copy.deepcopy(fp32_model).cpu())
+    output_names = ["bbox_regression", "cls_logits"] if model_name == "ssd" else ["logits"]
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        torch.onnx.export(
+            core, (_example_input(model_name),), output_path, input_names=["input"], output_names=output_names,
+            dynamic_axes={name: {0: "batch"} for name in ["input"] + output_names},
+            opset_version=config.ONNX_OPSET, dynamo=False,
+        )
+
+def collect_calibration_crops(pdf_paths, selected_gender_str, model_s, device_obj, extraction_mode=None,
+                              max_fields=None, max_chars=None):
+    """
+    Ambil crop area dan crop karakter dari PDF contoh dengan alur yang sama seperti
+    ekstraksi (render layout anotasi, deteksi SSD fp32, crop karakter).
+    Mengembalikan (list gambar area, list gambar karakter).
+    """
+    import extraction
+    import layout
+    if max_fields is None: max_fields = config.BACKEND_CALIBRATION_MAX_FIELDS
+    if max_chars is None: max_chars = config.BACKEND_CALIBRATION_MAX_CHARS
+    annotation_layout = layout.load_layout_for_gender(selected_gender_str)
+    if annotation_layout is None:
+        raise extraction.ExtractionError(f"File anotasi untuk gender '{selected_gender_str}' tidak ditemukan.")
+
+    field_images = []
+    for pdf_path in pdf_paths:
+        with open(pdf_path, "rb") as f:
+            pdf_bytes = f.read()
+        rendered_images, _, _ = extraction.render_field_images(pdf_bytes, annotation_layout, extraction_mode)
+        field_images += [img for img in rendered_images if img is not None]
+        if len(field_images) >= max_fields: break
+    field_images = field_images[:max_fields]
+    char_boxes_per_field = model.model_detect_chars_batch(field_images, model_s, device_obj, model.get_ssd_transform())
+    char_images, _ = extraction.collect_char_crops(field_images, char_boxes_per_field)
+    return field_images, char_images[:max_chars]
+
+def iter_calibration_batches(model_name, fp32_ssd, images, batch_size=32):
+    # Tensor input core model persis seperti saat inferensi (setelah transformasi internal SSD)
+    if model_name == "ssd":
+        transform_ssd = model.get_ssd_transform()
+        ssd_device = next(fp32_ssd.parameters()).device
+        for start_idx in range(0, len(images), batch_size):
+            field_tensors = [model.model_preprocess_field_for_ssd(img, transform_ssd).to(ssd_device) for img in images[start_idx:start_idx + batch_size]]
+            with torch.no_grad():
+                yield fp32_ssd.transform(field_tensors)[0].tensors.cpu()
+    else:
+        for start_idx in range(0, len(images), batch_size):
+            yield model._chars_to_tensor(images[start_idx:start_idx + batch_size])
+
+def load_fp32_models(device_obj=None):
+    if device_obj is None: device_obj = torch.device("cpu")
+    return {
+        "ssd": model.load_ssd_model(config.SSD_MODEL_PATH, config.SSD_NUM_CLASSES, device_obj),
+        "char_classifier": model.load_char_classifier_model(config.CHAR_CLASSIFIER_MODEL_PATH, config.CHAR_NUM_CLASSES, device_obj),
+    }
+
+def build_artifacts(backend, model_names=MODEL_NAMES, fp32_models=None, calibration_images=None):
+    """
+    Buat artefak backend untuk model yang diminta. `calibration_images` wajib untuk
+    static_int8: dict {"ssd": list gambar area, "char_classifier": list gambar karakter}
+    (lihat collect_calibration_crops). Mengembalikan dict {nama_model: path artefak}.
+    """
+    if backend not in ARTIFACT_BACKENDS: raise ValueError(f"Backend '{backend}' tidak memakai artefak.")
+    if fp32_models is None: fp32_models = load_fp32_models()
+    os.makedirs(config.BACKEND_ARTIFACT_DIR, exist_ok=True)
+    written_paths = {}
+    for model_name in model_names:
+        fp32_model = fp32_models[model_name]
+        if fp32_model is None: raise ValueError(f"Model fp32 '{model_name}' tidak berhasil dimuat.")
+        artifact_path = get_artifact_path(model_name, backend)
+        # Tulis ke file sementara lalu rename agar proses lain tidak membaca artefak setengah jadi
+        temp_path = f"{artifact_path}.{os.getpid()}.tmp"
+        if backend == "onnx":
+            export_onnx(model_name, fp32_model, temp_path)
+        elif backend == "torchscript":
+            torch.jit.save(build_torchscript(model_name, fp32_model), temp_path)
+        else:
+            if not calibration_images or not calibration_images.get(model_name):
+                raise ValueError(f"static_int8 membutuhkan crop kalibrasi untuk model '{model_name}'.")
+            calibration_batches = iter_calibration_batches(model_name, fp32_models.get("ssd"), calibration_images[model_name])
+            torch.jit.save(build_static_int8(model_name, fp32_model, calibration_batches), temp_path)
+        os.replace(temp_path, artifact_path)
+        written_paths[model_name] = artifact_path
+        print(f"Artefak {backend} untuk '{model_name}' disimpan di: {artifact_path}")
+    return written_paths
+
+def apply_backend(model_name, fp32_model, backend, device_obj):
+    """
+    Bungkus model fp32 dengan backend yang diminta. Artefak torchscript/onnx yang
+    belum ada dibuat otomatis; static_int8 membutuhkan kalibrasi (`python backends.py
+    build`), jadi tanpa artefak kembali ke eager. Mengembalikan (model, backend efektif).
+    """
+    if fp32_model is None or backend in (None, "eager"): return fp32_model, "eager"
+    if backend not in config.INFERENCE_BACKENDS:
+        print(f"Backend inferensi tidak dikenal: {backend}. Memakai eager.")
+        return fp32_model, "eager"
+    if device_obj.type != "cpu" and backend in ("dynamic_int8", "static_int8", "onnx"):
+        print(f"Backend '{backend}' hanya untuk CPU; '{model_name}' di {device_obj} memakai eager.")
+        return fp32_model, "eager"
+    try:
+        if backend == "dynamic_int8":
+            # Kuantisasi dinamis hanya berlaku untuk nn.Linear; SSD tidak punya layer Linear
+            if model_name == "ssd": return fp32_model, "eager"
+            _select_quantized_engine()
+            return torch.ao.quantization.quantize_dynamic(copy.deepcopy(fp32_model), {nn.Linear}, dtype=torch.qint8).eval(), backend
+
+        artifact_path = get_artifact_path(model_name, backend)
+        if not os.path.exists(artifact_path):
+            if backend == "static_int8":
+                print(f"Artefak static_int8 '{model_name}' belum ada ({artifact_path}); jalankan 'python backends.py build'. Memakai eager.")
+                return fp32_model, "eager"
+            build_artifacts(backend, model_names=(model_name,), fp32_models={model_name: fp32_model})
+
+        if backend == "onnx":
+            core = OnnxModule(artifact_path)
+        else:
+            if backend == "static_int8": _select_quantized_engine()
+            core = torch.jit.freeze(torch.jit.load(artifact_path, map_location=device_obj).eval())
+        return _wrap_core(model_name, fp32_model, core), backend
+    except Exception as e_backend:
+        print(f"Gagal memuat backend '{backend}' untuk '{model_name}': {e_backend}. Memakai eager.")
+        return fp32_model, "eager"
+
+def edit_distance(text_a, text_b):
+    previous_row = list(range(len(text_b) + 1))
+    for i, char_a in enumerate(text_a, 1):
+        current_row = [i]
+        for j, char_b in enumerate(text_b, 1):
+            current_row.append(min(previous_row[j] + 1, current_row[j - 1] + 1, previous_row[j - 1] + (char_a != char_b)))
+        previous_row = current_row
+    return previous_row[-1]
+
+def compare_backends(pdf_paths, selected_gender_str, backend_names, extraction_mode=None, max_char_error_rate=None):
+    """
+    Bandingkan akurasi vs latensi di CPU. Area setiap PDF dirender sekali, lalu
+    deteksi + klasifikasi dijalankan dengan tiap backend (cache area dimatikan).
+    Teks dibandingkan dengan baseline eager fp32; rasio karakter berbeda = jarak
+    edit / jumlah karakter fp32. Mengembalikan list dict ringkasan per backend.
+    """
+    import extraction
+    import layout
+    if max_char_error_rate is None: max_char_error_rate = config.BACKEND_MAX_CHAR_ERROR_RATE
+    device_obj = torch.device("cpu")
+    annotation_layout = layout.load_layout_for_gender(selected_gender_str)
+    if annotation_layout is None:
+        raise extraction.ExtractionError(f"File anotasi untuk gender '{selected_gender_str}' tidak ditemukan.")
+
+    field_images_per_doc = []
+    for pdf_path in pdf_paths:
+        with open(pdf_path, "rb") as f:
+            pdf_bytes = f.read()
+        rendered_images, _, _ = extraction.render_field_images(pdf_bytes, annotation_layout, extraction_mode)
+        field_images_per_doc.append([img for img in rendered_images if img is not None])
+    return compare_backends_on_fields(field_images_per_doc, backend_names, device_obj, max_char_error_rate)
+
+def compare_backends_on_fields(field_images_per_doc, backend_names, device_obj, max_char_error_rate):
+    import extraction
+    import model_registry
+    field_cache_enabled = config.FIELD_CACHE_ENABLED
+    config.FIELD_CACHE_ENABLED = False
+    try:
+        backend_names = ["eager"] + [name for name in backend_names if name != "eager"]
+        strings_per_backend = {}
+        summaries = []
+        for backend in backend_names:
+            model_s, model_c = model_registry.get_models(device_obj, backend)
+            effective_backends = model_registry.get_effective_backends(device_obj, backend)
+            doc_times_s = []
+            backend_strings = []
+            for field_images in field_images_per_doc:
+                start_time = time.perf_counter()
+                recognized_strings, _, _, _ = extraction.recognize_fields(field_images, model_s, model_c, device_obj)
+                doc_times_s.append(time.perf_counter() - start_time)
+                backend_strings += recognized_strings
+            strings_per_backend[backend] = backend_strings
+
+            baseline_strings = strings_per_backend["eager"]
+            total_chars = sum(len(text) for text in baseline_strings)
+            total_errors = sum(edit_distance(text, baseline_text) for text, baseline_text in zip(backend_strings, baseline_strings))
+            char_error_rate = total_errors / total_chars if total_chars > 0 else 0.0
+            mean_doc_s = sum(doc_times_s) / len(doc_times_s) if doc_times_s else 0.0
+            summaries.append({
+                "backend": backend, "effective": effective_backends, "mean_doc_s": round(mean_doc_s, 4),
+                "fields": len(backend_strings),
+                "fields_identical_pct": round(100.0 * sum(a == b for a, b in zip(backend_strings, baseline_strings)) / max(1, len(backend_strings)), 2),
+                "char_error_rate": round(char_error_rate, 5), "within_tolerance": char_error_rate <= max_char_error_rate,
+            })
+        baseline_s = summaries[0]["mean_doc_s"]
+        for summary in summaries:
+            summary["speedup"] = round(baseline_s / summary["mean_doc_s"], 2) if summary["mean_doc_s"] > 0 else None
+        return summaries
+    finally:
+        config.FIELD_CACHE_ENABLED = field_cache_enabled
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Buat dan bandingkan backend inferensi (int8, TorchScript, ONNX).")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Buat artefak backend (kalibrasi untuk static_int8)")
+    build_parser.add_argument("--backend", required=True, choices=ARTIFACT_BACKENDS)
+    build_parser.add_argument("--pdf", nargs="*", default=[], help="PDF contoh untuk kalibrasi static_int8")
+    build_parser.add_argument("--gender", default="pria", choices=["pria", "perempuan"])
+    build_parser.add_argument("--mode", default=config.EXTRACTION_MODE, choices=config.EXTRACTION_MODES)
+    compare_parser = subparsers.add_parser("compare", help="Bandingkan akurasi vs latensi terhadap fp32")
+    compare_parser.add_argument("--pdf", nargs="+", required=True, help="PDF uji")
+    compare_parser.add_argument("--gender", default="pria", choices=["pria", "perempuan"])
+    compare_parser.add_argument("--mode", default=config.EXTRACTION_MODE, choices=config.EXTRACTION_MODES)
+    compare_parser.add_argument("--backends", nargs="+", default=config.INFERENCE_BACKENDS, choices=config.INFERENCE_BACKENDS)
+    compare_parser.add_argument("--tolerance", type=float, default=config.BACKEND_MAX_CHAR_ERROR_RATE, help="Rasio karakter berbeda maksimum")
+    compare_parser.add_argument("--output", default=None, help="Simpan ringkasan sebagai JSON")
+    return parser
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    if args.command == "build":
+        fp32_models = load_fp32_models()
+        calibration_images = None
+        if args.backend == "static_int8":
+            if not args.pdf:
+                print("static_int8 membutuhkan --pdf untuk kalibrasi.")
+                return 1
+            field_images, char_images = collect_calibration_crops(args.pdf, args.gender, fp32_models["ssd"], torch.device("cpu"), args.mode)
+            print(f"Kalibrasi dengan {len(field_images)} crop area dan {len(char_images)} crop karakter.")
+            calibration_images = {"ssd": field_images, "char_classifier": char_images}
+        build_artifacts(args.backend, fp32_models=fp32_models, calibration_images=calibration_images)
+        return 0
+
+    summaries = compare_backends(args.pdf, args.gender, args.backends, args.mode, args.tolerance)
+    print(f"{'Backend':<14} {'Efektif (ssd/char)':<28} {'Detik/dok':>10} {'Speedup':>8} {'Identik %':>10} {'CER':>8}  OK")
+    for summary in summaries:
+        effective_str = "/".join(summary["effective"])
+        print(f"{summary['backend']:<14} {effective_str:<28} {summary['mean_doc_s']:>10.3f} {summary['speedup'] or 0:>8.2f} "
+              f"{summary['fields_identical_pct']:>10.2f} {summary['char_error_rate']:>8.4f}  {'ya' if summary['within_tolerance'] else 'TIDAK'}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(summaries, f, indent=2)
+    return 0 if all(summary["within_tolerance"] for summary in summaries) else 2
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,363 @@
+# batch_extract.py
+# CLI headless untuk mengekstraksi banyak PDF kuesioner sekaligus dengan process pool.
+#
+# Contoh:
+#   python batch_extract.py data/gelombang_1/ --gender pria --workers 4 --output hasil.json
+#   python batch_extract.py manifest.csv --gender-map gender_map.json --output hasil.csv
+
+import os
+import sys
+import csv
+import json
+import time
+import fnmatch
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import config # Import file config
+
+# State per proses worker (diisi oleh _init_worker)
+_worker_state = {}
+
+def load_gender_map(gender_map_path):
+    """
+    Baca pemetaan nama file -> gender. Format JSON {"pola_glob": "gender"} atau
+    CSV dengan kolom pattern,gender. Pola dicocokkan ke nama file (fnmatch).
+    """
+    if not gender_map_path: return []
+    if gender_map_path.lower().endswith(".json"):
+        with open(gender_map_path, "r") as f:
+            return list(json.load(f).items())
+    with open(gender_map_path, "r", newline="") as f:
+        return [(row["pattern"], row["gender"]) for row in csv.DictReader(f)]
+
+def resolve_gender(pdf_path, gender_map, default_gender):
+    file_name = os.path.basename(pdf_path)
+    for pattern, gender in gender_map:
+        if fnmatch.fnmatch(file_name, pattern) or fnmatch.fnmatch(pdf_path, pattern):
+            return gender
+    return default_gender
+
+def collect_documents(input_path, gender_map, default_gender):
+    """
+    Kumpulkan daftar (path_pdf, gender) dari direktori (dicari rekursif) atau
+    manifest. Manifest bisa CSV (kolom path dan opsional gender), JSON (list
+    objek {"path", "gender"} atau list path), atau teks satu path per baris.
+    Gender kosong diisi dari gender map lalu default.
+    """
+    entries = []
+    if os.path.isdir(input_path):
+        for root_dir, _, file_names in os.walk(input_path):
+            for file_name in sorted(file_names):
+                if file_name.lower().endswith(".pdf"):
+                    entries.append((os.path.join(root_dir, file_name), None))
+        entries.sort()
+    else:
+        base_dir = os.path.dirname(os.path.abspath(input_path))
+        lower_path = input_path.lower()
+        if lower_path.endswith(".csv"):
+            with open(input_path, "r", newline="") as f:
+                entries = [(row["path"], row.get("gender") or None) for row in csv.DictReader(f)]
+        elif lower_path.endswith(".json"):
+            with open(input_path, "r") as f:
+                manifest_data = json.load(f)
+            for manifest_item in manifest_data:
+                if isinstance(manifest_item, str): entries.append((manifest_item, None))
+                else: entries.append((manifest_item["path"], manifest_item.get("gender")))
+        else:
+            with open(input_path, "r") as f:
+                entries = [(line.strip(), None) for line in f if line.strip() and not line.startswith("#")]
+        # Path relatif di manifest dihitung dari lokasi manifest
+        entries = [(p if os.path.isabs(p) else os.path.join(base_dir, p), g) for p, g in entries]
+
+    return [(pdf_path, gender or resolve_gender(pdf_path, gender_map, default_gender)) for pdf_path, gender in entries]
+
+def _init_worker(device_str, torch_threads, inference_backend=None, template_grid_enabled=None, page_registration_enabled=None,
+                 adaptive_escalation_enabled=None, docs_in_flight=1):
+    # Setiap worker memuat model sekali lewat registry lalu memakainya untuk semua dokumen
+    import torch
+    import model_registry
+    if torch_threads: torch.set_num_threads(torch_threads)
+    # Diset di config agar kunci cache hasil di worker juga memakai backend ini
+    if inference_backend: config.INFERENCE_BACKEND = inference_backend
+    if template_grid_enabled is not None: config.TEMPLATE_GRID_ENABLED = template_grid_enabled
+    if page_registration_enabled is not None: config.PAGE_REGISTRATION_ENABLED = page_registration_enabled
+    if adaptive_escalation_enabled is not None: config.ADAPTIVE_ESCALATION_ENABLED = adaptive_escalation_enabled
+    device_obj = torch.device(device_str)
+    config.DEVICE = device_obj # Kunci cache memakai backend efektif model di device ini
+    _worker_state["device"] = device_obj
+    _worker_state["models"] = model_registry.get_models(device_obj)
+    # Beberapa dokumen bersamaan per worker berbagi satu scheduler agar batch inferensi lebih besar
+    _worker_state["docs_in_flight"] = max(1, int(docs_in_flight or 1))
+    _worker_state["scheduler"] = None
+    if _worker_state["docs_in_flight"] > 1 and None not in _worker_state["models"]:
+        import batch_scheduler
+        _worker_state["scheduler"] = batch_scheduler.InferenceScheduler(*_worker_state["models"], device_obj)
+
+def process_document(pdf_path, selected_gender_str, extraction_mode, use_pipeline=False,
+                     profile_dir=None, torch_trace=False, profile_name=None):
+    """
+    Ekstraksi satu PDF di worker; hasil tanpa gambar agar ringan dikirim antar proses.
+    Jika profile_dir diberikan, profil waktu per stage disimpan sebagai
+    <profile_name>.profile.json (dan trace torch jika torch_trace); profile_name
+    default nama file PDF (lihat _profile_names untuk nama unik per batch).
+    """
+    import extraction
+    import result_cache
+    import profiling
+    profiler = profiling.ExtractionProfiler(label=pdf_path) if profile_dir else None
+    if profile_name is None: profile_name = os.path.basename(pdf_path)
+    torch_trace_path = None
+    if profile_dir and torch_trace:
+        torch_trace_path = os.path.join(profile_dir, profile_name + ".trace.json")
+    start_time = time.perf_counter()
+    doc_result = {"path": pdf_path, "gender": selected_gender_str, "status": "ok", "error": None, "results": []}
+    try:
+        model_s, model_c = _worker_state["models"]
+        if model_s is None or model_c is None:
+            raise extraction.ExtractionError("Model AI tidak berhasil dimuat di worker.")
+        with open(pdf_path, "rb") as f:
+            pdf_bytes = f.read()
+        document_key = result_cache.compute_document_key(pdf_bytes, selected_gender_str, extraction_mode)
+        cached_document = result_cache.get_document(document_key)
+        if cached_document is not None:
+            doc_result["results"] = extraction.strip_result_images(cached_document[0])
+            doc_result["cached"] = True
+        else:
+            with profiling.torch_trace(profiler, torch_trace_path):
+                results_data, document_stats = extraction.extract_document(
+                    pdf_bytes, selected_gender_str, model_s, model_c, _worker_state["device"],
+                    extraction_mode=extraction_mode, use_pipeline=use_pipeline, profiler=profiler,
+                    scheduler=_worker_state.get("scheduler"), document_tag=pdf_path
+                )
+            result_cache.put_document(document_key, results_data)
+            doc_result["results"] = extraction.strip_result_images(results_data)
+            doc_result["stats"] = document_stats
+    except Exception as e:
+        doc_result["status"] = "error"
+        doc_result["error"] = str(e)
+    doc_result["elapsed_s"] = time.perf_counter() - start_time
+    if profiler is not None:
+        profiler.finish()
+        profiler.metadata.update({"gender": selected_gender_str, "extraction_mode": extraction_mode, "use_pipeline": use_pipeline})
+        profiler.to_json(os.path.join(profile_dir, profile_name + ".profile.json"))
+        doc_result["profile"] = profiler.to_dict()
+    return doc_result
+
+def process_document_group(document_specs, extraction_mode, use_pipeline=False, profile_dir=None, torch_trace=False):
+    """
+    Proses beberapa dokumen bersamaan (thread) di satu worker agar scheduler dapat
+    mengemas area dan karakter lintas dokumen ke batch bersama. `document_specs`
+    berisi (path PDF, gender, nama file profil). Mengembalikan
+    (list hasil dokumen, statistik scheduler worker ini, pid worker).
+    """
+    with ThreadPoolExecutor(max_workers=_worker_state["docs_in_flight"]) as executor:
+        doc_results = list(executor.map(
+            lambda document_spec: process_document(document_spec[0], document_spec[1], extraction_mode, use_pipeline, profile_dir, torch_trace,
+                                                   document_spec[2]),
+            document_specs
+        ))
+    scheduler = _worker_state.get("scheduler")
+    return doc_results, scheduler.get_stats() if scheduler is not None else None, os.getpid()
+
+def _profile_names(documents):
+    # Nama file profil unik per dokumen: path relatif terhadap folder bersama semua PDF ("/" menjadi "__"),
+    # agar PDF bernama sama di folder berbeda tidak saling menimpa
+    pdf_paths = [os.path.abspath(pdf_path) for pdf_path, _ in documents]
+    try:
+        common_dir = os.path.commonpath([os.path.dirname(pdf_path) for pdf_path in pdf_paths]) if pdf_paths else ""
+    except ValueError: # Drive berbeda (Windows)
+        common_dir = None
+    profile_names = []
+    used_names = set()
+    for doc_idx, pdf_path in enumerate(pdf_paths):
+        relative_path = os.path.relpath(pdf_path, common_dir) if common_dir is not None else pdf_path.replace(":", "")
+        profile_name = relative_path.replace(os.sep, "__").replace("/", "__")
+        if profile_name in used_names: profile_name = f"{doc_idx:05d}__{profile_name}" # PDF yang sama muncul dua kali di manifest
+        used_names.add(profile_name)
+        profile_names.append(profile_name)
+    return profile_names
+
+def _merge_scheduler_stats(scheduler_stats_per_worker):
+    # Gabungkan statistik kumulatif terakhir tiap worker menjadi ringkasan per batcher
+    merged_stats = {}
+    for worker_stats in scheduler_stats_per_worker.values():
+        for batcher_name, batcher_stats in worker_stats.items():
+            merged = merged_stats.setdefault(batcher_name, {"items": 0, "batches": 0, "full_batches": 0, "docs_in_batches": 0.0})
+            merged["items"] += batcher_stats["items"]
+            merged["batches"] += batcher_stats["batches"]
+            merged["full_batches"] += batcher_stats["full_batches"]
+            merged["docs_in_batches"] += batcher_stats["avg_docs_per_batch"] * batcher_stats["batches"]
+    for merged in merged_stats.values():
+        merged["avg_batch_size"] = round(merged["items"] / merged["batches"], 2) if merged["batches"] else 0.0
+        merged["avg_docs_per_batch"] = round(merged.pop("docs_in_batches") / merged["batches"], 2) if merged["batches"] else 0.0
+    return merged_stats
+
+def _iter_combined_rows(doc_results):
+    # Baris per area (dengan kolom Dokumen) untuk laporan gabungan; dokumen gagal ditulis sebagai satu baris error
+    for doc_result in doc_results:
+        if doc_result["status"] != "ok":
+            yield {"ID_Pertanyaan": "", "Halaman": "", "Teks": doc_result["error"], "Avg_Conf": "",
+                   "Dokumen": doc_result["path"], "Gender": doc_result["gender"], "Status": doc_result["status"]}
+        for res_data in doc_result["results"]:
+            yield dict(res_data, Dokumen=doc_result["path"], Gender=doc_result["gender"], Status=doc_result["status"])
+
+def write_combined_output(doc_results, output_path):
+    """
+    Tulis hasil gabungan sesuai ekstensi output: .json (satu objek per dokumen),
+    .csv (satu baris per area), .xlsx (workbook write-only/streaming, tanpa
+    gambar) atau .parquet (membutuhkan pandas + pyarrow).
+    """
+    lower_path = output_path.lower()
+    if lower_path.endswith(".csv"):
+        with open(output_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["File", "Gender", "Status", "ID_Pertanyaan", "Halaman", "Teks", "Avg_Conf"])
+            for doc_result in doc_results:
+                if doc_result["status"] != "ok":
+                    writer.writerow([doc_result["path"], doc_result["gender"], doc_result["status"], "", "", doc_result["error"], ""])
+                for res_data in doc_result["results"]:
+                    writer.writerow([doc_result["path"], doc_result["gender"], doc_result["status"],
+                                     res_data["ID_Pertanyaan"], res_data["Halaman"], res_data["Teks"], res_data["Avg_Conf"]])
+    elif lower_path.endswith(".xlsx"):
+        import model
+        model.write_excel_report(_iter_combined_rows(doc_results), output_path, write_only=True,
+                                 include_images=False, document_column=True)
+    elif lower_path.endswith(".parquet"):
+        import model
+        with open(output_path, "wb") as f:
+            f.write(model.create_tabular_report(_iter_combined_rows(doc_results), "parquet").getvalue())
+    else:
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(doc_results, f, ensure_ascii=False, indent=2, default=str)
+
+def _failed_doc_result(document, error):
+    # Hasil dokumen gagal yang tidak sempat dibuat worker (format sama dengan process_document)
+    return {"path": document[0], "gender": document[1], "status": "error", "error": error, "results": [], "elapsed_s": 0.0}
+
+def run_batch(documents, output_path, num_workers, extraction_mode, device_str, torch_threads=None, use_pipeline=False,
+              profile_dir=None, torch_trace=False, inference_backend=None, template_grid_enabled=None,
+              page_registration_enabled=None, adaptive_escalation_enabled=None, docs_in_flight=None):
+    """
+    Proses semua dokumen dengan process pool. Urutan output mengikuti urutan input.
+    Progres dan dokumen/detik dicetak setiap kali dokumen selesai. Dengan
+    docs_in_flight > 1, setiap worker memproses kelompok dokumen bersamaan dan
+    inferensinya dibatch lintas dokumen (lihat batch_scheduler.py).
+    """
+    if docs_in_flight is None: docs_in_flight = config.BATCH_DOCS_IN_FLIGHT
+    docs_in_flight = max(1, int(docs_in_flight))
+    num_workers = max(1, int(num_workers))
+    if torch_threads is None:
+        torch_threads = max(1, (os.cpu_count() or 1) // num_workers)
+    if profile_dir: os.makedirs(profile_dir, exist_ok=True)
+    profile_names = _profile_names(documents)
+    doc_results = [None] * len(documents)
+    start_time = time.perf_counter()
+    num_done = 0
+    num_failed = 0
+
+    # "spawn" agar setiap worker punya state torch/OpenMP sendiri yang bersih
+    mp_context = multiprocessing.get_context("spawn")
+    scheduler_stats_per_worker = {}
+    try:
+        with ProcessPoolExecutor(max_workers=num_workers, mp_context=mp_context,
+                                 initializer=_init_worker, initargs=(device_str, torch_threads, inference_backend, template_grid_enabled, page_registration_enabled,
+                                           adaptive_escalation_enabled, docs_in_flight)) as executor:
+            # Satu task berisi satu dokumen, atau satu kelompok dokumen jika batching lintas dokumen aktif
+            group_size = 2 * docs_in_flight if docs_in_flight > 1 else 1
+            doc_idx_groups = [list(range(start_idx, min(len(documents), start_idx + group_size))) for start_idx in range(0, len(documents), group_size)]
+            if docs_in_flight > 1:
+                futures = {
+                    executor.submit(process_document_group, [documents[doc_idx] + (profile_names[doc_idx],) for doc_idx in doc_idx_group], extraction_mode,
+                                    use_pipeline, profile_dir, torch_trace): doc_idx_group
+                    for doc_idx_group in doc_idx_groups
+                }
+            else:
+                futures = {
+                    executor.submit(process_document, documents[doc_idx_group[0]][0], documents[doc_idx_group[0]][1], extraction_mode,
+                                    use_pipeline, profile_dir, torch_trace, profile_names[doc_idx_group[0]]): doc_idx_group
+                    for doc_idx_group in doc_idx_groups
+                }
+            for future in as_completed(futures):
+                doc_idx_group = futures[future]
+                try:
+                    if docs_in_flight > 1:
+                        group_results, worker_scheduler_stats, worker_pid = future.result()
+                        if worker_scheduler_stats is not None: scheduler_stats_per_worker[worker_pid] = worker_scheduler_stats
+                    else:
+                        group_results = [future.result()]
+                except Exception as e:
+                    # Worker mati (mis. BrokenProcessPool) atau task gagal: dokumen kelompok ini dicatat gagal, batch lanjut
+                    group_results = [_failed_doc_result(documents[doc_idx], f"Worker gagal: {e}") for doc_idx in doc_idx_group]
+                for doc_idx, doc_result in zip(doc_idx_group, group_results):
+                    doc_results[doc_idx] = doc_result
+                    num_done += 1
+                    if doc_result["status"] != "ok": num_failed += 1
+                    elapsed_s = time.perf_counter() - start_time
+                    docs_per_sec = num_done / elapsed_s if elapsed_s > 0 else 0.0
+                    print(f"[{num_done}/{len(documents)}] {os.path.basename(doc_result['path'])} "
+                          f"({doc_result['status']}, {doc_result['elapsed_s']:.2f}s) "
+                          f"- {docs_per_sec:.2f} dok/detik", flush=True)
+    finally:
+        # Hasil dokumen yang sudah selesai tetap ditulis walaupun batch terhenti di tengah jalan
+        doc_results = [
+            doc_result if doc_result is not None else _failed_doc_result(documents[doc_idx], "Dokumen tidak selesai diproses.")
+            for doc_idx, doc_result in enumerate(doc_results)
+        ]
+        write_combined_output(doc_results, output_path)
+    elapsed_s = time.perf_counter() - start_time
+    summary = {
+        "documents": len(documents), "failed": num_failed, "elapsed_s": elapsed_s,
+        "docs_per_sec": len(documents) / elapsed_s if elapsed_s > 0 else 0.0, "workers": num_workers,
+        "docs_in_flight": docs_in_flight,
+    }
+    if scheduler_stats_per_worker:
+        summary["scheduler_stats"] = _merge_scheduler_stats(scheduler_stats_per_worker)
+        for batcher_name, batcher_stats in summary["scheduler_stats"].items():
+            print(f"Scheduler {batcher_name}: {batcher_stats['batches']} batch, rata-rata {batcher_stats['avg_batch_size']} item "
+                  f"dari {batcher_stats['avg_docs_per_batch']} dokumen per batch ({batcher_stats['full_batches']} batch penuh)")
+    print(f"Selesai: {summary['documents']} dokumen ({num_failed} gagal) dalam {elapsed_s:.1f}s "
+          f"= {summary['docs_per_sec']:.2f} dok/detik. Hasil: {output_path}")
+    return summary
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Ekstraksi batch PDF kuesioner tanpa UI.")
+    parser.add_argument("input", help="Direktori berisi PDF, atau manifest (.csv/.json/.txt)")
+    parser.add_argument("--output", "-o", default="hasil_ekstraksi_batch.json", help="File hasil gabungan (.json, .csv, .xlsx atau .parquet)")
+    parser.add_argument("--gender", default="pria", choices=["pria", "perempuan"], help="Gender default untuk layout anotasi")
+    parser.add_argument("--gender-map", default=None, help="Pemetaan pola nama file -> gender (.json atau .csv)")
+    parser.add_argument("--workers", "-w", type=int, default=config.BATCH_NUM_WORKERS, help="Jumlah proses worker")
+    parser.add_argument("--torch-threads", type=int, default=None, help="Thread torch per worker (default: CPU / workers)")
+    parser.add_argument("--mode", default=config.EXTRACTION_MODE, choices=config.EXTRACTION_MODES, help="Mode render PDF")
+    parser.add_argument("--pipeline", action="store_true", help="Jalankan tahap per dokumen secara tumpang tindih (mode page)")
+    parser.add_argument("--profile-dir", default=None, help="Simpan profil waktu per dokumen (JSON) ke direktori ini")
+    parser.add_argument("--torch-trace", action="store_true", help="Dengan --profile-dir, simpan juga trace torch.profiler")
+    parser.add_argument("--device", default=str(config.DEVICE), help="Device torch, mis. cpu atau cuda")
+    parser.add_argument("--backend", default=config.INFERENCE_BACKEND, choices=config.INFERENCE_BACKENDS,
+                        help="Backend inferensi (lihat backends.py; static_int8 perlu 'python backends.py build' dulu)")
+    parser.add_argument("--template-grid", action="store_true", default=None,
+                        help="Potong karakter dari grid anotasi (perlu 'python template_grid.py build' dulu), SSD hanya sebagai fallback")
+    parser.add_argument("--register-pages", action="store_true", default=None,
+                        help="Registrasi rotasi/skala/pergeseran per halaman sebelum crop (perlu 'python registration.py build' dulu)")
+    parser.add_argument("--docs-in-flight", type=int, default=config.BATCH_DOCS_IN_FLIGHT,
+                        help="Dokumen yang diproses bersamaan per worker; > 1 membatch deteksi/klasifikasi lintas dokumen")
+    parser.add_argument("--adaptive", action="store_true", default=None,
+                        help="Proses ulang area yang ragu dengan DPI tinggi, model fp32, dan TTA (lihat escalation.py)")
+    return parser
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    documents = collect_documents(args.input, load_gender_map(args.gender_map), args.gender)
+    if not documents:
+        print(f"Tidak ada PDF yang ditemukan di: {args.input}")
+        return 1
+    import model
+    model.cleanup_stale_workspaces()
+    print(f"Memproses {len(documents)} dokumen dengan {args.workers} worker (mode {args.mode}, backend {args.backend})...")
+    summary = run_batch(documents, args.output, args.workers, args.mode, args.device, args.torch_threads, args.pipeline,
+                        args.profile_dir, args.torch_trace, args.backend, args.template_grid,
+                        args.register_pages, args.adaptive, args.docs_in_flight)
+    return 0 if summary["failed"] == 0 else 2
+
+if __name__ == "__main__":
+    sys.exit(main())
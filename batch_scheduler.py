@@ -0,0 +1,194 @@
+# batch_scheduler.py
+# Batching dinamis lintas dokumen (seperti dynamic batching di server inferensi):
+# crop area dan crop karakter dari banyak dokumen yang sedang diproses bersamaan
+# dikumpulkan ke batch bersama per ember ukuran, lalu dikirim ke model saat batch
+# penuh atau saat item tertua sudah menunggu max_wait_s. Setiap item mendapat
+# Future sehingga hasilnya kembali ke dokumen dan area asalnya.
+
+import math
+import time
+import threading
+from concurrent.futures import Future
+import model
+import config # Import file config
+
+class BatchStats:
+    """Penghitung per batcher: ukuran batch yang tercapai, waktu tunggu item, dan dokumen per batch."""
+    def __init__(self, name, max_batch_size):
+        self.name = name
+        self.max_batch_size = max_batch_size
+        self.items = 0
+        self.batches = 0
+        self.full_batches = 0
+        self.errors = 0
+        self.busy_s = 0.0
+        self.wait_s_sum = 0.0
+        self.wait_s_max = 0.0
+        self.docs_per_batch_sum = 0
+        self.batch_size_histogram = {}
+        self._lock = threading.Lock()
+
+    def record_batch(self, batch_size, wait_times_s, num_docs, busy_s, failed=False):
+        with self._lock:
+            self.items += batch_size
+            self.batches += 1
+            if batch_size >= self.max_batch_size: self.full_batches += 1
+            if failed: self.errors += 1
+            self.busy_s += busy_s
+            self.wait_s_sum += sum(wait_times_s)
+            self.wait_s_max = max([self.wait_s_max] + list(wait_times_s))
+            self.docs_per_batch_sum += num_docs
+            # Histogram dalam ember pangkat dua (1, 2-3, 4-7, ...) agar ringkas
+            size_bucket = 2 ** int(math.log2(batch_size)) if batch_size > 0 else 0
+            self.batch_size_histogram[size_bucket] = self.batch_size_histogram.get(size_bucket, 0) + 1
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "batcher": self.name, "max_batch_size": self.max_batch_size, "items": self.items, "batches": self.batches,
+                "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+                "full_batches": self.full_batches, "errors": self.errors, "busy_s": round(self.busy_s, 4),
+                "avg_wait_ms": round(1000 * self.wait_s_sum / self.items, 2) if self.items else 0.0,
+                "max_wait_ms": round(1000 * self.wait_s_max, 2),
+                "avg_docs_per_batch": round(self.docs_per_batch_sum / self.batches, 2) if self.batches else 0.0,
+                "batch_size_histogram": {str(size): count for size, count in sorted(self.batch_size_histogram.items())},
+            }
+
+class DynamicBatcher:
+    """
+    Antrian item per ember (bucket_fn(payload), default satu ember) yang dilayani
+    thread dispatcher. `run_batch_fn` menerima list payload dan mengembalikan list
+    hasil sejajar. Batch dikirim jika satu ember mencapai max_batch_size, atau jika
+    item tertua sebuah ember sudah menunggu max_wait_s (ember tertua lebih dulu).
+    """
+    def __init__(self, name, run_batch_fn, max_batch_size, max_wait_s, bucket_fn=None, num_workers=1):
+        self.name = name
+        self.run_batch_fn = run_batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait_s = max(0.0, float(max_wait_s))
+        self.bucket_fn = bucket_fn
+        self.stats = BatchStats(name, self.max_batch_size)
+        self._buckets = {} # kunci ember -> list (payload, tag, future, waktu masuk)
+        self._condition = threading.Condition()
+        self._closed = False
+        self._threads = [
+            threading.Thread(target=self._dispatch_loop, name=f"batcher-{name}-{worker_idx}", daemon=True)
+            for worker_idx in range(max(1, int(num_workers)))
+        ]
+        for dispatch_thread in self._threads: dispatch_thread.start()
+
+    def submit(self, payload, tag=None):
+        """Masukkan satu item; `tag` (mis. (id_dokumen, field_idx)) dipakai untuk statistik lintas dokumen."""
+        future = Future()
+        bucket_key = self.bucket_fn(payload) if self.bucket_fn is not None else None
+        with self._condition:
+            if self._closed: raise RuntimeError(f"Batcher '{self.name}' sudah ditutup")
+            self._buckets.setdefault(bucket_key, []).append((payload, tag, future, time.perf_counter()))
+            self._condition.notify()
+        return future
+
+    def _take_ready_batch(self):
+        # Dipanggil dengan lock: (list entri, 0) jika ada batch siap, atau (None, detik sampai tenggat terdekat)
+        now = time.perf_counter()
+        nearest_deadline_s = None
+        ready_keys = [] # Kunci ember bisa None (ember default), jadi dipakai list, bukan sentinel None
+        for bucket_key, entries in self._buckets.items():
+            if len(entries) >= self.max_batch_size:
+                ready_keys = [bucket_key]
+                break
+            remaining_s = entries[0][3] + self.max_wait_s - now
+            if remaining_s <= 0 or self._closed:
+                ready_keys.append(bucket_key)
+            elif nearest_deadline_s is None or remaining_s < nearest_deadline_s:
+                nearest_deadline_s = remaining_s
+        if not ready_keys: return None, nearest_deadline_s
+        ready_key = min(ready_keys, key=lambda bucket_key: self._buckets[bucket_key][0][3])
+        entries = self._buckets[ready_key]
+        batch_entries = entries[:self.max_batch_size]
+        if len(entries) > self.max_batch_size: self._buckets[ready_key] = entries[self.max_batch_size:]
+        else: del self._buckets[ready_key]
+        return batch_entries, 0.0
+
+    def _dispatch_loop(self):
+        while True:
+            with self._condition:
+                while True:
+                    batch_entries, wait_s = self._take_ready_batch()
+                    if batch_entries is not None: break
+                    if self._closed and not self._buckets: return
+                    self._condition.wait(timeout=wait_s)
+            self._run_batch(batch_entries)
+
+    def _run_batch(self, batch_entries):
+        start_time = time.perf_counter()
+        wait_times_s = [start_time - entry[3] for entry in batch_entries]
+        num_docs = len({entry[1][0] if isinstance(entry[1], tuple) else entry[1] for entry in batch_entries})
+        failed = False
+        try:
+            outputs = self.run_batch_fn([entry[0] for entry in batch_entries])
+            for entry, output in zip(batch_entries, outputs):
+                entry[2].set_result(output)
+        except Exception as e_batch:
+            failed = True
+            print(f"Error di batcher '{self.name}': {e_batch}")
+            for entry in batch_entries:
+                if not entry[2].done(): entry[2].set_exception(e_batch)
+        self.stats.record_batch(len(batch_entries), wait_times_s, num_docs, time.perf_counter() - start_time, failed)
+
+    def close(self):
+        # Item yang masih antri tetap diproses sebelum thread dispatcher berhenti
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        for dispatch_thread in self._threads: dispatch_thread.join()
+
+def _ssd_bucket(payload):
+    # Ember berdasarkan luas gambar (kelipatan pangkat dua piksel) agar memori per batch terkendali
+    field_w, field_h = payload[1]
+    return int(math.log2(max(1, field_w * field_h)))
+
+class InferenceScheduler:
+    """
+    Scheduler bersama untuk satu pasang model: deteksi SSD dan klasifikasi karakter
+    dari banyak dokumen yang berjalan bersamaan (thread) dikemas ke batch bersama.
+    Dipakai lewat parameter `scheduler` di model.model_detect_chars*/model_classify_char*
+    atau extraction.extract_document. Tag item adalah (id_dokumen, indeks area).
+    """
+    def __init__(self, model_s, model_c, device_obj, ssd_batch_size=None, char_batch_size=None, max_wait_s=None):
+        if ssd_batch_size is None: ssd_batch_size = config.SCHEDULER_SSD_BATCH_SIZE
+        if char_batch_size is None: char_batch_size = config.SCHEDULER_CHAR_BATCH_SIZE
+        if max_wait_s is None: max_wait_s = config.SCHEDULER_MAX_WAIT_S
+        self.model_s = model_s
+        self.model_c = model_c
+        self.device_obj = device_obj
+        self.detector = DynamicBatcher("detect", self._run_detect, ssd_batch_size, max_wait_s, bucket_fn=_ssd_bucket)
+        self.classifier = DynamicBatcher("classify", self._run_classify, char_batch_size, max_wait_s)
+
+    def _run_detect(self, payloads):
+        return model.model_detect_chars_preprocessed(
+            [payload[0] for payload in payloads], [payload[1] for payload in payloads], self.model_s, self.device_obj,
+            size_scales=[payload[2] for payload in payloads]
+        )
+
+    def _run_classify(self, payloads):
+        return model.model_classify_chars_batch([payload[0] for payload in payloads], self.model_c, self.device_obj,
+                                                batch_size=len(payloads), size_scales=[payload[1] for payload in payloads])
+
+    def detect_preprocessed_async(self, field_tensor, field_size, tag=None, size_scale=1.0):
+        # Future berisi list kotak karakter (format sama dengan model_detect_chars)
+        return self.detector.submit((field_tensor, field_size, size_scale), tag)
+
+    def detect_chars_async(self, field_image_pil, transform_ssd, tag=None):
+        # Preprocessing dijalankan di thread pemanggil agar dispatcher hanya menjalankan forward pass
+        return self.detect_preprocessed_async(model.model_preprocess_field_for_ssd(field_image_pil, transform_ssd), field_image_pil.size, tag)
+
+    def classify_char_async(self, char_image_pil, tag=None, size_scale=1.0):
+        # Future berisi (karakter, confidence) (format sama dengan model_classify_char)
+        return self.classifier.submit((char_image_pil, size_scale), tag)
+
+    def get_stats(self):
+        return {"detect": self.detector.stats.to_dict(), "classify": self.classifier.stats.to_dict()}
+
+    def close(self):
+        self.detector.close()
+        self.classifier.close()
@@ -0,0 +1,220 @@
+# benchmarks/bench_extraction.py
+# Benchmark end-to-end ekstraksi dengan kuesioner sintetis (lihat synthetic_forms.py):
+# waktu per stage, dokumen/detik, puncak RSS, dan akurasi karakter terhadap ground truth.
+# Hasil JSON memuat commit git dan konfigurasi sehingga bisa dibandingkan antar commit/backend.
+#
+# Contoh (jalankan dari root repositori):
+#   python benchmarks/bench_extraction.py --docs 5 --output bench_eager.json
+#   python benchmarks/bench_extraction.py --docs 5 --backend static_int8 --output bench_int8.json --compare bench_eager.json
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import resource
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import torch
+import config # Import file config
+import backends
+import extraction
+import model_registry
+import profiling
+import synthetic_forms
+
+# Naikkan jika struktur JSON hasil berubah
+BENCH_SCHEMA_VERSION = 1
+
+def _current_rss_mib():
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"): return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return None
+
+def _peak_rss_mib():
+    # ru_maxrss dalam KiB di Linux dan byte di macOS; puncak seumur proses
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss / (1024.0 * 1024.0) if sys.platform == "darwin" else peak_rss / 1024.0
+
+def _git_revision():
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=repo_dir, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=repo_dir,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return {"commit": commit, "dirty": dirty}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+
+def score_document(results_data, ground_truth):
+    # Hasil dan ground truth sama-sama urut layout; area yang hilang atau tidak cocok dihitung salah semua
+    total_errors = 0
+    fields_exact = 0
+    for pos, truth_item in enumerate(ground_truth):
+        recognized_text = ""
+        if pos < len(results_data) and results_data[pos]["ID_Pertanyaan"] == truth_item["ID_Pertanyaan"]:
+            recognized_text = results_data[pos]["Teks"]
+        errors = backends.edit_distance(recognized_text, truth_item["Teks"])
+        total_errors += errors
+        fields_exact += int(errors == 0)
+    return {
+        "chars": sum(len(truth_item["Teks"]) for truth_item in ground_truth), "char_errors": total_errors,
+        "fields": len(ground_truth), "fields_exact": fields_exact,
+    }
+
+def run_benchmark(documents, selected_gender_str, extraction_mode, use_pipeline, inference_backend, warmup_docs=1):
+    """
+    Jalankan ekstraksi untuk setiap dokumen sintetis (cache hasil dimatikan) dan
+    kumpulkan waktu per stage, dokumen/detik, RSS, serta akurasi karakter.
+    Puncak RSS berlaku untuk seluruh proses, jadi jalankan satu konfigurasi per proses.
+    """
+    config.RESULT_CACHE_ENABLED = False
+    device_obj = torch.device("cpu") if inference_backend != "eager" else config.DEVICE
+    rss_before_models_mib = _current_rss_mib()
+    load_start = time.perf_counter()
+    model_s, model_c = model_registry.get_models(device_obj, inference_backend)
+    model_load_s = time.perf_counter() - load_start
+    if model_s is None or model_c is None:
+        raise RuntimeError("Model AI tidak berhasil dimuat.")
+    rss_after_models_mib = _current_rss_mib()
+
+    def read_pdf(pdf_path):
+        with open(pdf_path, "rb") as f:
+            return f.read()
+
+    # Dokumen warmup tidak ikut diukur (alokasi awal, JIT, cache poppler)
+    for pdf_path, _ in documents[:warmup_docs]:
+        extraction.extract_document(read_pdf(pdf_path), selected_gender_str, model_s, model_c, device_obj,
+                                    extraction_mode=extraction_mode, use_pipeline=use_pipeline)
+
+    stage_totals = {}
+    counter_totals = {}
+    doc_times_s = []
+    score_totals = {"chars": 0, "char_errors": 0, "fields": 0, "fields_exact": 0}
+    bench_start = time.perf_counter()
+    for pdf_path, ground_truth in documents:
+        pdf_bytes = read_pdf(pdf_path)
+        profiler = profiling.ExtractionProfiler(label=os.path.basename(pdf_path))
+        results_data, _ = extraction.extract_document(
+            pdf_bytes, selected_gender_str, model_s, model_c, device_obj,
+            extraction_mode=extraction_mode, use_pipeline=use_pipeline, profiler=profiler
+        )
+        profiler.finish()
+        profile_data = profiler.to_dict()
+        doc_times_s.append(profile_data["total_s"])
+        for stage_name, stage_info in profile_data["stages"].items():
+            stage_totals[stage_name] = stage_totals.get(stage_name, 0.0) + stage_info["total_s"]
+        for counter_name, counter_value in profile_data["counters"].items():
+            counter_totals[counter_name] = counter_totals.get(counter_name, 0) + counter_value
+        for score_key, score_value in score_document(results_data, ground_truth).items():
+            score_totals[score_key] += score_value
+    wall_s = time.perf_counter() - bench_start
+
+    num_docs = len(documents)
+    return {
+        "docs": num_docs, "wall_s": round(wall_s, 4),
+        "docs_per_sec": round(num_docs / wall_s, 4) if wall_s > 0 else None,
+        "doc_s_mean": round(sum(doc_times_s) / num_docs, 4) if num_docs else None,
+        "doc_s_min": round(min(doc_times_s), 4) if doc_times_s else None,
+        "doc_s_max": round(max(doc_times_s), 4) if doc_times_s else None,
+        "stages_s_per_doc": {name: round(total_s / num_docs, 4) for name, total_s in sorted(stage_totals.items(), key=lambda kv: -kv[1])},
+        "counters": dict(sorted(counter_totals.items())),
+        # 1 - (jarak edit / jumlah karakter ground truth), dibatasi 0 jika karakter sisipan sangat banyak
+        "char_accuracy": round(max(0.0, 1.0 - score_totals["char_errors"] / score_totals["chars"]), 5) if score_totals["chars"] else None,
+        "field_exact_pct": round(100.0 * score_totals["fields_exact"] / score_totals["fields"], 2) if score_totals["fields"] else None,
+        "model_load_s": round(model_load_s, 3),
+        "effective_backends": model_registry.get_effective_backends(device_obj, inference_backend),
+        "rss_before_models_mib": rss_before_models_mib, "rss_after_models_mib": rss_after_models_mib,
+        "peak_rss_mib": round(_peak_rss_mib(), 1),
+    }
+
+def build_report(args, bench_results):
+    return {
+        "schema_version": BENCH_SCHEMA_VERSION,
+        "git": _git_revision(),
+        "environment": {
+            "python": platform.python_version(), "torch": torch.__version__, "platform": platform.platform(),
+            "cpu_count": os.cpu_count(), "torch_threads": torch.get_num_threads(),
+        },
+        "params": {
+            "gender": args.gender, "docs": args.docs, "seed": args.seed, "mode": args.mode, "pipeline": args.pipeline,
+            "backend": args.backend, "template_grid": config.TEMPLATE_GRID_ENABLED,
+            "page_registration": config.PAGE_REGISTRATION_ENABLED, "adaptive_escalation": config.ADAPTIVE_ESCALATION_ENABLED,
+            "generator_version": synthetic_forms.GENERATOR_VERSION,
+            "pdf_render_dpi": config.PDF_RENDER_DPI, "ssd_batch_size": config.SSD_BATCH_SIZE, "char_batch_size": config.CHAR_BATCH_SIZE,
+        },
+        "results": bench_results,
+    }
+
+def print_comparison(current_report, baseline_path):
+    # Selisih metrik utama dan waktu per stage terhadap hasil benchmark sebelumnya
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline_report = json.load(f)
+    if baseline_report["params"].get("seed") != current_report["params"]["seed"] or \
+       baseline_report["params"].get("gender") != current_report["params"]["gender"]:
+        print("Peringatan: seed/gender berbeda dengan baseline, dokumen uji tidak sama.")
+    baseline_results, current_results = baseline_report["results"], current_report["results"]
+    baseline_commit = (baseline_report["git"]["commit"] or "?")[:10]
+    current_commit = (current_report["git"]["commit"] or "?")[:10]
+    print(f"\nPerbandingan dengan {baseline_path} ({baseline_commit} {baseline_report['params']['backend']} -> "
+          f"{current_commit} {current_report['params']['backend']}):")
+    for metric_name in ("docs_per_sec", "doc_s_mean", "char_accuracy", "field_exact_pct", "peak_rss_mib"):
+        old_value, new_value = baseline_results.get(metric_name), current_results.get(metric_name)
+        if old_value is None or new_value is None: continue
+        change_pct = 100.0 * (new_value - old_value) / old_value if old_value else 0.0
+        print(f"  {metric_name:<22} {old_value:>10} -> {new_value:>10} ({change_pct:+.1f}%)")
+    all_stages = list(dict.fromkeys(list(current_results["stages_s_per_doc"]) + list(baseline_results["stages_s_per_doc"])))
+    for stage_name in all_stages:
+        old_value = baseline_results["stages_s_per_doc"].get(stage_name, 0.0)
+        new_value = current_results["stages_s_per_doc"].get(stage_name, 0.0)
+        print(f"  stage {stage_name:<16} {old_value:>10.4f} -> {new_value:>10.4f} s/dok")
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Benchmark ekstraksi dengan kuesioner sintetis.")
+    parser.add_argument("--gender", default="pria", choices=["pria", "perempuan"])
+    parser.add_argument("--docs", type=int, default=5, help="Jumlah dokumen terukur")
+    parser.add_argument("--seed", type=int, default=0, help="Seed generator (dokumen sama untuk seed sama)")
+    parser.add_argument("--mode", default=config.EXTRACTION_MODE, choices=config.EXTRACTION_MODES)
+    parser.add_argument("--pipeline", action="store_true", help="Jalankan mode pipeline")
+    parser.add_argument("--backend", default=config.INFERENCE_BACKEND, choices=config.INFERENCE_BACKENDS)
+    parser.add_argument("--template-grid", action="store_true", help="Pakai grid anotasi (template_grid.py), SSD hanya sebagai fallback")
+    parser.add_argument("--register-pages", action="store_true", help="Registrasi halaman sebelum crop (registration.py)")
+    parser.add_argument("--adaptive", action="store_true", help="Eskalasi area yang ragu ke DPI tinggi + fp32 + TTA (escalation.py)")
+    parser.add_argument("--torch-threads", type=int, default=None)
+    parser.add_argument("--warmup-docs", type=int, default=1, help="Dokumen pertama yang dijalankan tanpa diukur")
+    parser.add_argument("--synthetic-dir", default=None, help="Direktori PDF sintetis (default: benchmarks/synthetic)")
+    parser.add_argument("--output", default=None, help="Simpan hasil benchmark sebagai JSON")
+    parser.add_argument("--compare", default=None, help="JSON hasil benchmark sebelumnya sebagai baseline")
+    return parser
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    if args.torch_threads: torch.set_num_threads(args.torch_threads)
+    if args.template_grid: config.TEMPLATE_GRID_ENABLED = True
+    if args.register_pages: config.PAGE_REGISTRATION_ENABLED = True
+    if args.adaptive: config.ADAPTIVE_ESCALATION_ENABLED = True
+    documents = synthetic_forms.generate_documents(args.gender, args.docs, args.seed, args.synthetic_dir)
+    print(f"Benchmark {len(documents)} dokumen sintetis ({args.gender}, seed {args.seed}, mode {args.mode}, "
+          f"pipeline {args.pipeline}, backend {args.backend})...")
+    bench_results = run_benchmark(documents, args.gender, args.mode, args.pipeline, args.backend, args.warmup_docs)
+    report = build_report(args, bench_results)
+
+    print(f"{bench_results['docs_per_sec']:.3f} dok/detik, rata-rata {bench_results['doc_s_mean']:.3f} s/dok, "
+          f"akurasi karakter {bench_results['char_accuracy']}, area tepat {bench_results['field_exact_pct']}%, "
+          f"puncak RSS {bench_results['peak_rss_mib']} MiB")
+    for stage_name, stage_s in bench_results["stages_s_per_doc"].items():
+        print(f"  {stage_name:<22} {stage_s:.4f} s/dok")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.compare: print_comparison(report, args.compare)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
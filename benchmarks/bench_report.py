@@ -0,0 +1,135 @@
+# benchmarks/bench_report.py
+# Bandingkan waktu dan puncak memori pembuatan laporan: implementasi lama
+# (PNG sementara di disk) vs laporan di memori, downscale, write-only, CSV/Parquet.
+#
+# Contoh:
+#   python benchmarks/bench_report.py --fields 158 --docs 1
+#   python benchmarks/bench_report.py --fields 158 --docs 20 --output bench_report.json
+
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from openpyxl import Workbook
+from openpyxl.drawing.image import Image as XLImage
+import model
+import config # Import file config
+
+def legacy_create_excel_report(results_data):
+    # Salinan implementasi sebelum laporan di memori (acuan pembanding)
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Hasil Ekstraksi"
+    ws.append(["Nomor Pertanyaan", "Gambar Pertanyaan", "Hasil Karakter", "Avg. Confidence"])
+    ws.column_dimensions['A'].width = 25
+    ws.column_dimensions['B'].width = 45
+    ws.column_dimensions['C'].width = 30
+    ws.column_dimensions['D'].width = 20
+
+    current_excel_row = 2
+    temp_image_paths_for_cleanup = []
+
+    for res_data in results_data:
+        ws.row_dimensions[current_excel_row].height = 70
+
+        temp_img_path = os.path.join(config.TEMP_PROCESSING_DIR, f"excel_temp_img_{current_excel_row}.png")
+        try:
+            res_data["Image_PIL"].save(temp_img_path)
+            temp_image_paths_for_cleanup.append(temp_img_path)
+
+            img_for_excel = XLImage(temp_img_path)
+            img_for_excel.height = 80
+            aspect_ratio = res_data["Image_PIL"].width / res_data["Image_PIL"].height if res_data["Image_PIL"].height > 0 else 1
+            img_for_excel.width = img_for_excel.height * aspect_ratio
+            ws.add_image(img_for_excel, f"B{current_excel_row}")
+        except Exception as e_excel_img:
+            print(f"Error menambah gambar ke excel: {e_excel_img}")
+            ws[f"B{current_excel_row}"] = "Gagal memuat gambar"
+
+        ws[f"A{current_excel_row}"] = res_data["ID_Pertanyaan"]
+        ws[f"C{current_excel_row}"] = res_data["Teks"]
+        ws[f"D{current_excel_row}"] = res_data["Avg_Conf"]
+        current_excel_row += 1
+
+    excel_buffer = io.BytesIO()
+    wb.save(excel_buffer)
+    excel_buffer.seek(0)
+
+    for img_path in temp_image_paths_for_cleanup:
+        if os.path.exists(img_path):
+            try: os.remove(img_path)
+            except Exception as e_del_excel: print(f"Gagal hapus temp img excel: {e_del_excel}")
+
+    return excel_buffer
+
+def make_synthetic_results(num_fields, num_docs, field_size=(780, 300)):
+    # Crop area sintetis seukuran area anotasi pada 300 DPI (kotak-kotak digit di latar putih)
+    results_data = []
+    for doc_idx in range(num_docs):
+        for field_idx in range(num_fields):
+            field_image_pil = Image.new("RGB", field_size, "white")
+            draw = ImageDraw.Draw(field_image_pil)
+            for box_idx in range(6):
+                x0 = 20 + box_idx * 120
+                draw.rectangle([x0, 60, x0 + 100, 240], outline="black", width=3)
+                draw.text((x0 + 40, 130), str((field_idx + box_idx) % 10), fill="black")
+            results_data.append({
+                "ID_Pertanyaan": f"Q{field_idx + 1}", "Halaman": str(field_idx // 30 + 1),
+                "Teks": "123456", "Avg_Conf": "0.95", "Image_PIL": field_image_pil,
+                "Dokumen": f"dokumen_{doc_idx + 1}.pdf",
+            })
+    return results_data
+
+def measure(label, report_fn):
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    report_buffer = report_fn()
+    elapsed_s = time.perf_counter() - start_time
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    report_size = len(report_buffer.getvalue()) if hasattr(report_buffer, "getvalue") else 0
+    print(f"{label:<32} {elapsed_s:8.3f}s  puncak {peak_bytes / 2**20:8.1f} MiB  ukuran {report_size / 2**20:7.2f} MiB")
+    return {"label": label, "elapsed_s": round(elapsed_s, 4), "peak_mib": round(peak_bytes / 2**20, 2),
+            "size_mib": round(report_size / 2**20, 3)}
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Benchmark pembuatan laporan Excel/CSV/Parquet.")
+    parser.add_argument("--fields", type=int, default=158, help="Jumlah area per dokumen")
+    parser.add_argument("--docs", type=int, default=1, help="Jumlah dokumen dalam satu laporan")
+    parser.add_argument("--output", default=None, help="Simpan hasil benchmark sebagai JSON")
+    return parser
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    os.makedirs(config.TEMP_PROCESSING_DIR, exist_ok=True)
+    results_data = make_synthetic_results(args.fields, args.docs)
+    print(f"{len(results_data)} baris hasil ({args.docs} dokumen x {args.fields} area)")
+
+    cases = [
+        ("lama (PNG sementara)", lambda: legacy_create_excel_report(results_data)),
+        ("memori", lambda: model.create_excel_report(results_data, downscale_images=False)),
+        ("memori + downscale", lambda: model.create_excel_report(results_data, downscale_images=True)),
+        ("write-only + downscale", lambda: model.create_excel_report(iter(results_data), write_only=True, downscale_images=True)),
+        ("write-only tanpa gambar", lambda: model.create_excel_report(iter(results_data), write_only=True, include_images=False)),
+        ("csv", lambda: model.create_tabular_report(results_data, "csv")),
+    ]
+    try:
+        import pandas, pyarrow
+        cases.append(("parquet", lambda: model.create_tabular_report(results_data, "parquet")))
+    except ImportError:
+        print("pandas/pyarrow tidak tersedia, kasus parquet dilewati.")
+
+    bench_results = [measure(label, report_fn) for label, report_fn in cases]
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"rows": len(results_data), "fields": args.fields, "docs": args.docs, "results": bench_results}, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
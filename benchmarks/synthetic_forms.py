@@ -0,0 +1,137 @@
+# benchmarks/synthetic_forms.py
+# Generator kuesioner sintetis dari layout anotasi (anotasi_pria.json / anotasi_perempuan.json).
+# Setiap area diisi kotak-kotak karakter berisi digit/huruf dari CHAR_TARGET_CLASSES_LIST,
+# sehingga teks jawabannya (ground truth) diketahui tanpa memakai formulir asli.
+#
+# Contoh:
+#   python benchmarks/synthetic_forms.py --gender pria --docs 5 --seed 0 --output-dir benchmarks/synthetic
+
+import os
+import sys
+import json
+import random
+import argparse
+from PIL import Image, ImageDraw, ImageFont
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import layout
+import config # Import file config
+
+# Naikkan jika cara menggambar berubah agar PDF lama di direktori output dibuat ulang
+GENERATOR_VERSION = 1
+PAGE_WIDTH_INCH = 595 / 72.0 # Lebar A4; tinggi mengikuti rasio halaman anotasi
+SYNTHETIC_DPI = 300
+
+def _load_font(size_px):
+    try:
+        return ImageFont.truetype("DejaVuSans-Bold.ttf", size_px)
+    except OSError:
+        return ImageFont.load_default(size=size_px)
+
+def _draw_field(draw, rect, rng):
+    """
+    Gambar kotak-kotak karakter di dalam persegi area dan isi setiap kotak dengan
+    satu karakter acak (posisi, ukuran, dan ketebalan sedikit bervariasi seperti
+    tulisan tangan). Mengembalikan teks yang digambar.
+    """
+    x1, y1, x2, y2 = rect
+    field_w, field_h = x2 - x1, y2 - y1
+    # Area anotasi yang bersebelahan bisa sedikit tumpang tindih, jadi kotak tidak memenuhi tinggi area
+    box_size = int(field_h * 0.6)
+    box_gap = max(2, int(box_size * 0.15))
+    num_boxes = max(1, min(8, (field_w - box_gap) // (box_size + box_gap)))
+    start_x = x1 + (field_w - num_boxes * (box_size + box_gap) + box_gap) // 2
+    start_y = y1 + (field_h - box_size) // 2
+    line_width = max(2, box_size // 28)
+
+    text_chars = []
+    for box_idx in range(num_boxes):
+        bx = start_x + box_idx * (box_size + box_gap)
+        draw.rectangle([bx, start_y, bx + box_size, start_y + box_size], outline=0, width=line_width)
+        char = rng.choice(config.CHAR_TARGET_CLASSES_LIST)
+        font = _load_font(int(box_size * rng.uniform(0.55, 0.7)))
+        text_box = draw.textbbox((0, 0), char, font=font)
+        text_w, text_h = text_box[2] - text_box[0], text_box[3] - text_box[1]
+        jitter = box_size * 0.06
+        tx = bx + (box_size - text_w) / 2 - text_box[0] + rng.uniform(-jitter, jitter)
+        ty = start_y + (box_size - text_h) / 2 - text_box[1] + rng.uniform(-jitter, jitter)
+        draw.text((tx, ty), char, fill=rng.randint(0, 60), font=font, stroke_width=rng.randint(0, 1), stroke_fill=0)
+        text_chars.append(char)
+    return "".join(text_chars)
+
+def generate_document(annotation_layout, seed, dpi=SYNTHETIC_DPI):
+    """
+    Buat halaman-halaman satu kuesioner sintetis. Mengembalikan (list gambar
+    halaman grayscale, list ground truth per area sesuai urutan layout).
+    """
+    rng = random.Random(seed)
+    first_field = annotation_layout.fields[0]
+    page_w = int(round(PAGE_WIDTH_INCH * dpi))
+    page_h = int(round(page_w * first_field.original_height / first_field.original_width))
+    num_pages = max(annotation_layout.page_numbers)
+    label_font = _load_font(max(12, dpi // 8))
+
+    page_images = []
+    ground_truth = []
+    for page_number in range(1, num_pages + 1):
+        page_image = Image.new("L", (page_w, page_h), 255)
+        draw = ImageDraw.Draw(page_image)
+        draw.text((dpi // 2, dpi // 3), f"KUESIONER SINTETIS - HALAMAN {page_number}", fill=0, font=label_font)
+        for field, rect in annotation_layout.get_crop_rects(page_number, (page_w, page_h)):
+            # Nomor pertanyaan di kiri area sebagai pengganti teks soal
+            draw.text((max(0, rect[0] - dpi), rect[1]), f"{field.id_pertanyaan}.", fill=0, font=label_font)
+            ground_truth.append({
+                "field_idx": field.field_idx, "ID_Pertanyaan": field.id_pertanyaan,
+                "Halaman": field.halaman_str, "Teks": _draw_field(draw, rect, rng),
+            })
+        page_images.append(page_image)
+    ground_truth.sort(key=lambda item: item["field_idx"])
+    return page_images, ground_truth
+
+def generate_documents(selected_gender_str, num_docs, seed=0, output_dir=None, dpi=SYNTHETIC_DPI):
+    """
+    Tulis `num_docs` PDF sintetis beserta ground truth (.json) ke output_dir.
+    PDF yang sudah ada dengan versi generator, gender, seed, dan DPI yang sama
+    dipakai ulang. Mengembalikan list (path_pdf, ground_truth).
+    """
+    if output_dir is None: output_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "synthetic")
+    annotation_layout = layout.load_layout_for_gender(selected_gender_str)
+    if annotation_layout is None:
+        raise FileNotFoundError(f"File anotasi untuk gender '{selected_gender_str}' tidak ditemukan.")
+    os.makedirs(output_dir, exist_ok=True)
+
+    documents = []
+    for doc_idx in range(num_docs):
+        doc_seed = seed * 100003 + doc_idx
+        base_name = f"sintetis_v{GENERATOR_VERSION}_{selected_gender_str}_s{seed}_d{doc_idx:04d}_{dpi}dpi"
+        pdf_path = os.path.join(output_dir, base_name + ".pdf")
+        truth_path = os.path.join(output_dir, base_name + ".json")
+        if os.path.exists(pdf_path) and os.path.exists(truth_path):
+            with open(truth_path, "r", encoding="utf-8") as f:
+                documents.append((pdf_path, json.load(f)))
+            continue
+        page_images, ground_truth = generate_document(annotation_layout, doc_seed, dpi)
+        page_images[0].save(pdf_path, "PDF", save_all=True, append_images=page_images[1:], resolution=dpi)
+        with open(truth_path, "w", encoding="utf-8") as f:
+            json.dump(ground_truth, f, ensure_ascii=False, indent=1)
+        documents.append((pdf_path, ground_truth))
+    return documents
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Buat PDF kuesioner sintetis dengan ground truth.")
+    parser.add_argument("--gender", default="pria", choices=["pria", "perempuan"])
+    parser.add_argument("--docs", type=int, default=5, help="Jumlah dokumen")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--dpi", type=int, default=SYNTHETIC_DPI)
+    parser.add_argument("--output-dir", default=None, help="Default: benchmarks/synthetic")
+    return parser
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    documents = generate_documents(args.gender, args.docs, args.seed, args.output_dir, args.dpi)
+    for pdf_path, ground_truth in documents:
+        print(f"{pdf_path}: {len(ground_truth)} area, {sum(len(item['Teks']) for item in ground_truth)} karakter")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,6 +9,7 @@ APP_DATA_PATH = 'app_data'
 SSD_MODEL_FILENAME = 'ssd_mobilenetv3_large_kotakkecil.pth'
 CHAR_CLASSIFIER_MODEL_FILENAME = 'mobilenetv3_small_char_classifier_augmented.pth'
 TEMP_PROCESSING_DIR = 'temp_streamlit_processing_files' 
+TEMP_WORKSPACE_MAX_AGE_S = 6 * 60 * 60 # Workspace req_* lebih tua dari ini yang lock pemiliknya sudah lepas dianggap sisa dan dihapus
 
 # Membuat path lengkap
 SSD_MODEL_PATH = os.path.join(APP_DATA_PATH, SSD_MODEL_FILENAME)
@@ -17,6 +18,25 @@ ANNOTATION_CROP_AREA_DIR = APP_DATA_PATH
 
 # --- Parameter Model dan Pemrosesan ---
 DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+MODEL_WARMUP = True # Jalankan satu inferensi dummy saat model pertama kali dimuat
+
+# Parameter Backend Inferensi (lihat backends.py)
+INFERENCE_BACKEND = "eager" # "eager" (fp32), "dynamic_int8", "static_int8", "torchscript", atau "onnx"
+INFERENCE_BACKENDS = ["eager", "dynamic_int8", "static_int8", "torchscript", "onnx"]
+BACKEND_ARTIFACT_DIR = os.path.join(APP_DATA_PATH, 'backends') # Model hasil kuantisasi/ekspor
+BACKEND_CALIBRATION_MAX_FIELDS = 256 # Jumlah crop area maksimum untuk kalibrasi int8 SSD
+BACKEND_CALIBRATION_MAX_CHARS = 2048 # Jumlah crop karakter maksimum untuk kalibrasi int8 klasifikasi
+BACKEND_MAX_CHAR_ERROR_RATE = 0.01 # Toleransi perbandingan: rasio karakter berbeda dari fp32
+ONNX_OPSET = 17
+
+# Parameter Render PDF
+PDF_RENDER_DPI = 300
+PDF_PAGE_WINDOW = 1 # Jumlah halaman berurutan yang dirender per pemanggilan poppler
+EXTRACTION_MODE = "page" # "page": render halaman penuh, "region": render hanya area anotasi
+EXTRACTION_MODES = ["page", "region"]
+REGION_MIN_DPI = 150 # Batas DPI untuk mode "region" (dipilih per area dari ukuran input SSD)
+REGION_MAX_DPI = 300
+REGION_RENDER_WORKERS = 4 # Jumlah proses pdftoppm paralel pada mode "region"
 
 # Parameter Model Klasifikasi Karakter
 CHAR_IMAGE_SIZE = (64, 64)
@@ -29,13 +49,92 @@ SSD_NUM_CLASSES = 2
 SSD_DETECTION_THRESHOLD = 0.3 
 SSD_NMS_IOU_THRESHOLD = 0.3   
 SSD_INPUT_SIZE = (320, 320) 
+SSD_BATCH_SIZE = 32 # Jumlah gambar area per forward pass SSD
 
 # Parameter Filter dan Klasifikasi
 CHAR_CLASSIFICATION_THRESHOLD = 0.5 
+CHAR_BATCH_SIZE = 256 # Jumlah crop karakter per forward pass klasifikasi
+BLANK_CHAR_MAX_STDDEV = 7 # Crop dianggap kosong jika stddev grayscale di bawah nilai ini...
+BLANK_CHAR_MIN_MEAN = 240 # ...dan rata-rata grayscale di atas nilai ini
 MIN_CHAR_BOX_WIDTH = 5    
 MIN_CHAR_BOX_HEIGHT = 10   
 MAX_CHAR_BOX_ASPECT_RATIO = 2.5 
 MIN_CHAR_AREA = MIN_CHAR_BOX_WIDTH * MIN_CHAR_BOX_HEIGHT
 
+# Parameter Registrasi Halaman (rotasi/skala/pergeseran scan per halaman, lihat registration.py)
+PAGE_REGISTRATION_ENABLED = False # Hanya berlaku untuk mode "page"; perlu 'python registration.py build'
+REGISTRATION_WORK_WIDTH = 640 # Lebar gambar kerja (px) untuk estimasi transformasi
+REGISTRATION_MAX_ANGLE_DEG = 2.0 # Kemiringan maksimum yang dicari
+REGISTRATION_ANGLE_STEP_DEG = 0.1
+REGISTRATION_MAX_SCALE_DELTA = 0.03 # Skala yang dicari: 1 +- nilai ini
+REGISTRATION_SCALE_STEP = 0.0025
+REGISTRATION_MAX_SHIFT_FRAC = 0.05 # Pergeseran maksimum yang dicari, relatif terhadap ukuran halaman
+REGISTRATION_MIN_CONFIDENCE = 0.5 # Korelasi profil minimum; di bawahnya halaman di-crop tanpa registrasi
+
+# Parameter Template Grid (kotak karakter per area dipelajari dari dokumen referensi, lihat template_grid.py)
+TEMPLATE_GRID_ENABLED = False # Potong karakter langsung dari grid; SSD hanya untuk area yang penyelarasannya ragu
+GRID_PROFILE_SIZE = (256, 64) # Ukuran (lebar, tinggi) profil proyeksi area untuk penyelarasan
+GRID_MAX_SHIFT_FRAC = 0.15 # Pergeseran maksimum yang dicari, relatif terhadap ukuran area
+GRID_MIN_CONFIDENCE = 0.6 # Korelasi profil minimum agar grid dipakai (di bawahnya memakai SSD)
+GRID_MIN_SUPPORT = 0.6 # Proporsi dokumen referensi dengan jumlah kotak yang sama agar grid area disimpan
+
+# Parameter Eskalasi Adaptif (dua tingkat, lihat escalation.py)
+ADAPTIVE_ESCALATION_ENABLED = False # Area yang ragu diproses ulang dengan DPI tinggi, model fp32, dan TTA
+ESCALATION_MIN_AVG_CONF = 0.8 # Area dengan confidence rata-rata karakter di bawah ini dieskalasi
+ESCALATION_DPI = 400 # DPI render ulang halaman untuk area yang dieskalasi
+ESCALATION_BACKEND = "eager" # Backend model tingkat kedua (presisi penuh)
+ESCALATION_TTA_VARIANTS = 5 # Jumlah varian crop per karakter (>= 1): asli, diperbesar, diperkecil, geser kiri/kanan, geser atas/bawah;
+                            # di atas 7 pola yang sama diulang dengan geseran kelipatan lebih besar. Biaya klasifikasi naik linear
+ESCALATION_TTA_JITTER_FRAC = 0.08 # Besar geseran/perbesaran varian TTA (pecahan ukuran kotak)
+ESCALATION_MAX_FIELDS_FRAC = 1.0 # Batas pecahan area per dokumen yang boleh dieskalasi (terburuk lebih dulu)
+
+# Parameter Pipeline (render, crop, deteksi, klasifikasi berjalan tumpang tindih)
+PIPELINE_ENABLED = False # Hanya berlaku untuk mode "page"
+PIPELINE_QUEUE_SIZE = 8 # Ukuran maksimum queue antar stage (backpressure)
+PIPELINE_RENDER_WORKERS = 2
+PIPELINE_CROP_WORKERS = 1
+PIPELINE_DETECT_WORKERS = 1
+PIPELINE_CLASSIFY_WORKERS = 1
+PIPELINE_CLASSIFY_FIELDS_PER_BATCH = 16 # Jumlah area yang karakternya diklasifikasi bersama
+PIPELINE_MAX_WAIT_S = 0.05 # Waktu tunggu maksimum untuk melengkapi satu batch
+
+# Parameter Cache Hasil (SQLite di disk, dialamatkan berdasarkan isi)
+RESULT_CACHE_ENABLED = True
+FIELD_CACHE_ENABLED = True # Cache per area berdasarkan hash piksel crop
+RESULT_CACHE_PATH = os.path.join('result_cache', 'extraction_cache.sqlite')
+RESULT_CACHE_MAX_BYTES = 2 * 1024 ** 3 # Total ukuran maksimum sebelum entri lama dihapus
+RESULT_CACHE_MAX_AGE_S = 30 * 24 * 3600 # Entri lebih tua dari ini dianggap kedaluwarsa
+
+# Parameter Ekstraksi Batch (CLI)
+BATCH_NUM_WORKERS = 2 # Jumlah proses worker default untuk batch_extract.py
+BATCH_DOCS_IN_FLIGHT = 1 # Dokumen yang diproses bersamaan per worker; > 1 mengaktifkan scheduler batch lintas dokumen
+
+# Parameter Scheduler Batch Dinamis Lintas Dokumen (lihat batch_scheduler.py)
+SCHEDULER_SSD_BATCH_SIZE = 64 # Ukuran batch maksimum deteksi SSD gabungan
+SCHEDULER_CHAR_BATCH_SIZE = 512 # Ukuran batch maksimum klasifikasi karakter gabungan
+SCHEDULER_MAX_WAIT_S = 0.02 # Batas tunggu item tertua sebelum batch yang belum penuh dikirim
+
+# Parameter Antrian Job (lihat job_queue.py)
+JOB_QUEUE_ENABLED = True # UI mengirim job ke antrian dan mem-polling hasil, bukan memproses langsung
+JOB_QUEUE_PATH = os.path.join('job_queue', 'jobs.sqlite')
+JOB_QUEUE_EMBEDDED_WORKERS = 1 # Worker thread di dalam proses Streamlit (0: hanya worker terpisah)
+JOB_POLL_INTERVAL_S = 0.5 # Jeda worker saat antrian kosong
+JOB_UI_POLL_INTERVAL_S = 1.0 # Jeda polling status job di UI/CLI
+JOB_PROGRESS_INTERVAL_S = 0.5 # Jeda minimum antar penulisan progres (sekaligus heartbeat)
+JOB_STALE_AFTER_S = 300 # Job 'running' tanpa heartbeat selama ini dianggap worker mati
+JOB_MAX_ATTEMPTS = 2 # Percobaan maksimum sebelum job digagalkan
+JOB_MAX_AGE_S = 7 * 24 * 3600 # Job selesai lebih tua dari ini dihapus beserta hasilnya
+JOB_MAX_UPLOAD_BYTES = 200 * 1024 ** 2 # Ukuran PDF maksimum lewat API HTTP
+JOB_HTTP_PORT = 8502
+
+# Parameter Record Hasil (lihat result_records.py)
+RESULT_THUMBNAIL_WIDTH = 400 # Lebar maksimum thumbnail untuk tampilan paginasi (2x lebar tampilan agar tetap tajam)
+RESULT_PNG_COMPRESS_LEVEL = 3 # Level kompresi PNG crop/thumbnail yang disimpan di record (0-9)
+
+# Parameter Laporan Excel
+EXCEL_IMAGE_HEIGHT_PX = 80 # Tinggi tampilan gambar area di Excel
+EXCEL_DOWNSCALE_IMAGES = False # Perkecil gambar yang disematkan ke tinggi tampilan (file jauh lebih kecil, tapi buram saat di-zoom)
+EXCEL_PNG_COMPRESS_LEVEL = 3 # Level kompresi PNG gambar di Excel (0-9; makin kecil makin cepat)
+
 # Parameter UI
 ITEMS_PER_PAGE = 30
@@ -2,109 +2,65 @@
 # Mengelola alur aplikasi dan interaksi antara Model dan View.
 
 import streamlit as st
-import os
-import json
-import numpy as np
-import model
+import io
+import extraction
 import config # Import file config
 
 def run_extraction_workflow(uploaded_pdf_bytes, selected_gender_str, 
-                            model_s, model_c, device_obj):
+                            model_s, model_c, device_obj, extraction_mode=None, use_pipeline=None,
+                            profiler=None, torch_trace_path=None):
     """
     Fungsi utama untuk mengontrol proses ekstraksi.
     Mengambil input, memanggil fungsi model, dan mengembalikan hasil.
+    `extraction_mode` "page" merender halaman penuh lalu crop, "region" hanya
+    merender area anotasi (default dari config.EXTRACTION_MODE). `use_pipeline`
+    menjalankan tahap-tahap ekstraksi secara tumpang tindih (default dari config).
+    `profiler` (profiling.ExtractionProfiler) mencatat rincian waktu per stage;
+    `torch_trace_path` menyimpan trace torch.profiler untuk inferensi.
     """
-    all_extracted_results = []
-    
-    # Dapatkan transformasi dari model
-    transform_s = model.get_ssd_transform()
-    transform_c = model.get_char_transform()
-    
-    # 1. Load data anotasi area
-    annotation_crop_filename = f"anotasi_{selected_gender_str}.json"
-    annotation_crop_path = os.path.join(config.APP_DATA_PATH, annotation_crop_filename)
+    if extraction_mode is None: extraction_mode = config.EXTRACTION_MODE
 
-    if not os.path.exists(annotation_crop_path):
-        st.error(f"File anotasi area '{annotation_crop_filename}' tidak ditemukan. Pastikan ada di: '{config.APP_DATA_PATH}'")
-        return [], None
-            
-    with open(annotation_crop_path, "r") as f:
-        crop_area_data = json.load(f)
+    # Inisialisasi progress bar Streamlit
+    my_bar = st.progress(0.0, text="Memproses anotasi pertanyaan PDF...")
+    def update_progress(fraction, text):
+        my_bar.progress(min(1.0, max(0.0, fraction)), text=text)
 
-    # 2. Konversi PDF ke gambar
-    pdf_images_pil = model.model_convert_pdf(uploaded_pdf_bytes) 
-    if not pdf_images_pil:
-        st.error("Gagal mengkonversi PDF ke gambar.")
+    # Alur inti (cache dokumen, render, deteksi, klasifikasi, laporan) ada di modul extraction
+    try:
+        all_extracted_results, excel_bytes, document_stats = extraction.extract_document_with_report(
+            uploaded_pdf_bytes, selected_gender_str, model_s, model_c, device_obj,
+            extraction_mode=extraction_mode, progress_callback=update_progress,
+            use_pipeline=use_pipeline, profiler=profiler, torch_trace_path=torch_trace_path
+        )
+    except extraction.ExtractionError as e_extract:
+        my_bar.empty()
+        st.error(str(e_extract))
         return [], None
 
-    # Inisialisasi progress bar Streamlit
-    progress_text_area = "Memproses anotasi pertanyaan PDF..."
-    my_bar = st.progress(0.0, text=f"{progress_text_area} (0/{len(crop_area_data)})")
-    num_tasks_total = len(crop_area_data)
-
-    # 3. Iterasi dan proses setiap area anotasi
-    for task_idx, task in enumerate(crop_area_data): 
-        my_bar.progress((task_idx + 1) / num_tasks_total, text=f"{progress_text_area} ({task_idx+1}/{num_tasks_total})")
+    my_bar.empty() 
 
-        annotations_result = task['annotations'][0]['result']
-        
-        for item_idx, item in enumerate(annotations_result):
-            if item['type'] == 'rectanglelabels' and item['from_name'] == 'box':
-                box_id = item['id']
-                field_annotation_value = item['value']
-                original_w = item['original_width']
-                original_h = item['original_height']
-                
-                id_pertanyaan = "N/A" 
-                try:
-                    id_pertanyaan = next(r['value']['text'][0] for r in annotations_result if r['from_name'] == 'nomor' and r['id'] == box_id)
-                except StopIteration: pass
+    if document_stats is None:
+        st.caption("Hasil diambil dari cache (PDF ini sudah pernah diproses dengan pengaturan yang sama).")
+    else:
+        show_document_stats(document_stats)
+    return all_extracted_results, io.BytesIO(excel_bytes)
 
-                halaman_str = "0"
-                try:
-                    halaman_str = next(r['value']['text'][0] for r in annotations_result if r['from_name'] == 'halaman' and r['id'] == box_id)
-                    page_idx = int(halaman_str) - 1
-                    if not (0 <= page_idx < len(pdf_images_pil)): continue
-                    current_page_image = pdf_images_pil[page_idx]
-                except (StopIteration, ValueError): continue
-                
-                # Panggil model untuk crop area pertanyaan
-                field_image_pil = model.model_crop_region(current_page_image, field_annotation_value, original_w, original_h)
-                
-                # Panggil model untuk deteksi karakter
-                char_boxes_detected = model.model_detect_chars(
-                    field_image_pil, model_s, device_obj, transform_s
-                )
-                
-                recognized_string = ""
-                confidences = []
-                for _, char_box_coords in enumerate(char_boxes_detected):
-                    x1, y1, x2, y2 = char_box_coords
-                    if x1 >= x2 or y1 >= y2: continue
-                    
-                    char_image_pil_single = field_image_pil.crop((x1, y1, x2, y2)) 
-                    if char_image_pil_single.width == 0 or char_image_pil_single.height == 0: continue
-                    
-                    # Panggil model untuk klasifikasi karakter
-                    char_pred, confidence = model.model_classify_char(
-                        char_image_pil_single, model_c, device_obj, transform_c
-                    )
-                    
-                    if char_pred == "?" or confidence < config.CHAR_CLASSIFICATION_THRESHOLD : 
-                        recognized_string += "?" 
-                    else:
-                        recognized_string += char_pred
-                    confidences.append(confidence)
+def show_document_stats(document_stats):
+    # Penghematan mode region, eskalasi adaptif, dan statistik pipeline (jika ada) untuk satu dokumen
+    render_stats = document_stats.get("render_stats")
+    if render_stats is not None:
+        savings_msg = (f"Mode region: {render_stats['region_pixels']:,} piksel dirender vs "
+                       f"{render_stats['full_page_pixels']:,} piksel halaman penuh "
+                       f"(hemat {render_stats['pixel_savings_pct']:.1f}%).")
+        print(savings_msg)
+        st.caption(savings_msg)
 
-                avg_confidence = np.mean(confidences) if confidences else 0.0
-                all_extracted_results.append({ 
-                    "ID_Pertanyaan": id_pertanyaan, "Halaman": halaman_str, 
-                    "Teks": recognized_string, "Avg_Conf": f"{avg_confidence:.2f}",
-                    "Image_PIL": field_image_pil, 
-                })
-    
-    my_bar.empty() 
+    escalation_stats = document_stats.get("escalation_stats")
+    if escalation_stats is not None:
+        st.caption(f"Mode adaptif: {escalation_stats['escalated_fields']} area diproses ulang dengan DPI tinggi, "
+                   f"{escalation_stats['improved_fields']} hasilnya lebih baik.")
 
-    # 4. Panggil model untuk membuat laporan Excel
-    excel_buffer_result = model.create_excel_report(all_extracted_results)
-    return all_extracted_results, excel_buffer_result
+    pipeline_stats = document_stats.get("pipeline_stats")
+    if pipeline_stats is not None:
+        with st.expander("Statistik pipeline per stage"):
+            st.json(pipeline_stats)
@@ -0,0 +1,173 @@
+# escalation.py
+# Pemrosesan ulang adaptif dua tingkat: semua area melewati jalur murah (backend,
+# DPI, dan template grid sesuai config), lalu hanya area yang ragu diproses ulang
+# dengan DPI tinggi, model fp32, dan test-time augmentation (TTA). Hasil ulang
+# hanya dipakai jika lebih baik daripada hasil jalur murah. Hasil akhir disimpan
+# ke cache area, sehingga area dari cache tidak dieskalasi ulang.
+
+import numpy as np
+import model
+import extraction
+import registration
+import result_cache
+import model_registry
+import profiling
+import config # Import file config
+
+# Varian kotak TTA dalam satuan jitter (lihat _tta_variants): (dx1, dy1, dx2, dy2)
+# Urutan: asli, diperbesar, diperkecil, geser kiri, geser kanan, geser atas, geser bawah
+_TTA_BOX_OFFSETS = [(0, 0, 0, 0), (-1, -1, 1, 1), (1, 1, -1, -1), (-1, 0, -1, 0), (1, 0, 1, 0), (0, -1, 0, -1), (0, 1, 0, 1)]
+
+def _tta_box_offsets(num_variants):
+    # Offset untuk num_variants varian (minimal 1); setelah daftar dasar habis, pola yang sama diulang dengan geseran kelipatan lebih besar
+    base_offsets = _TTA_BOX_OFFSETS[1:]
+    offsets = [_TTA_BOX_OFFSETS[0]]
+    while len(offsets) < num_variants:
+        step = 1 + (len(offsets) - 1) // len(base_offsets)
+        dx1, dy1, dx2, dy2 = base_offsets[(len(offsets) - 1) % len(base_offsets)]
+        offsets.append((dx1 * step, dy1 * step, dx2 * step, dy2 * step))
+    return offsets
+
+def expected_box_count(field, template_grids):
+    # Jumlah kotak karakter menurut template grid area ini (None jika tidak ada grid)
+    if template_grids is None or field is None: return None
+    grid = template_grids.get(field)
+    return len(grid["boxes"]) if grid is not None else None
+
+def _uncertain_chars(confidences):
+    # Karakter "?" selain crop kosong (confidence None): termasuk crop yang ditolak karena terlalu kecil (0.0)
+    return sum(1 for confidence in confidences if confidence is not None and confidence < config.CHAR_CLASSIFICATION_THRESHOLD)
+
+def _classified_mean(confidences):
+    classified = [confidence for confidence in confidences if confidence is not None]
+    return float(np.mean(classified)) if classified else None
+
+def escalation_reason(confidences, expected_count=None):
+    """
+    Alasan area perlu diproses ulang ("no_boxes", "box_count", "uncertain_chars",
+    "low_confidence"), atau None jika hasil jalur murah sudah cukup. Area yang
+    semua kotaknya kosong (tidak diisi responden) tidak dieskalasi.
+    """
+    if not confidences: return "no_boxes"
+    if expected_count is not None and len(confidences) != expected_count: return "box_count"
+    if _uncertain_chars(confidences) > 0: return "uncertain_chars"
+    classified_mean = _classified_mean(confidences)
+    if classified_mean is not None and classified_mean < config.ESCALATION_MIN_AVG_CONF: return "low_confidence"
+    return None
+
+def _result_score(confidences, expected_count):
+    # Makin kecil makin baik: jumlah kotak tidak sesuai, karakter ragu, lalu confidence rata-rata
+    count_mismatch = len(confidences) == 0 if expected_count is None else len(confidences) != expected_count
+    classified_mean = _classified_mean(confidences)
+    return (count_mismatch, _uncertain_chars(confidences), -(classified_mean if classified_mean is not None else 0.0))
+
+def _tta_variants(field_image_pil, char_box):
+    # Crop kotak asli + varian yang digeser/diperbesar/diperkecil sedikit (dibatasi tepi area)
+    x1, y1, x2, y2 = char_box
+    jitter_x = max(1, int(round((x2 - x1) * config.ESCALATION_TTA_JITTER_FRAC)))
+    jitter_y = max(1, int(round((y2 - y1) * config.ESCALATION_TTA_JITTER_FRAC)))
+    field_w, field_h = field_image_pil.size
+    variants = []
+    for dx1, dy1, dx2, dy2 in _tta_box_offsets(max(1, int(config.ESCALATION_TTA_VARIANTS))):
+        vx1, vy1 = max(0, x1 + dx1 * jitter_x), max(0, y1 + dy1 * jitter_y)
+        vx2, vy2 = min(field_w, x2 + dx2 * jitter_x), min(field_h, y2 + dy2 * jitter_y)
+        if vx2 > vx1 and vy2 > vy1: variants.append(field_image_pil.crop((vx1, vy1, vx2, vy2)))
+    return variants
+
+def render_fields_high_dpi(pdf_bytes, annotation_layout, fields, profiler=None):
+    # Render ulang halaman yang memuat area tersebut pada ESCALATION_DPI, lalu crop (dengan registrasi jika aktif)
+    wanted_field_idxs = {field.field_idx for field in fields}
+    page_references = registration.get_active_references(annotation_layout)
+    field_images = {}
+    with profiling.stage(profiler, "escalation_render"):
+        page_numbers = sorted({field.page_number for field in fields})
+        for page_number, page_image in model.model_iter_pdf_pages(pdf_bytes, page_numbers, dpi=config.ESCALATION_DPI, profiler=profiler):
+            for field, field_image_pil in registration.crop_page_fields(annotation_layout, page_number, page_image, page_references, profiler):
+                if field.field_idx in wanted_field_idxs: field_images[field.field_idx] = field_image_pil
+            del page_image
+    return field_images
+
+def recognize_fields_high_precision(field_images, device_obj, profiler=None):
+    """
+    Deteksi (SSD) dan klasifikasi dengan model ESCALATION_BACKEND (default fp32)
+    dan TTA untuk list gambar area. Mengembalikan (list teks, list list confidence).
+    """
+    model_s, model_c = model_registry.get_models(device_obj, backend=config.ESCALATION_BACKEND)
+    with profiling.stage(profiler, "escalation_detect"):
+        char_boxes_per_field = model.model_detect_chars_batch(field_images, model_s, device_obj, model.get_ssd_transform(), profiler=profiler)
+    variant_groups, owner_field_idxs = [], []
+    for field_idx, (field_image_pil, char_boxes) in enumerate(zip(field_images, char_boxes_per_field)):
+        for char_box in char_boxes:
+            variants = _tta_variants(field_image_pil, char_box)
+            if not variants: continue
+            variant_groups.append(variants)
+            owner_field_idxs.append(field_idx)
+    with profiling.stage(profiler, "escalation_classify"):
+        char_predictions = model.model_classify_chars_tta(variant_groups, model_c, device_obj, profiler=profiler)
+    return extraction.assemble_field_texts(len(field_images), owner_field_idxs, char_predictions)
+
+def escalate_field_results(pdf_bytes, annotation_layout, field_results, device_obj, template_grids=None,
+                           progress_callback=None, profiler=None, field_keys=None, cached_positions=()):
+    """
+    Tingkat kedua untuk list (field, gambar area, teks, list confidence) hasil jalur
+    murah: area yang ragu (lihat escalation_reason) dirender ulang pada DPI tinggi
+    dan dikenali dengan model presisi penuh + TTA; hasilnya menggantikan hasil
+    murah hanya jika skornya lebih baik. Gambar area di hasil tetap crop jalur murah.
+    `field_keys` (kunci cache area sejajar field_results, None jika cache mati) dan
+    `cached_positions` (indeks hasil yang diambil dari cache) berasal dari jalur murah
+    (recognize_fields/pipeline): area dari cache sudah berupa hasil akhir dan dilewati;
+    hasil akhir area lainnya disimpan ke cache. Mengembalikan (list hasil baru, dict
+    statistik eskalasi).
+    """
+    escalation_stats = {"escalated_fields": 0, "improved_fields": 0, "cached_fields": 0, "reasons": {}}
+    cached_positions = set(cached_positions)
+    escalation_stats["cached_fields"] = len(cached_positions)
+    candidates = []
+    for result_idx, (field, _, _, confidences) in enumerate(field_results):
+        if result_idx in cached_positions: continue
+        reason = escalation_reason(confidences, expected_box_count(field, template_grids))
+        if reason is None: continue
+        candidates.append(result_idx)
+        escalation_stats["reasons"][reason] = escalation_stats["reasons"].get(reason, 0) + 1
+    if config.ESCALATION_MAX_FIELDS_FRAC < 1.0:
+        # Batasi biaya pada dokumen yang sangat buruk: dahulukan area dengan skor terburuk
+        max_fields = int(len(field_results) * config.ESCALATION_MAX_FIELDS_FRAC)
+        candidates = sorted(candidates, key=lambda result_idx: _result_score(
+            field_results[result_idx][3], expected_box_count(field_results[result_idx][0], template_grids)
+        ), reverse=True)[:max_fields]
+    profiling.count(profiler, "escalated_fields", len(candidates))
+    escalation_stats["escalated_fields"] = len(candidates)
+    if not candidates:
+        _store_final_values(field_results, field_keys, cached_positions, profiler)
+        return field_results, escalation_stats
+
+    if progress_callback is not None:
+        progress_callback(1.0, f"Memproses ulang {len(candidates)} area yang ragu dengan DPI tinggi...")
+    try:
+        high_dpi_images = render_fields_high_dpi(pdf_bytes, annotation_layout, [field_results[i][0] for i in candidates], profiler)
+    except model.PdfRenderError as e:
+        raise extraction.ExtractionError(f"Gagal merender ulang area dengan DPI tinggi: {e}") from e
+    rendered_candidates = [i for i in candidates if field_results[i][0].field_idx in high_dpi_images]
+    recognized_strings, confidences_per_field = recognize_fields_high_precision(
+        [high_dpi_images[field_results[i][0].field_idx] for i in rendered_candidates], device_obj, profiler
+    )
+
+    new_field_results = list(field_results)
+    for result_idx, recognized_string, confidences in zip(rendered_candidates, recognized_strings, confidences_per_field):
+        field, field_image_pil, _, cheap_confidences = field_results[result_idx]
+        expected_count = expected_box_count(field, template_grids)
+        if _result_score(confidences, expected_count) < _result_score(cheap_confidences, expected_count):
+            new_field_results[result_idx] = (field, field_image_pil, recognized_string, confidences)
+            escalation_stats["improved_fields"] += 1
+    profiling.count(profiler, "escalation_improved_fields", escalation_stats["improved_fields"])
+    _store_final_values(new_field_results, field_keys, cached_positions, profiler)
+    return new_field_results, escalation_stats
+
+def _store_final_values(field_results, field_keys, cached_positions, profiler=None):
+    # Hasil akhir (setelah eskalasi) untuk area yang belum ada di cache
+    if field_keys is None: return
+    with profiling.stage(profiler, "field_cache_store"):
+        result_cache.put_fields({
+            field_keys[result_idx]: (recognized_string, confidences)
+            for result_idx, (_, _, recognized_string, confidences) in enumerate(field_results) if result_idx not in cached_positions
+        })
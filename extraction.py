@@ -0,0 +1,354 @@
+# extraction.py
+# Alur inti ekstraksi satu dokumen tanpa ketergantungan ke Streamlit,
+# dipakai oleh controller (UI) maupun worker batch/CLI.
+
+import os
+import numpy as np
+import model
+import layout
+import pipeline
+import result_cache
+import result_records
+import registration
+import template_grid
+import escalation
+import profiling
+import config # Import file config
+
+class ExtractionError(Exception):
+    """Error yang pesannya layak ditampilkan langsung ke pengguna."""
+
+def _noop_progress(fraction, text):
+    pass
+
+def render_field_images(pdf_bytes, annotation_layout, extraction_mode=None, progress_callback=None, profiler=None):
+    """
+    Render gambar setiap area anotasi dari PDF. Mengembalikan (list gambar PIL yang
+    sejajar dengan annotation_layout.fields, None untuk area di halaman yang tidak
+    ada; jumlah halaman yang berhasil dirender; statistik render mode region atau None).
+    Melempar ExtractionError jika ada halaman/area yang ada di PDF gagal dirender,
+    agar dokumen setengah jadi tidak dianggap berhasil (dan tidak masuk cache).
+    """
+    if extraction_mode is None: extraction_mode = config.EXTRACTION_MODE
+    if progress_callback is None: progress_callback = _noop_progress
+    field_specs = annotation_layout.fields
+    num_pages_total = len(annotation_layout.page_numbers)
+    progress_text_area = "Merender halaman dan memproses anotasi pertanyaan PDF..."
+
+    field_images = [None] * len(field_specs)
+    pages_rendered = 0
+    render_stats = None
+    try:
+        if extraction_mode == "region":
+            # Render hanya persegi area anotasi dengan DPI per area
+            progress_callback(0.0, f"Merender {len(field_specs)} area anotasi langsung dari PDF...")
+            field_images, render_stats = model.model_render_pdf_regions(
+                pdf_bytes, [(field.page_number, field.value) for field in field_specs], profiler=profiler
+            )
+            pages_rendered = len({field_specs[i].page_number for i, img in enumerate(field_images) if img is not None})
+        else:
+            # Render hanya halaman yang dipakai anotasi, crop area, lalu lepas halamannya
+            # Registrasi halaman (jika aktif) dihitung sekali per halaman lalu dipakai semua area di halaman itu
+            page_references = registration.get_active_references(annotation_layout)
+            progress_callback(0.0, f"{progress_text_area} (0/{num_pages_total})")
+            for page_number, current_page_image in model.model_iter_pdf_pages(pdf_bytes, annotation_layout.page_numbers, profiler=profiler):
+                pages_rendered += 1
+                progress_callback(pages_rendered / max(1, num_pages_total), f"{progress_text_area} ({pages_rendered}/{num_pages_total})")
+                for field, field_image_pil in registration.crop_page_fields(annotation_layout, page_number, current_page_image, page_references, profiler):
+                    field_images[field.field_idx] = field_image_pil
+                del current_page_image
+    except model.PdfRenderError as e:
+        raise ExtractionError(f"Gagal mengkonversi PDF ke gambar: {e}") from e
+    return field_images, pages_rendered, render_stats
+
+def collect_char_crops(field_images, char_boxes_per_field):
+    # Crop semua kotak karakter; mengembalikan (list crop, list indeks area pemiliknya)
+    char_images_all = []
+    char_owner_field_idx = []
+    for field_idx, (field_image_pil, char_boxes_detected) in enumerate(zip(field_images, char_boxes_per_field)):
+        for char_box_coords in char_boxes_detected:
+            x1, y1, x2, y2 = char_box_coords
+            if x1 >= x2 or y1 >= y2: continue
+
+            char_image_pil_single = field_image_pil.crop((x1, y1, x2, y2))
+            if char_image_pil_single.width == 0 or char_image_pil_single.height == 0: continue
+            char_images_all.append(char_image_pil_single)
+            char_owner_field_idx.append(field_idx)
+    return char_images_all, char_owner_field_idx
+
+def assemble_field_texts(num_fields, char_owner_field_idx, char_predictions):
+    # Gabungkan prediksi karakter per area; karakter ragu dan crop kosong (confidence None) menjadi "?"
+    recognized_strings = [""] * num_fields
+    confidences_per_field = [[] for _ in range(num_fields)]
+    for field_idx, (char_pred, confidence) in zip(char_owner_field_idx, char_predictions):
+        if char_pred == "?" or confidence is None or confidence < config.CHAR_CLASSIFICATION_THRESHOLD :
+            recognized_strings[field_idx] += "?"
+        else:
+            recognized_strings[field_idx] += char_pred
+        confidences_per_field[field_idx].append(confidence)
+    return recognized_strings, confidences_per_field
+
+def build_result_record(field, recognized_string, confidences, field_image_pil):
+    # Crop di-encode sekali ke PNG + thumbnail; PIL penuh dilepas setelah record dibuat
+    # Crop kosong (confidence None) dihitung 0 pada rata-rata
+    avg_confidence = np.mean([confidence or 0.0 for confidence in confidences]) if confidences else 0.0
+    return result_records.FieldResult.from_image(
+        field.id_pertanyaan, field.halaman_str, recognized_string, f"{avg_confidence:.2f}", field_image_pil
+    )
+
+def extract_document(pdf_bytes, selected_gender_str, model_s, model_c, device_obj,
+                     extraction_mode=None, progress_callback=None, use_pipeline=None, profiler=None,
+                     scheduler=None, document_tag=None):
+    """
+    Jalankan seluruh alur ekstraksi untuk satu PDF: render area, deteksi kotak
+    karakter (batch), klasifikasi karakter (batch), lalu susun hasil per area.
+    Dengan `use_pipeline` (mode "page"), tahap-tahap tersebut berjalan tumpang
+    tindih sebagai pipeline (lihat pipeline.py). Mengembalikan (list dict hasil,
+    dict statistik dokumen). Melempar ExtractionError jika anotasi tidak ada
+    atau PDF gagal dirender. Jika `profiler` (profiling.ExtractionProfiler)
+    diberikan, waktu per stage dan penghitungnya dicatat di sana. Dengan
+    `scheduler` (batch_scheduler.InferenceScheduler), deteksi dan klasifikasi
+    dikemas ke batch bersama dokumen lain yang sedang berjalan; `document_tag`
+    menandai item dokumen ini di statistik scheduler.
+    """
+    if progress_callback is None: progress_callback = _noop_progress
+    if extraction_mode is None: extraction_mode = config.EXTRACTION_MODE
+    if use_pipeline is None: use_pipeline = config.PIPELINE_ENABLED
+    if scheduler is not None and document_tag is None: document_tag = id(pdf_bytes)
+
+    # 1. Load layout anotasi area (dikompilasi sekali dan di-cache per file)
+    with profiling.stage(profiler, "load_layout"):
+        annotation_layout = layout.load_layout_for_gender(selected_gender_str)
+    if annotation_layout is None:
+        annotation_crop_filename = os.path.basename(layout.get_annotation_path(selected_gender_str))
+        raise ExtractionError(f"File anotasi area '{annotation_crop_filename}' tidak ditemukan. Pastikan ada di: '{config.APP_DATA_PATH}'")
+
+    if use_pipeline and extraction_mode == "page":
+        return _extract_document_pipelined(pdf_bytes, annotation_layout, model_s, model_c, device_obj, progress_callback, profiler,
+                                           scheduler, document_tag)
+
+    # 2. Render area pertanyaan dari PDF
+    field_images, pages_rendered, render_stats = render_field_images(
+        pdf_bytes, annotation_layout, extraction_mode, progress_callback, profiler
+    )
+    if pages_rendered == 0:
+        raise ExtractionError("Gagal mengkonversi PDF ke gambar.")
+
+    # Area pada halaman yang tidak ada di PDF dilewati, urutan anotasi tetap dipertahankan
+    field_entries = [
+        (field, field_image_pil)
+        for field, field_image_pil in zip(annotation_layout.fields, field_images) if field_image_pil is not None
+    ]
+    entry_images = [entry[1] for entry in field_entries]
+    # Mode "region" merender tiap area dengan DPI sendiri; batas ukuran karakter diskalakan per area
+    entry_size_scales = None
+    if render_stats is not None:
+        entry_size_scales = [model.model_char_size_scale(render_stats["dpi_per_region"][field.field_idx]) for field, _ in field_entries]
+
+    # 3-4. Deteksi + klasifikasi (batch), area yang crop-nya sudah pernah diproses diambil dari cache
+    template_grids = template_grid.get_active_grids(annotation_layout)
+    recognized_strings, confidences_per_field, recognize_stats, (field_keys, cached_positions) = recognize_fields(
+        entry_images, model_s, model_c, device_obj, progress_callback, profiler,
+        fields=[entry[0] for entry in field_entries], template_grids=template_grids,
+        scheduler=scheduler, document_tag=document_tag, size_scales=entry_size_scales
+    )
+    field_results = [
+        (field, field_image_pil, recognized_strings[field_idx], confidences_per_field[field_idx])
+        for field_idx, (field, field_image_pil) in enumerate(field_entries)
+    ]
+
+    # 5. (Opsional) Area yang ragu diproses ulang dengan DPI tinggi, model fp32, dan TTA
+    field_results, escalation_stats = escalate_if_enabled(
+        pdf_bytes, annotation_layout, field_results, device_obj, template_grids, progress_callback, profiler,
+        field_keys, cached_positions
+    )
+
+    all_extracted_results = [
+        build_result_record(field, recognized_string, confidences, field_image_pil)
+        for field, field_image_pil, recognized_string, confidences in field_results
+    ]
+    document_stats = {
+        "pages_rendered": pages_rendered, "fields": len(field_entries),
+        "chars": sum(len(confidences) for _, _, _, confidences in field_results),
+        "field_cache_hits": recognize_stats["field_cache_hits"],
+        "grid_fields": recognize_stats["grid_fields"], "render_stats": render_stats,
+        "escalation_stats": escalation_stats,
+    }
+    return all_extracted_results, document_stats
+
+def escalate_if_enabled(pdf_bytes, annotation_layout, field_results, device_obj, template_grids=None,
+                        progress_callback=None, profiler=None, field_keys=None, cached_positions=()):
+    # Tingkat kedua mode adaptif (lihat escalation.py); tanpa ADAPTIVE_ESCALATION_ENABLED hasil dikembalikan apa adanya
+    # field_keys/cached_positions dari jalur murah dipakai ulang agar kunci dan lookup cache tidak dihitung dua kali
+    if not config.ADAPTIVE_ESCALATION_ENABLED: return field_results, None
+    return escalation.escalate_field_results(
+        pdf_bytes, annotation_layout, field_results, device_obj, template_grids, progress_callback, profiler,
+        field_keys, cached_positions
+    )
+
+def extract_document_with_report(pdf_bytes, selected_gender_str, model_s, model_c, device_obj, extraction_mode=None,
+                                 progress_callback=None, use_pipeline=None, profiler=None, torch_trace_path=None):
+    """
+    extract_document + laporan Excel, memakai cache dokumen (PDF, anotasi, model,
+    dan threshold identik diambil langsung dari cache). Dipakai controller (UI) dan
+    worker antrian job. Mengembalikan (list hasil, bytes Excel, dict statistik
+    dokumen atau None jika hasil diambil dari cache). Melempar ExtractionError.
+    """
+    if extraction_mode is None: extraction_mode = config.EXTRACTION_MODE
+    if profiler is not None:
+        profiler.metadata.update({"gender": selected_gender_str, "extraction_mode": extraction_mode,
+                                  "use_pipeline": bool(use_pipeline if use_pipeline is not None else config.PIPELINE_ENABLED)})
+    with profiling.stage(profiler, "result_cache_lookup"):
+        document_key = result_cache.compute_document_key(pdf_bytes, selected_gender_str, extraction_mode)
+        cached_document = result_cache.get_document(document_key)
+    if cached_document is not None and cached_document[1] is not None:
+        profiling.count(profiler, "document_cache_hits")
+        if profiler is not None: profiler.finish()
+        return cached_document[0], cached_document[1], None
+
+    try:
+        with profiling.torch_trace(profiler, torch_trace_path):
+            all_extracted_results, document_stats = extract_document(
+                pdf_bytes, selected_gender_str, model_s, model_c, device_obj,
+                extraction_mode=extraction_mode, progress_callback=progress_callback,
+                use_pipeline=use_pipeline, profiler=profiler
+            )
+    except ExtractionError:
+        if profiler is not None: profiler.finish()
+        raise
+
+    with profiling.stage(profiler, "excel_report"):
+        excel_bytes = model.create_excel_report(all_extracted_results).getvalue()
+    with profiling.stage(profiler, "result_cache_store"):
+        result_cache.put_document(document_key, all_extracted_results, excel_bytes)
+    if profiler is not None: profiler.finish()
+    return all_extracted_results, excel_bytes, document_stats
+
+def compute_field_cache_keys(field_images, fields=None, template_grids=None):
+    # None jika cache level area dimatikan
+    if not (config.RESULT_CACHE_ENABLED and config.FIELD_CACHE_ENABLED): return None
+    # Dengan template grid, kotak karakter diambil dari grid milik area tersebut: crop identik di
+    # area lain (mis. dua area kosong) bisa menghasilkan teks lain, jadi identitas area ikut di kunci
+    field_identities = None
+    if template_grids is not None and fields is not None:
+        field_identities = [f"{template_grids.layout_hash}:{field.field_idx}" for field in fields]
+    return result_cache.compute_field_keys(field_images, field_identities)
+
+def store_field_values(new_field_values, profiler=None):
+    # Dengan eskalasi adaptif, cache area hanya berisi hasil akhir (disimpan oleh escalation.py), bukan hasil jalur murah
+    if config.ADAPTIVE_ESCALATION_ENABLED: return
+    with profiling.stage(profiler, "field_cache_store"):
+        result_cache.put_fields(new_field_values)
+
+def recognize_fields(field_images, model_s, model_c, device_obj, progress_callback=None, profiler=None,
+                     fields=None, template_grids=None, scheduler=None, document_tag=None, size_scales=None):
+    """
+    Deteksi kotak karakter (batch) lalu klasifikasi semua karakter (batch) untuk
+    list gambar area. Area yang hash pikselnya ada di cache area tidak diproses
+    ulang. Jika `template_grids` (lihat template_grid.py) dan `fields` (LayoutField
+    sejajar field_images) diberikan, kotak karakter diambil dari grid dan SSD hanya
+    dipakai untuk area yang penyelarasannya ragu. `scheduler`/`document_tag`
+    diteruskan ke model (lihat batch_scheduler.py). `size_scales` (opsional, sejajar
+    field_images, lihat model.model_char_size_scale) dipakai untuk area yang dirender
+    dengan DPI berbeda dari PDF_RENDER_DPI. Mengembalikan (list teks, list
+    list confidence, dict statistik, (kunci cache area atau None, list indeks area
+    yang diambil dari cache)); bagian terakhir diteruskan ke escalate_if_enabled.
+    """
+    if progress_callback is None: progress_callback = _noop_progress
+    recognized_strings = [""] * len(field_images)
+    confidences_per_field = [[] for _ in field_images]
+
+    with profiling.stage(profiler, "field_cache_lookup"):
+        field_keys = compute_field_cache_keys(field_images, fields, template_grids)
+        cached_fields = result_cache.get_fields(field_keys) if field_keys is not None else {}
+    pending_indices = []
+    for field_idx in range(len(field_images)):
+        cached_value = cached_fields.get(field_keys[field_idx]) if field_keys is not None else None
+        if cached_value is not None:
+            recognized_strings[field_idx], confidences_per_field[field_idx] = cached_value
+        else:
+            pending_indices.append(field_idx)
+    pending_images = [field_images[i] for i in pending_indices]
+    pending_scales = [size_scales[i] for i in pending_indices] if size_scales is not None else None
+
+    # Kotak dari template grid; sisanya (None) dideteksi SSD untuk semua area sekaligus (batch).
+    # Pergeseran halaman dihitung dari semua area, termasuk yang ada di cache, agar kotak tidak bergantung isi cache
+    if template_grids is not None and fields is not None and pending_indices:
+        grid_boxes_all = template_grid.match_fields(template_grids, fields, field_images, profiler)
+        char_boxes_per_field = [grid_boxes_all[i] for i in pending_indices]
+    else:
+        char_boxes_per_field = [None] * len(pending_images)
+    detect_positions = [pos for pos, char_boxes in enumerate(char_boxes_per_field) if char_boxes is None]
+    progress_callback(1.0, f"Mendeteksi karakter pada {len(detect_positions)} area pertanyaan...")
+    detected_boxes = model.model_detect_chars_batch(
+        [pending_images[pos] for pos in detect_positions], model_s, device_obj, model.get_ssd_transform(), profiler=profiler,
+        scheduler=scheduler, document_tag=document_tag,
+        size_scales=[pending_scales[pos] for pos in detect_positions] if pending_scales is not None else None
+    )
+    for pos, char_boxes in zip(detect_positions, detected_boxes):
+        char_boxes_per_field[pos] = char_boxes
+
+    # Kumpulkan semua crop karakter lalu klasifikasi sekaligus (batch)
+    with profiling.stage(profiler, "char_crop"):
+        char_images_all, char_owner_field_idx = collect_char_crops(pending_images, char_boxes_per_field)
+    progress_callback(1.0, f"Mengklasifikasi {len(char_images_all)} karakter...")
+    char_predictions = model.model_classify_chars_batch(
+        char_images_all, model_c, device_obj, profiler=profiler, scheduler=scheduler, document_tag=document_tag,
+        size_scales=[pending_scales[owner] for owner in char_owner_field_idx] if pending_scales is not None else None
+    )
+    pending_strings, pending_confidences = assemble_field_texts(
+        len(pending_images), char_owner_field_idx, char_predictions
+    )
+
+    new_field_values = {}
+    for pending_idx, field_idx in enumerate(pending_indices):
+        recognized_strings[field_idx] = pending_strings[pending_idx]
+        confidences_per_field[field_idx] = pending_confidences[pending_idx]
+        if field_keys is not None:
+            new_field_values[field_keys[field_idx]] = (pending_strings[pending_idx], pending_confidences[pending_idx])
+    store_field_values(new_field_values, profiler)
+    profiling.count(profiler, "fields", len(field_images))
+    profiling.count(profiler, "field_cache_hits", len(field_images) - len(pending_indices))
+
+    recognize_stats = {
+        "chars": sum(len(confidences) for confidences in confidences_per_field),
+        "chars_classified": len(char_images_all),
+        "field_cache_hits": len(field_images) - len(pending_indices),
+        "grid_fields": len(pending_indices) - len(detect_positions),
+    }
+    pending_set = set(pending_indices)
+    cached_positions = [field_idx for field_idx in range(len(field_images)) if field_idx not in pending_set]
+    return recognized_strings, confidences_per_field, recognize_stats, (field_keys, cached_positions)
+
+def _extract_document_pipelined(pdf_bytes, annotation_layout, model_s, model_c, device_obj, progress_callback, profiler=None,
+                                scheduler=None, document_tag=None):
+    # Error callback progres (mis. job dibatalkan) diteruskan apa adanya; error stage menjadi ExtractionError
+    try:
+        field_results, pages_rendered, pipeline_stats, (field_keys, cached_positions) = pipeline.run_document_pipeline(
+            pdf_bytes, annotation_layout, model_s, model_c, device_obj, progress_callback, profiler, scheduler, document_tag
+        )
+    except pipeline.StageError as e_stage:
+        raise ExtractionError(f"Ekstraksi gagal di tahap '{e_stage.stage_name}': {e_stage.__cause__}") from e_stage
+    if pages_rendered == 0:
+        raise ExtractionError("Gagal mengkonversi PDF ke gambar.")
+
+    field_results, escalation_stats = escalate_if_enabled(
+        pdf_bytes, annotation_layout, field_results, device_obj, template_grid.get_active_grids(annotation_layout),
+        progress_callback, profiler, field_keys, cached_positions
+    )
+    all_extracted_results = [
+        build_result_record(field, recognized_string, confidences, field_image_pil)
+        for field, field_image_pil, recognized_string, confidences in field_results
+    ]
+    document_stats = {
+        "pages_rendered": pages_rendered, "fields": len(field_results),
+        "chars": sum(len(confidences) for _, _, _, confidences in field_results),
+        "field_cache_hits": pipeline_stats["field_cache_hits"],
+        "grid_fields": pipeline_stats["grid_fields"], "render_stats": None, "pipeline_stats": pipeline_stats,
+        "escalation_stats": escalation_stats,
+    }
+    return all_extracted_results, document_stats
+
+def strip_result_images(results_data):
+    # Salinan hasil tanpa gambar PIL (untuk JSON/CSV atau dikirim antar proses)
+    return [{key: value for key, value in res_data.items() if key != "Image_PIL"} for res_data in results_data]
@@ -0,0 +1,570 @@
+# job_queue.py
+# Antrian job ekstraksi di disk (SQLite): upload langsung mendapat ID job, worker yang
+# memegang model memproses job di latar belakang, lalu status, progres, dan hasil
+# diambil dengan polling (UI Streamlit, HTTP, atau CLI).
+#
+# Contoh:
+#   python job_queue.py worker --workers 2
+#   python job_queue.py serve --port 8502 --workers 2
+#   python job_queue.py submit data/kuesioner.pdf --gender pria --wait
+#   python job_queue.py result <job_id> --output hasil.xlsx
+
+import os
+import sys
+import json
+import time
+import uuid
+import pickle
+import sqlite3
+import argparse
+import threading
+import multiprocessing
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import config # Import file config
+
+JOB_STATUSES = ["queued", "running", "done", "failed", "cancelled"]
+FINISHED_STATUSES = ("done", "failed", "cancelled")
+
+_JOB_COLUMNS = [
+    "id", "status", "filename", "gender", "extraction_mode", "use_pipeline", "profile", "progress", "progress_text",
+    "error", "attempts", "worker_id", "cancel_requested", "created_at", "started_at", "heartbeat_at", "finished_at",
+    "stats", "profile_data",
+]
+
+_connection_local = threading.local()
+_embedded_workers = []
+_embedded_workers_lock = threading.Lock()
+
+class JobCancelled(Exception):
+    """Dilempar di dalam worker saat job dibatalkan selagi berjalan."""
+
+class JobLost(Exception):
+    """Dilempar di dalam worker saat job sudah bukan miliknya (diantrikan ulang atau digagalkan karena dianggap mati)."""
+
+def _get_connection():
+    # Satu koneksi SQLite per thread (autocommit); WAL agar UI, HTTP, dan worker antar proses tidak saling kunci
+    connection = getattr(_connection_local, "connection", None)
+    queue_path = os.path.abspath(config.JOB_QUEUE_PATH)
+    if connection is not None and _connection_local.path == queue_path: return connection
+    os.makedirs(os.path.dirname(queue_path), exist_ok=True)
+    connection = sqlite3.connect(queue_path, timeout=30, isolation_level=None)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, status TEXT, filename TEXT, gender TEXT, "
+        "extraction_mode TEXT, use_pipeline INTEGER, profile INTEGER, progress REAL, progress_text TEXT, error TEXT, "
+        "attempts INTEGER, worker_id TEXT, cancel_requested INTEGER, created_at REAL, started_at REAL, "
+        "heartbeat_at REAL, finished_at REAL, stats TEXT, profile_data TEXT)"
+    )
+    connection.execute("CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at)")
+    # Input dan hasil di tabel terpisah agar query status tidak membaca blob
+    connection.execute("CREATE TABLE IF NOT EXISTS job_inputs (id TEXT PRIMARY KEY, pdf BLOB)")
+    connection.execute("CREATE TABLE IF NOT EXISTS job_results (id TEXT PRIMARY KEY, payload BLOB)")
+    _connection_local.connection = connection
+    _connection_local.path = queue_path
+    return connection
+
+def _row_to_job(row):
+    job = dict(zip(_JOB_COLUMNS, row))
+    job["use_pipeline"], job["profile"], job["cancel_requested"] = bool(job["use_pipeline"]), bool(job["profile"]), bool(job["cancel_requested"])
+    job["stats"] = json.loads(job["stats"]) if job["stats"] else None
+    job["profile_data"] = json.loads(job["profile_data"]) if job["profile_data"] else None
+    return job
+
+def submit_job(pdf_bytes, filename, selected_gender_str, extraction_mode=None, use_pipeline=None, profile=False):
+    """Simpan PDF ke antrian dan kembalikan ID job (langsung, tanpa menunggu ekstraksi)."""
+    if extraction_mode is None: extraction_mode = config.EXTRACTION_MODE
+    if use_pipeline is None: use_pipeline = config.PIPELINE_ENABLED
+    job_id = uuid.uuid4().hex
+    connection = _get_connection()
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        connection.execute("INSERT INTO job_inputs (id, pdf) VALUES (?, ?)", (job_id, pdf_bytes))
+        connection.execute(
+            f"INSERT INTO jobs ({', '.join(_JOB_COLUMNS)}) VALUES ({', '.join('?' * len(_JOB_COLUMNS))})",
+            (job_id, "queued", filename, selected_gender_str, extraction_mode, int(bool(use_pipeline)), int(bool(profile)),
+             0.0, "Menunggu di antrian...", None, 0, None, 0, time.time(), None, None, None, None, None)
+        )
+        connection.execute("COMMIT")
+    except Exception:
+        connection.execute("ROLLBACK")
+        raise
+    return job_id
+
+def get_job(job_id):
+    """Status job sebagai dict (tanpa input/hasil), atau None jika ID tidak dikenal."""
+    row = _get_connection().execute(f"SELECT {', '.join(_JOB_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    if row is None: return None
+    job = _row_to_job(row)
+    if job["status"] == "queued":
+        job["queue_position"] = _get_connection().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created_at <= ?", (job["created_at"],)
+        ).fetchone()[0]
+    return job
+
+def list_jobs(status=None, limit=50):
+    query = f"SELECT {', '.join(_JOB_COLUMNS)} FROM jobs"
+    params = []
+    if status is not None:
+        query += " WHERE status = ?"
+        params.append(status)
+    query += " ORDER BY created_at DESC LIMIT ?"
+    params.append(int(limit))
+    return [_row_to_job(row) for row in _get_connection().execute(query, params).fetchall()]
+
+def get_job_result(job_id, include_images=True):
+    """(list hasil, bytes Excel) untuk job yang selesai, atau None jika belum ada."""
+    import result_cache
+    row = _get_connection().execute("SELECT payload FROM job_results WHERE id = ?", (job_id,)).fetchone()
+    if row is None: return None
+    payload = pickle.loads(row[0])
+    if not include_images:
+        results_data = [{key: value for key, value in item.items() if key not in ("Image_PNG", "Thumbnail_PNG")} for item in payload["results"]]
+        return results_data, payload["excel"]
+    return result_cache.decode_results(payload["results"]), payload["excel"]
+
+def cancel_job(job_id):
+    """
+    Batalkan job. Job yang masih antri langsung dibatalkan; job yang sedang
+    berjalan ditandai dan dihentikan worker pada pembaruan progres berikutnya.
+    Mengembalikan status job setelahnya (None jika ID tidak dikenal).
+    """
+    connection = _get_connection()
+    connection.execute(
+        "UPDATE jobs SET status = 'cancelled', finished_at = ?, progress_text = 'Dibatalkan' WHERE id = ? AND status = 'queued'",
+        (time.time(), job_id)
+    )
+    connection.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'", (job_id,))
+    connection.execute("DELETE FROM job_inputs WHERE id = ? AND id IN (SELECT id FROM jobs WHERE status = 'cancelled')", (job_id,))
+    job = get_job(job_id)
+    return job["status"] if job is not None else None
+
+def claim_next_job(worker_id):
+    """Ambil job antri paling lama secara atomik dan tandai 'running'. None jika antrian kosong."""
+    connection = _get_connection()
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        row = connection.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1").fetchone()
+        if row is None:
+            connection.execute("COMMIT")
+            return None
+        now = time.time()
+        connection.execute(
+            "UPDATE jobs SET status = 'running', worker_id = ?, started_at = ?, heartbeat_at = ?, attempts = attempts + 1, "
+            "progress = 0.0, progress_text = 'Memulai ekstraksi...' WHERE id = ?",
+            (worker_id, now, now, row[0])
+        )
+        connection.execute("COMMIT")
+    except Exception:
+        connection.execute("ROLLBACK")
+        raise
+    return get_job(row[0])
+
+def update_progress(job_id, worker_id, fraction, text):
+    # Sekaligus heartbeat; JobLost dilempar jika job sudah bukan milik worker ini, JobCancelled jika diminta berhenti
+    connection = _get_connection()
+    cursor = connection.execute(
+        "UPDATE jobs SET progress = ?, progress_text = ?, heartbeat_at = ? WHERE id = ? AND worker_id = ? AND status = 'running'",
+        (float(min(1.0, max(0.0, fraction))), text, time.time(), job_id, worker_id)
+    )
+    if cursor.rowcount == 0: raise JobLost(f"Job {job_id} sudah tidak dimiliki worker {worker_id}")
+    if is_cancel_requested(job_id): raise JobCancelled(f"Job {job_id} dibatalkan")
+
+def is_cancel_requested(job_id):
+    row = _get_connection().execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return row is not None and bool(row[0])
+
+def _finish_job(job_id, worker_id, status, error=None, result_payload=None, stats=None, profile_data=None):
+    # False (tanpa perubahan apa pun) jika job sudah bukan milik worker ini, mis. sudah diantrikan ulang
+    connection = _get_connection()
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        cursor = connection.execute(
+            "UPDATE jobs SET status = ?, error = ?, progress = ?, progress_text = ?, finished_at = ?, stats = ?, profile_data = ? "
+            "WHERE id = ? AND worker_id = ? AND status = 'running'",
+            (status, error, 1.0 if status == "done" else None, {"done": "Selesai", "failed": "Gagal", "cancelled": "Dibatalkan"}[status],
+             time.time(), json.dumps(stats, default=str) if stats is not None else None,
+             json.dumps(profile_data, default=str) if profile_data is not None else None, job_id, worker_id)
+        )
+        if cursor.rowcount == 0:
+            connection.execute("ROLLBACK")
+            return False
+        if result_payload is not None:
+            connection.execute("INSERT OR REPLACE INTO job_results (id, payload) VALUES (?, ?)", (job_id, result_payload))
+        connection.execute("DELETE FROM job_inputs WHERE id = ?", (job_id,))
+        connection.execute("COMMIT")
+    except Exception:
+        connection.execute("ROLLBACK")
+        raise
+    return True
+
+def requeue_stale_jobs(stale_after_s=None):
+    """
+    Job 'running' tanpa heartbeat selama stale_after_s (worker mati) diantrikan
+    ulang, atau digagalkan jika sudah dicoba JOB_MAX_ATTEMPTS kali.
+    """
+    if stale_after_s is None: stale_after_s = config.JOB_STALE_AFTER_S
+    connection = _get_connection()
+    min_heartbeat_at = time.time() - stale_after_s
+    connection.execute(
+        "UPDATE jobs SET status = 'failed', finished_at = ?, error = 'Worker berhenti saat memproses job', progress_text = 'Gagal' "
+        "WHERE status = 'running' AND heartbeat_at < ? AND attempts >= ?",
+        (time.time(), min_heartbeat_at, config.JOB_MAX_ATTEMPTS)
+    )
+    connection.execute(
+        "UPDATE jobs SET status = 'queued', worker_id = NULL, progress = 0.0, progress_text = 'Diantrikan ulang...' "
+        "WHERE status = 'running' AND heartbeat_at < ?",
+        (min_heartbeat_at,)
+    )
+
+def purge_old_jobs(max_age_s=None):
+    # Hapus job selesai (beserta hasilnya) yang lebih tua dari max_age_s
+    if max_age_s is None: max_age_s = config.JOB_MAX_AGE_S
+    connection = _get_connection()
+    min_finished_at = time.time() - max_age_s
+    old_ids = [(row[0],) for row in connection.execute(
+        f"SELECT id FROM jobs WHERE status IN ({', '.join('?' * len(FINISHED_STATUSES))}) AND finished_at < ?",
+        (*FINISHED_STATUSES, min_finished_at)
+    ).fetchall()]
+    if not old_ids: return 0
+    for table_name in ("job_results", "job_inputs", "jobs"):
+        connection.executemany(f"DELETE FROM {table_name} WHERE id = ?", old_ids)
+    return len(old_ids)
+
+def get_queue_stats():
+    counts = dict(_get_connection().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+    return {status: counts.get(status, 0) for status in JOB_STATUSES}
+
+def process_job(job, model_s, model_c, device_obj):
+    """
+    Jalankan satu job yang sudah diklaim sampai selesai/gagal/batal, lalu simpan hasilnya.
+    Jika job ternyata sudah bukan milik worker ini (diantrikan ulang karena heartbeat
+    terlambat), pekerjaan dihentikan tanpa menulis apa pun dan "lost" dikembalikan.
+    """
+    import extraction
+    import profiling
+    import result_cache
+    job_id = job["id"]
+    worker_id = job["worker_id"]
+    def finish(status, **kwargs):
+        return status if _finish_job(job_id, worker_id, status, **kwargs) else "lost"
+
+    row = _get_connection().execute("SELECT pdf FROM job_inputs WHERE id = ?", (job_id,)).fetchone()
+    if row is None:
+        return finish("failed", error="Input PDF job tidak ditemukan.")
+
+    # Progres ditulis paling sering tiap JOB_PROGRESS_INTERVAL_S agar tidak membebani database
+    last_progress_at = [0.0]
+    def job_progress(fraction, text):
+        now = time.monotonic()
+        if now - last_progress_at[0] < config.JOB_PROGRESS_INTERVAL_S: return
+        last_progress_at[0] = now
+        update_progress(job_id, worker_id, fraction, text)
+
+    profiler = profiling.ExtractionProfiler(label=job["filename"]) if job["profile"] else None
+    try:
+        results_data, excel_bytes, document_stats = extraction.extract_document_with_report(
+            row[0], job["gender"], model_s, model_c, device_obj, extraction_mode=job["extraction_mode"],
+            progress_callback=job_progress, use_pipeline=job["use_pipeline"], profiler=profiler
+        )
+    except JobLost as e_lost:
+        print(f"Worker {worker_id}: {e_lost}; pekerjaan dihentikan.")
+        return "lost"
+    except JobCancelled:
+        return finish("cancelled")
+    except extraction.ExtractionError as e_extract:
+        return finish("failed", error=str(e_extract))
+    except Exception as e_job:
+        print(f"Error saat memproses job {job_id}: {e_job}")
+        return finish("failed", error=f"Error internal: {e_job}")
+
+    result_payload = pickle.dumps({"results": result_cache.encode_results(results_data), "excel": excel_bytes},
+                                  protocol=pickle.HIGHEST_PROTOCOL)
+    stats = {"from_cache": document_stats is None, "fields": len(results_data)}
+    if document_stats is not None:
+        stats.update({key: document_stats.get(key) for key in ("pages_rendered", "chars", "field_cache_hits", "grid_fields", "render_stats", "escalation_stats", "pipeline_stats")})
+    return finish("done", result_payload=result_payload, stats=stats,
+                  profile_data=profiler.to_dict() if profiler is not None else None)
+
+def run_worker_loop(worker_id, device_obj, stop_event=None, max_jobs=None):
+    """
+    Loop worker: muat model sekali lewat registry, lalu ambil dan proses job
+    sampai stop_event diset (atau max_jobs job selesai). Antrian kosong ditunggu
+    dengan jeda JOB_POLL_INTERVAL_S.
+    """
+    import model_registry
+    model_s, model_c = model_registry.get_models(device_obj)
+    if model_s is None or model_c is None:
+        print(f"Worker {worker_id}: model AI tidak berhasil dimuat, worker berhenti.")
+        return 0
+    num_jobs = 0
+    last_maintenance_at = 0.0
+    while stop_event is None or not stop_event.is_set():
+        if time.monotonic() - last_maintenance_at > config.JOB_STALE_AFTER_S / 4:
+            requeue_stale_jobs()
+            purge_old_jobs()
+            last_maintenance_at = time.monotonic()
+        job = claim_next_job(worker_id)
+        if job is None:
+            if stop_event is not None: stop_event.wait(config.JOB_POLL_INTERVAL_S)
+            else: time.sleep(config.JOB_POLL_INTERVAL_S)
+            continue
+        start_time = time.perf_counter()
+        status = process_job(job, model_s, model_c, device_obj)
+        print(f"Worker {worker_id}: job {job['id']} ({job['filename']}) {status} dalam {time.perf_counter() - start_time:.2f}s", flush=True)
+        num_jobs += 1
+        if max_jobs is not None and num_jobs >= max_jobs: break
+    return num_jobs
+
+def _worker_process_main(worker_idx, device_str, torch_threads, stop_event):
+    import torch
+    if torch_threads: torch.set_num_threads(torch_threads)
+    config.DEVICE = torch.device(device_str) # Kunci cache memakai backend efektif model di device ini
+    try:
+        run_worker_loop(f"{os.uname().nodename if hasattr(os, 'uname') else 'host'}:{os.getpid()}:{worker_idx}",
+                        torch.device(device_str), stop_event)
+    except KeyboardInterrupt:
+        pass
+
+def start_worker_pool(num_workers, device_str=None, torch_threads=None):
+    """
+    Jalankan num_workers proses worker (spawn, masing-masing memuat model sendiri).
+    Mengembalikan (list proses, stop_event) untuk dihentikan dengan stop_worker_pool.
+    """
+    if device_str is None: device_str = str(config.DEVICE)
+    num_workers = max(1, int(num_workers))
+    if torch_threads is None: torch_threads = max(1, (os.cpu_count() or 1) // num_workers)
+    mp_context = multiprocessing.get_context("spawn")
+    stop_event = mp_context.Event()
+    processes = []
+    for worker_idx in range(num_workers):
+        worker_process = mp_context.Process(
+            target=_worker_process_main, args=(worker_idx, device_str, torch_threads, stop_event),
+            name=f"job-worker-{worker_idx}", daemon=True
+        )
+        worker_process.start()
+        processes.append(worker_process)
+    return processes, stop_event
+
+def stop_worker_pool(processes, stop_event, timeout_s=None):
+    # Job yang sedang berjalan diselesaikan dulu; proses yang tidak berhenti dalam timeout dihentikan paksa
+    stop_event.set()
+    for worker_process in processes:
+        worker_process.join(timeout_s)
+        if worker_process.is_alive(): worker_process.terminate()
+
+def ensure_embedded_workers(device_obj=None, num_workers=None):
+    """
+    Worker thread di dalam proses ini (mis. proses Streamlit) agar aplikasi tetap
+    berjalan tanpa worker terpisah. Dijalankan sekali per proses; model diambil
+    dari registry yang sama dengan UI.
+    """
+    if device_obj is None: device_obj = config.DEVICE
+    if num_workers is None: num_workers = config.JOB_QUEUE_EMBEDDED_WORKERS
+    with _embedded_workers_lock:
+        while len(_embedded_workers) < num_workers:
+            worker_id = f"embedded:{os.getpid()}:{len(_embedded_workers)}"
+            worker_thread = threading.Thread(target=run_worker_loop, args=(worker_id, device_obj), name=worker_id, daemon=True)
+            worker_thread.start()
+            _embedded_workers.append(worker_thread)
+    return len(_embedded_workers)
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    """
+    API HTTP kecil:
+      POST   /jobs?gender=pria&mode=page&filename=a.pdf  (body: bytes PDF) -> {"job_id": ...}
+      GET    /jobs[?status=queued]                       -> daftar job
+      GET    /jobs/<id>                                  -> status dan progres
+      GET    /jobs/<id>/result                           -> hasil JSON (tanpa gambar)
+      GET    /jobs/<id>/excel                            -> laporan Excel
+      DELETE /jobs/<id>                                  -> batalkan job
+    """
+    server_version = "KuesionerJobs/1"
+
+    def _send_json(self, status_code, data):
+        body = json.dumps(data, ensure_ascii=False, default=str).encode("utf-8")
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _route(self):
+        parsed_url = urlparse(self.path)
+        path_parts = [part for part in parsed_url.path.split("/") if part]
+        query = {key: values[-1] for key, values in parse_qs(parsed_url.query).items()}
+        return path_parts, query
+
+    def do_POST(self):
+        path_parts, query = self._route()
+        if path_parts != ["jobs"]: return self._send_json(404, {"error": "Endpoint tidak dikenal"})
+        content_length = int(self.headers.get("Content-Length") or 0)
+        if content_length <= 0: return self._send_json(400, {"error": "Body harus berisi bytes PDF"})
+        if content_length > config.JOB_MAX_UPLOAD_BYTES: return self._send_json(413, {"error": "PDF terlalu besar"})
+        pdf_bytes = self.rfile.read(content_length)
+        if not pdf_bytes.startswith(b"%PDF"): return self._send_json(400, {"error": "Body bukan file PDF"})
+        gender = query.get("gender", "pria")
+        extraction_mode = query.get("mode", config.EXTRACTION_MODE)
+        if gender not in ("pria", "perempuan") or extraction_mode not in config.EXTRACTION_MODES:
+            return self._send_json(400, {"error": "Parameter gender/mode tidak valid"})
+        job_id = submit_job(pdf_bytes, query.get("filename", "upload.pdf"), gender, extraction_mode,
+                            query.get("pipeline", "").lower() in ("1", "true", "ya") or None,
+                            profile=query.get("profile", "").lower() in ("1", "true", "ya"))
+        self._send_json(202, {"job_id": job_id, "status_url": f"/jobs/{job_id}"})
+
+    def do_GET(self):
+        path_parts, query = self._route()
+        if path_parts == ["jobs"]:
+            limit = query.get("limit", "50")
+            if not limit.isdecimal() or int(limit) <= 0 or query.get("status", JOB_STATUSES[0]) not in JOB_STATUSES:
+                return self._send_json(400, {"error": "Parameter limit/status tidak valid"})
+            return self._send_json(200, {"jobs": list_jobs(query.get("status"), int(limit)), "stats": get_queue_stats()})
+        if len(path_parts) < 2 or path_parts[0] != "jobs": return self._send_json(404, {"error": "Endpoint tidak dikenal"})
+        job = get_job(path_parts[1])
+        if job is None: return self._send_json(404, {"error": "Job tidak ditemukan"})
+        if len(path_parts) == 2: return self._send_json(200, job)
+        if path_parts[2] not in ("result", "excel"): return self._send_json(404, {"error": "Endpoint tidak dikenal"})
+        if job["status"] != "done": return self._send_json(409, {"error": f"Job belum selesai (status: {job['status']})", "job": job})
+        job_result = get_job_result(job["id"], include_images=False)
+        if job_result is None: return self._send_json(410, {"error": "Hasil job sudah dihapus"})
+        if path_parts[2] == "result": return self._send_json(200, {"job": job, "results": job_result[0]})
+        excel_bytes = job_result[1] or b""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+        self.send_header("Content-Disposition", f'attachment; filename="hasil_ekstraksi_{job["id"]}.xlsx"')
+        self.send_header("Content-Length", str(len(excel_bytes)))
+        self.end_headers()
+        self.wfile.write(excel_bytes)
+
+    def do_DELETE(self):
+        path_parts, _ = self._route()
+        if len(path_parts) != 2 or path_parts[0] != "jobs": return self._send_json(404, {"error": "Endpoint tidak dikenal"})
+        status = cancel_job(path_parts[1])
+        if status is None: return self._send_json(404, {"error": "Job tidak ditemukan"})
+        self._send_json(200, {"job_id": path_parts[1], "status": status})
+
+    def log_message(self, format, *args):
+        print(f"[http] {self.address_string()} {format % args}")
+
+def wait_for_job(job_id, timeout_s=None, poll_interval_s=None, progress_fn=None):
+    # Polling sampai job selesai (atau timeout); mengembalikan status job terakhir
+    if poll_interval_s is None: poll_interval_s = config.JOB_UI_POLL_INTERVAL_S
+    deadline = time.monotonic() + timeout_s if timeout_s is not None else None
+    while True:
+        job = get_job(job_id)
+        if job is None or job["status"] in FINISHED_STATUSES: return job
+        if progress_fn is not None: progress_fn(job)
+        if deadline is not None and time.monotonic() > deadline: return job
+        time.sleep(poll_interval_s)
+
+def _write_result_file(job_id, output_path):
+    import model
+    job_result = get_job_result(job_id, include_images=not output_path.lower().endswith((".json", ".csv")))
+    if job_result is None:
+        print(f"Hasil job {job_id} tidak tersedia.")
+        return 1
+    results_data, excel_bytes = job_result
+    lower_path = output_path.lower()
+    if lower_path.endswith(".xlsx"):
+        with open(output_path, "wb") as f:
+            f.write(excel_bytes)
+    elif lower_path.endswith(".csv"):
+        with open(output_path, "wb") as f:
+            f.write(model.create_tabular_report(results_data, "csv").getvalue())
+    else:
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(results_data, f, ensure_ascii=False, indent=2, default=str)
+    print(f"Hasil job {job_id} disimpan di: {output_path}")
+    return 0
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Antrian job ekstraksi kuesioner (SQLite) dengan worker dan API HTTP.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    worker_parser = subparsers.add_parser("worker", help="Jalankan pool worker yang memproses antrian")
+    worker_parser.add_argument("--workers", "-w", type=int, default=config.BATCH_NUM_WORKERS)
+    worker_parser.add_argument("--torch-threads", type=int, default=None)
+    worker_parser.add_argument("--device", default=str(config.DEVICE))
+
+    serve_parser = subparsers.add_parser("serve", help="Jalankan API HTTP (opsional sekaligus pool worker)")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=config.JOB_HTTP_PORT)
+    serve_parser.add_argument("--workers", "-w", type=int, default=0, help="Jumlah proses worker (0: worker dijalankan terpisah)")
+    serve_parser.add_argument("--torch-threads", type=int, default=None)
+    serve_parser.add_argument("--device", default=str(config.DEVICE))
+
+    submit_parser = subparsers.add_parser("submit", help="Kirim PDF ke antrian")
+    submit_parser.add_argument("pdf", nargs="+")
+    submit_parser.add_argument("--gender", default="pria", choices=["pria", "perempuan"])
+    submit_parser.add_argument("--mode", default=config.EXTRACTION_MODE, choices=config.EXTRACTION_MODES)
+    submit_parser.add_argument("--pipeline", action="store_true", default=None)
+    submit_parser.add_argument("--wait", action="store_true", help="Tunggu sampai semua job selesai")
+
+    status_parser = subparsers.add_parser("status", help="Status satu job atau daftar job terbaru")
+    status_parser.add_argument("job_id", nargs="?")
+    status_parser.add_argument("--status", default=None, choices=JOB_STATUSES)
+
+    result_parser = subparsers.add_parser("result", help="Simpan hasil job (.xlsx, .csv atau .json)")
+    result_parser.add_argument("job_id")
+    result_parser.add_argument("--output", "-o", required=True)
+
+    cancel_parser = subparsers.add_parser("cancel", help="Batalkan job")
+    cancel_parser.add_argument("job_id")
+    return parser
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    if args.command in ("worker", "serve"):
+        import model
+        model.cleanup_stale_workspaces()
+    if args.command == "worker":
+        processes, stop_event = start_worker_pool(args.workers, args.device, args.torch_threads)
+        print(f"{len(processes)} worker berjalan (antrian: {config.JOB_QUEUE_PATH}). Ctrl+C untuk berhenti.")
+        try:
+            for worker_process in processes: worker_process.join()
+        except KeyboardInterrupt:
+            stop_worker_pool(processes, stop_event, timeout_s=config.JOB_STALE_AFTER_S)
+        return 0
+    if args.command == "serve":
+        processes, stop_event = start_worker_pool(args.workers, args.device, args.torch_threads) if args.workers > 0 else ([], None)
+        http_server = ThreadingHTTPServer((args.host, args.port), JobRequestHandler)
+        print(f"API job berjalan di http://{args.host}:{args.port}/jobs ({len(processes)} worker). Ctrl+C untuk berhenti.")
+        try:
+            http_server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            http_server.server_close()
+            if processes: stop_worker_pool(processes, stop_event, timeout_s=config.JOB_STALE_AFTER_S)
+        return 0
+    if args.command == "submit":
+        job_ids = []
+        for pdf_path in args.pdf:
+            with open(pdf_path, "rb") as f:
+                job_ids.append(submit_job(f.read(), os.path.basename(pdf_path), args.gender, args.mode, args.pipeline))
+            print(f"{job_ids[-1]}  {pdf_path}")
+        if not args.wait: return 0
+        final_statuses = [wait_for_job(job_id)["status"] for job_id in job_ids]
+        for job_id, status in zip(job_ids, final_statuses): print(f"{job_id}  {status}")
+        return 0 if all(status == "done" for status in final_statuses) else 2
+    if args.command == "status":
+        if args.job_id:
+            job = get_job(args.job_id)
+            if job is None:
+                print(f"Job {args.job_id} tidak ditemukan.")
+                return 1
+            print(json.dumps(job, ensure_ascii=False, indent=2, default=str))
+            return 0
+        print(json.dumps(get_queue_stats()))
+        for job in list_jobs(args.status):
+            print(f"{job['id']}  {job['status']:<9}  {(job['progress'] or 0.0) * 100:5.1f}%  {job['filename']}  {job['error'] or ''}")
+        return 0
+    if args.command == "result":
+        return _write_result_file(args.job_id, args.output)
+    if args.command == "cancel":
+        print(cancel_job(args.job_id))
+        return 0
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
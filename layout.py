@@ -0,0 +1,133 @@
+# layout.py
+# Layout anotasi terkompilasi: dibangun sekali per file anotasi dan di-cache per proses.
+
+import os
+import json
+import hashlib
+import threading
+from collections import namedtuple
+import config # Import file config
+
+# Satu area pertanyaan (from_name == 'box') beserta nomor dan halamannya
+LayoutField = namedtuple("LayoutField", [
+    "field_idx", "box_id", "id_pertanyaan", "halaman_str", "page_number",
+    "value", "original_width", "original_height",
+])
+
+_layout_cache = {}
+_layout_cache_lock = threading.Lock()
+
+def compute_crop_rect(annotation_value, original_width, original_height, img_w, img_h):
+    # Persen anotasi -> persegi piksel (x1, y1, x2, y2) pada gambar halaman berukuran img_w x img_h
+    scale_x = img_w / original_width
+    scale_y = img_h / original_height
+    x = annotation_value['x'] / 100 * original_width * scale_x
+    y = annotation_value['y'] / 100 * original_height * scale_y
+    w = annotation_value['width'] / 100 * original_width * scale_x
+    h = annotation_value['height'] / 100 * original_height * scale_y
+    return (x, y, x + w, y + h)
+
+class AnnotationLayout:
+    """
+    Hasil kompilasi satu file anotasi: daftar area berurutan, pengelompokan per
+    halaman, dan persegi crop piksel yang di-cache per ukuran halaman.
+    """
+    def __init__(self, source_path, file_hash, fields):
+        self.source_path = source_path
+        self.file_hash = file_hash
+        self.fields = fields
+        self.fields_by_page = {}
+        for field in fields:
+            self.fields_by_page.setdefault(field.page_number, []).append(field)
+        self.page_numbers = sorted(self.fields_by_page)
+        self._rect_cache = {}
+        self._rect_cache_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.fields)
+
+    def get_crop_rects(self, page_number, page_size_px):
+        """
+        List (field, (x1, y1, x2, y2)) untuk semua area di halaman `page_number`
+        pada gambar halaman berukuran `page_size_px` (w, h). Koordinat dibulatkan
+        seperti yang dilakukan PIL saat crop.
+        """
+        cache_key = (page_number, tuple(page_size_px))
+        with self._rect_cache_lock:
+            cached_rects = self._rect_cache.get(cache_key)
+        if cached_rects is not None: return cached_rects
+        img_w, img_h = page_size_px
+        page_rects = []
+        for field in self.fields_by_page.get(page_number, []):
+            rect = compute_crop_rect(field.value, field.original_width, field.original_height, img_w, img_h)
+            page_rects.append((field, tuple(int(round(v)) for v in rect)))
+        with self._rect_cache_lock:
+            self._rect_cache[cache_key] = page_rects
+        return page_rects
+
+    def get_crop_rects_for_dpi(self, page_number, page_size_pts, dpi):
+        # Ukuran halaman dalam point (1/72 inci) -> ukuran piksel pada DPI render
+        page_size_px = (int(page_size_pts[0] * dpi / 72.0), int(page_size_pts[1] * dpi / 72.0))
+        return self.get_crop_rects(page_number, page_size_px)
+
+def compile_annotation_layout(crop_area_data, source_path="", file_hash=""):
+    # Satu kali lewat per task: indeks 'nomor' dan 'halaman' berdasarkan id kotak
+    fields = []
+    for task in crop_area_data:
+        annotations_result = task['annotations'][0]['result']
+        nomor_by_id = {}
+        halaman_by_id = {}
+        for r in annotations_result:
+            if r['from_name'] == 'nomor': nomor_by_id.setdefault(r['id'], r['value']['text'][0])
+            elif r['from_name'] == 'halaman': halaman_by_id.setdefault(r['id'], r['value']['text'][0])
+
+        for item in annotations_result:
+            if item['type'] == 'rectanglelabels' and item['from_name'] == 'box':
+                box_id = item['id']
+                halaman_str = halaman_by_id.get(box_id)
+                if halaman_str is None: continue
+                try: page_number = int(halaman_str)
+                except ValueError: continue
+                fields.append(LayoutField(
+                    len(fields), box_id, nomor_by_id.get(box_id, "N/A"), halaman_str, page_number,
+                    item['value'], item['original_width'], item['original_height'],
+                ))
+    return AnnotationLayout(source_path, file_hash, fields)
+
+def load_annotation_layout(annotation_path):
+    """
+    Muat layout terkompilasi untuk file anotasi, memakai cache proses. Cache
+    divalidasi dengan mtime dan ukuran file; jika berubah, hash isi file dicek
+    dan file hanya di-parse ulang bila isinya benar-benar berbeda.
+    """
+    abs_path = os.path.abspath(annotation_path)
+    file_stat = os.stat(abs_path)
+    stat_key = (file_stat.st_mtime_ns, file_stat.st_size)
+    with _layout_cache_lock:
+        cached = _layout_cache.get(abs_path)
+    if cached is not None and cached[0] == stat_key:
+        return cached[2]
+
+    with open(abs_path, "rb") as f:
+        raw_bytes = f.read()
+    file_hash = hashlib.sha256(raw_bytes).hexdigest()
+    if cached is not None and cached[1] == file_hash:
+        compiled_layout = cached[2]
+    else:
+        compiled_layout = compile_annotation_layout(json.loads(raw_bytes), abs_path, file_hash)
+    with _layout_cache_lock:
+        _layout_cache[abs_path] = (stat_key, file_hash, compiled_layout)
+    return compiled_layout
+
+def get_annotation_path(selected_gender_str):
+    return os.path.join(config.ANNOTATION_CROP_AREA_DIR, f"anotasi_{selected_gender_str}.json")
+
+def load_layout_for_gender(selected_gender_str):
+    # None jika file anotasi untuk gender tersebut tidak ada
+    annotation_path = get_annotation_path(selected_gender_str)
+    if not os.path.exists(annotation_path): return None
+    return load_annotation_layout(annotation_path)
+
+def clear_layout_cache():
+    with _layout_cache_lock:
+        _layout_cache.clear()
@@ -4,7 +4,7 @@
 import os
 import json
 from PIL import Image, ImageOps, ImageStat
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
 import torch
 import torch.nn as nn
 from torchvision import transforms as T
@@ -17,7 +17,22 @@ from openpyxl.drawing.image import Image as XLImage
 import numpy as np
 import functools
 import io
+import re
+import csv
+import time
+import shutil
+import tempfile
+import math
+import contextlib
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import fcntl # Lock workspace (POSIX); tanpa fcntl workspace lama tidak pernah dihapus otomatis
+except ImportError:
+    fcntl = None
 import config # Import file config
+import layout
+import profiling
 
 # Pastikan direktori sementara ada
 os.makedirs(config.TEMP_PROCESSING_DIR, exist_ok=True)
@@ -45,8 +60,9 @@ def load_ssd_model(model_path, num_classes_ssd, device_obj):
         print(f"File model SSD tidak ditemukan di: {model_path}")
         return None
     try:
-        weights_ssd_coco = SSDLite320_MobileNet_V3_Large_Weights.COCO_V1
-        model = ssdlite320_mobilenet_v3_large(weights=weights_ssd_coco) 
+        # Bobot COCO tidak perlu dimuat karena seluruh state_dict ditimpa dari file .pth.
+        # Tanpa bobot (dan tanpa backbone pre-trained) arsitekturnya identik dengan versi COCO_V1.
+        model = ssdlite320_mobilenet_v3_large(weights=None, weights_backbone=None) 
         in_channels_head_ssd = [672, 480, 512, 256, 256, 128] 
         num_anchors_ssd = model.anchor_generator.num_anchors_per_location()
         norm_layer_ssd = functools.partial(nn.BatchNorm2d, eps=0.001, momentum=0.03)
@@ -69,13 +85,18 @@ def load_ssd_model(model_path, num_classes_ssd, device_obj):
         return None
 
 # --- Fungsi Transformasi ---
+CHAR_NORMALIZE_MEAN = [0.485, 0.456, 0.406]
+CHAR_NORMALIZE_STD = [0.229, 0.224, 0.225]
+
+@functools.lru_cache(maxsize=None)
 def get_char_transform(): # Diubah agar tidak menerima argumen
     return T.Compose([
         T.Resize(config.CHAR_IMAGE_SIZE),
         T.ToTensor(),
-        T.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]) 
+        T.Normalize(mean=CHAR_NORMALIZE_MEAN, std=CHAR_NORMALIZE_STD) 
     ])
 
+@functools.lru_cache(maxsize=None)
 def get_ssd_transform(): # Diubah agar tidak menerima argumen
     try:
         weights_enum_entry_ssd = SSDLite320_MobileNet_V3_Large_Weights.COCO_V1
@@ -97,56 +118,260 @@ def get_ssd_transform(): # Diubah agar tidak menerima argumen
     ])
 
 # --- Fungsi Logika Inti ---
+WORKSPACE_PREFIX = "req_"
+WORKSPACE_LOCK_FILENAME = ".owner.lock" # Berisi PID pemilik; di-flock selama workspace dipakai
+
+@contextlib.contextmanager
+def request_workspace():
+    """
+    Direktori kerja unik per request di dalam TEMP_PROCESSING_DIR, dihapus beserta
+    isinya setelah blok selesai (termasuk saat error). Dengan ini beberapa ekstraksi
+    bisa berjalan paralel dalam satu proses tanpa saling menimpa file. Selama blok
+    berjalan, file lock di dalamnya dikunci (fcntl) sebagai bukti workspace masih hidup.
+    """
+    os.makedirs(config.TEMP_PROCESSING_DIR, exist_ok=True)
+    workspace_dir = tempfile.mkdtemp(prefix=WORKSPACE_PREFIX, dir=config.TEMP_PROCESSING_DIR)
+    lock_file = open(os.path.join(workspace_dir, WORKSPACE_LOCK_FILENAME), "w")
+    try:
+        if fcntl is not None: fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        lock_file.write(str(os.getpid()))
+        lock_file.flush()
+        yield workspace_dir
+    finally:
+        shutil.rmtree(workspace_dir, ignore_errors=True)
+        lock_file.close() # Lock dilepas setelah direktori terhapus
+
+def cleanup_stale_workspaces(max_age_s=None):
+    """
+    Hapus workspace request_workspace sisa proses yang mati sebelum sempat
+    membersihkan. Hanya direktori req_* yang lebih tua dari max_age_s dan lock
+    pemiliknya bisa diambil (pemiliknya sudah tidak ada) yang dihapus. Dipanggil
+    eksplisit dari entry point (app, batch, worker). Mengembalikan jumlah yang dihapus.
+    """
+    if fcntl is None: return 0 # Tanpa lock tidak bisa dibuktikan workspace sudah mati
+    if max_age_s is None: max_age_s = config.TEMP_WORKSPACE_MAX_AGE_S
+    if not os.path.isdir(config.TEMP_PROCESSING_DIR): return 0
+    now = time.time()
+    num_removed = 0
+    for entry in os.scandir(config.TEMP_PROCESSING_DIR):
+        if not entry.name.startswith(WORKSPACE_PREFIX) or not entry.is_dir(follow_symlinks=False): continue
+        try:
+            if now - entry.stat().st_mtime < max_age_s: continue
+            with open(os.path.join(entry.path, WORKSPACE_LOCK_FILENAME), "a") as lock_file:
+                try:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue # Masih dipakai proses lain
+                shutil.rmtree(entry.path, ignore_errors=True)
+            num_removed += 1
+        except OSError as e_del:
+            print(f"Gagal hapus workspace lama {entry.path}: {e_del}")
+    return num_removed
+
 def model_convert_pdf(pdf_bytes, dpi=300):
-    temp_pdf_path = None
     try:
-        temp_pdf_path = os.path.join(config.TEMP_PROCESSING_DIR, "temp_model_uploaded.pdf")
-        with open(temp_pdf_path, "wb") as f:
-            f.write(pdf_bytes)
-        images = convert_from_path(temp_pdf_path, dpi=dpi, poppler_path=None)
-        return images
+        with temp_pdf_file(pdf_bytes) as temp_pdf_path:
+            return convert_from_path(temp_pdf_path, dpi=dpi, poppler_path=None)
     except Exception as e:
         print(f"Error saat model konversi PDF: {e}")
         return []
-    finally: 
-        if temp_pdf_path and os.path.exists(temp_pdf_path):
-            try: os.remove(temp_pdf_path)
-            except Exception as e_del: print(f"Gagal hapus temp PDF: {e_del}")
+
+@contextlib.contextmanager
+def temp_pdf_file(pdf_bytes):
+    # Tulis PDF ke workspace unik untuk poppler; workspace dihapus setelahnya
+    with request_workspace() as workspace_dir:
+        temp_pdf_path = os.path.join(workspace_dir, "uploaded.pdf")
+        with open(temp_pdf_path, "wb") as f:
+            f.write(pdf_bytes)
+        yield temp_pdf_path
+
+class PdfRenderError(Exception):
+    """Poppler gagal merender halaman/area yang ada di PDF; hasil render tidak lengkap."""
+
+def _group_page_windows(page_numbers, window_size):
+    # Kelompokkan nomor halaman yang berurutan menjadi jendela (first_page, last_page)
+    windows = []
+    for page_number in sorted(set(page_numbers)):
+        if windows and page_number == windows[-1][1] + 1 and (page_number - windows[-1][0]) < window_size:
+            windows[-1][1] = page_number
+        else:
+            windows.append([page_number, page_number])
+    return [tuple(w) for w in windows]
+
+def model_iter_pdf_pages(pdf_bytes, page_numbers, dpi=None, window_size=None, profiler=None):
+    """
+    Generator yang merender hanya halaman yang dibutuhkan (nomor halaman mulai dari 1),
+    satu jendela kecil halaman berurutan per pemanggilan poppler. Menghasilkan pasangan
+    (nomor_halaman, gambar_PIL); pemanggil sebaiknya melepas gambar setelah crop selesai
+    agar memori puncak hanya sebesar beberapa halaman. Halaman di luar PDF dilewati;
+    semua halaman lain pasti dihasilkan, atau PdfRenderError dilempar (tidak ada
+    hasil setengah jadi).
+    """
+    if dpi is None: dpi = config.PDF_RENDER_DPI
+    if window_size is None: window_size = config.PDF_PAGE_WINDOW
+    window_size = max(1, int(window_size))
+    try:
+        with temp_pdf_file(pdf_bytes) as temp_pdf_path:
+            total_pages = model_get_pdf_page_count(temp_pdf_path)
+            valid_pages = [p for p in page_numbers if 1 <= p <= total_pages]
+            for first_page, last_page in _group_page_windows(valid_pages, window_size):
+                with profiling.stage(profiler, "render_pdf"):
+                    window_images = convert_from_path(temp_pdf_path, dpi=dpi, first_page=first_page, last_page=last_page, poppler_path=None)
+                profiling.count(profiler, "pages_rendered", len(window_images))
+                if len(window_images) != last_page - first_page + 1:
+                    raise PdfRenderError(f"Halaman {first_page}-{last_page} hanya menghasilkan {len(window_images)} gambar")
+                for offset in range(len(window_images)):
+                    page_image = window_images[offset]
+                    window_images[offset] = None # Lepas referensi di list agar halaman bisa dibebaskan
+                    yield first_page + offset, page_image
+                    del page_image
+    except PdfRenderError as e:
+        print(f"Error saat model render halaman PDF: {e}")
+        raise
+    except Exception as e:
+        print(f"Error saat model render halaman PDF: {e}")
+        raise PdfRenderError(str(e)) from e
+
+def model_render_pdf_page(pdf_path, page_number, dpi=None, profiler=None):
+    # Render satu halaman dari file PDF yang sudah ada di disk
+    if dpi is None: dpi = config.PDF_RENDER_DPI
+    with profiling.stage(profiler, "render_pdf"):
+        page_images = convert_from_path(pdf_path, dpi=dpi, first_page=page_number, last_page=page_number, poppler_path=None)
+    profiling.count(profiler, "pages_rendered", len(page_images))
+    return page_images[0] if page_images else None
+
+def model_get_pdf_page_count(pdf_path):
+    return int(pdfinfo_from_path(pdf_path, poppler_path=None)["Pages"])
+
+def model_get_pdf_page_sizes(pdf_path):
+    # Ukuran tiap halaman dalam point (1/72 inci) setelah rotasi halaman, {nomor_halaman: (w, h)}
+    total_pages = model_get_pdf_page_count(pdf_path)
+    output = subprocess.run(
+        ["pdfinfo", "-f", "1", "-l", str(total_pages), pdf_path],
+        capture_output=True, text=True, check=True
+    ).stdout
+    page_sizes = {}
+    page_rotations = {}
+    for line in output.splitlines():
+        match_size = re.match(r"Page\s+(\d+)\s+size:\s+([\d.]+)\s+x\s+([\d.]+)", line)
+        if match_size:
+            page_sizes[int(match_size.group(1))] = (float(match_size.group(2)), float(match_size.group(3)))
+            continue
+        match_rot = re.match(r"Page\s+(\d+)\s+rot:\s+(\d+)", line)
+        if match_rot:
+            page_rotations[int(match_rot.group(1))] = int(match_rot.group(2))
+    for page_number, rotation in page_rotations.items():
+        if page_number in page_sizes and rotation % 180 == 90:
+            w_pts, h_pts = page_sizes[page_number]
+            page_sizes[page_number] = (h_pts, w_pts)
+    return page_sizes
+
+def model_choose_region_dpi(field_w_pts, field_h_pts):
+    # DPI terkecil agar sisi terpanjang area mencapai ukuran input SSD, dibatasi rentang config
+    longest_side_inch = max(field_w_pts, field_h_pts) / 72.0
+    if longest_side_inch <= 0: return config.REGION_MAX_DPI
+    needed_dpi = math.ceil(max(config.SSD_INPUT_SIZE) / longest_side_inch)
+    return int(min(config.REGION_MAX_DPI, max(config.REGION_MIN_DPI, needed_dpi)))
+
+def _render_pdf_region(pdf_path, page_number, dpi, x_px, y_px, w_px, h_px):
+    # pdftoppm hanya merasterisasi potongan (-x/-y/-W/-H) dan menulis PNG ke stdout
+    completed = subprocess.run(
+        ["pdftoppm", "-f", str(page_number), "-l", str(page_number), "-r", str(dpi),
+         "-x", str(x_px), "-y", str(y_px), "-W", str(w_px), "-H", str(h_px), "-png", pdf_path],
+        capture_output=True, check=True
+    )
+    region_image = Image.open(io.BytesIO(completed.stdout))
+    region_image.load()
+    return region_image.convert("RGB")
+
+def model_render_pdf_regions(pdf_bytes, region_specs, max_workers=None, profiler=None):
+    """
+    Render hanya persegi area anotasi langsung dari PDF, tanpa merender halaman penuh.
+    `region_specs` adalah list (nomor_halaman, annotation_value); DPI dipilih per area
+    dari ukurannya dan ukuran input SSD. Mengembalikan (list gambar PIL atau None jika
+    halaman tidak ada, dict statistik piksel dibanding render halaman penuh). Melempar
+    PdfRenderError jika info PDF gagal dibaca atau ada area di halaman yang ada gagal dirender.
+    """
+    if max_workers is None: max_workers = config.REGION_RENDER_WORKERS
+    region_images = [None] * len(region_specs)
+    render_stats = {"region_pixels": 0, "full_page_pixels": 0, "pixel_savings_pct": 0.0, "dpi_per_region": [None] * len(region_specs)}
+    try:
+        with temp_pdf_file(pdf_bytes) as temp_pdf_path:
+            page_sizes = model_get_pdf_page_sizes(temp_pdf_path)
+            render_jobs = []
+            for region_idx, (page_number, annotation_value) in enumerate(region_specs):
+                if page_number not in page_sizes: continue
+                page_w_pts, page_h_pts = page_sizes[page_number]
+                field_w_pts = annotation_value['width'] / 100 * page_w_pts
+                field_h_pts = annotation_value['height'] / 100 * page_h_pts
+                dpi = model_choose_region_dpi(field_w_pts, field_h_pts)
+                scale = dpi / 72.0
+                x_px = int(round(annotation_value['x'] / 100 * page_w_pts * scale))
+                y_px = int(round(annotation_value['y'] / 100 * page_h_pts * scale))
+                w_px = max(1, int(round(field_w_pts * scale)))
+                h_px = max(1, int(round(field_h_pts * scale)))
+                render_jobs.append((region_idx, page_number, dpi, x_px, y_px, w_px, h_px))
+                render_stats["dpi_per_region"][region_idx] = dpi
+                render_stats["region_pixels"] += w_px * h_px
+
+            full_page_scale = config.PDF_RENDER_DPI / 72.0
+            for page_number in {job[1] for job in render_jobs}:
+                page_w_pts, page_h_pts = page_sizes[page_number]
+                render_stats["full_page_pixels"] += int(page_w_pts * full_page_scale) * int(page_h_pts * full_page_scale)
+
+            with profiling.stage(profiler, "render_pdf_regions"), ThreadPoolExecutor(max_workers=max(1, int(max_workers))) as executor:
+                futures = {executor.submit(_render_pdf_region, temp_pdf_path, *job[1:]): job for job in render_jobs}
+                for future, job in futures.items():
+                    try:
+                        region_images[job[0]] = future.result()
+                    except Exception as e_region:
+                        for pending_future in futures: pending_future.cancel()
+                        raise PdfRenderError(f"Gagal render area {job[0]} (halaman {job[1]}): {e_region}") from e_region
+    except PdfRenderError as e:
+        print(f"Error saat model render area PDF: {e}")
+        raise
+    except Exception as e:
+        print(f"Error saat model render area PDF: {e}")
+        raise PdfRenderError(str(e)) from e
+
+    profiling.count(profiler, "regions_rendered", sum(1 for img in region_images if img is not None))
+    if render_stats["full_page_pixels"] > 0:
+        render_stats["pixel_savings_pct"] = 100.0 * (1 - render_stats["region_pixels"] / render_stats["full_page_pixels"])
+    return region_images, render_stats
 
 def model_crop_region(page_image_pil, annotation_value, original_width, original_height):
     img_w, img_h = page_image_pil.size
-    scale_x = img_w / original_width
-    scale_y = img_h / original_height
-    x = annotation_value['x'] / 100 * original_width * scale_x
-    y = annotation_value['y'] / 100 * original_height * scale_y
-    w = annotation_value['width'] / 100 * original_width * scale_x
-    h = annotation_value['height'] / 100 * original_height * scale_y
-    return page_image_pil.crop((x, y, x + w, y + h))
-
-def model_detect_chars(field_image_pil, model_ssd, device_obj, transform_ssd):
-    if model_ssd is None: return []
-    img_transformed = transform_ssd(field_image_pil.convert("RGB"))
-    img_tensor = img_transformed.unsqueeze(0).to(device_obj) 
-    model_ssd.eval()
-    with torch.no_grad():
-        predictions = model_ssd(img_tensor)
-    pred = predictions[0]
+    return page_image_pil.crop(layout.compute_crop_rect(annotation_value, original_width, original_height, img_w, img_h))
+
+def model_char_size_scale(dpi):
+    # Faktor skala batas ukuran karakter (MIN_CHAR_*, dalam piksel pada PDF_RENDER_DPI) untuk gambar ber-DPI lain
+    if not dpi: return 1.0
+    return dpi / config.PDF_RENDER_DPI
+
+def _filter_char_boxes(pred, field_w, field_h, profiler=None, size_scale=1.0):
+    # Threshold, NMS, dan filter ukuran/rasio kotak untuk output satu gambar
+    # `size_scale` (lihat model_char_size_scale) menyesuaikan batas ukuran dengan DPI gambar
     scores = pred['scores']
     labels = pred['labels']
     boxes = pred['boxes']
     target_label_mask = (labels == 1) & (scores > config.SSD_DETECTION_THRESHOLD)
     boxes_target_label = boxes[target_label_mask]
     scores_target_label = scores[target_label_mask]
+    profiling.count(profiler, "boxes_before_nms", boxes_target_label.shape[0])
     if boxes_target_label.nelement() == 0: return []
     keep_indices = nms(boxes_target_label, scores_target_label, config.SSD_NMS_IOU_THRESHOLD)
     nms_boxes = boxes_target_label[keep_indices].cpu().numpy().astype(int)
+    profiling.count(profiler, "boxes_after_nms", len(nms_boxes))
     
+    min_w = config.MIN_CHAR_BOX_WIDTH * size_scale
+    min_h = config.MIN_CHAR_BOX_HEIGHT * size_scale
+    min_area = config.MIN_CHAR_AREA * size_scale * size_scale # Luas berskala kuadrat terhadap DPI
     final_char_boxes = []
     for box_coords in nms_boxes:
         x1, y1, x2, y2 = box_coords
         w_box = x2 - x1
         h_box = y2 - y1
-        if w_box < config.MIN_CHAR_BOX_WIDTH or h_box < config.MIN_CHAR_BOX_HEIGHT or (w_box * h_box) < config.MIN_CHAR_AREA:
+        if w_box < min_w or h_box < min_h or (w_box * h_box) < min_area:
             continue
         aspect_ratio = w_box / h_box if h_box > 0 else float('inf')
         if aspect_ratio > config.MAX_CHAR_BOX_ASPECT_RATIO or \
@@ -154,25 +379,99 @@ def model_detect_chars(field_image_pil, model_ssd, device_obj, transform_ssd):
             continue
         x1_c = max(0, x1)
         y1_c = max(0, y1)
-        x2_c = min(field_image_pil.width, x2)
-        y2_c = min(field_image_pil.height, y2)
+        x2_c = min(field_w, x2)
+        y2_c = min(field_h, y2)
         if x2_c <= x1_c or y2_c <= y1_c:
             continue
         final_char_boxes.append([x1_c, y1_c, x2_c, y2_c])
 
+    profiling.count(profiler, "boxes_after_filter", len(final_char_boxes))
     if len(final_char_boxes) > 0:
         return sorted(final_char_boxes, key=lambda b: b[0])
     return []
 
-def model_classify_char(char_image_pil, model_classifier, device_obj, transform_classifier):
+def model_detect_chars(field_image_pil, model_ssd, device_obj, transform_ssd, scheduler=None, tag=None):
+    # Dengan `scheduler` (batch_scheduler.InferenceScheduler) area ini dikemas ke batch bersama dokumen lain
+    if scheduler is not None: return scheduler.detect_chars_async(field_image_pil, transform_ssd, tag).result()
+    if model_ssd is None: return []
+    return model_detect_chars_batch([field_image_pil], model_ssd, device_obj, transform_ssd, batch_size=1)[0]
+
+def model_detect_chars_batch(field_images_pil, model_ssd, device_obj, transform_ssd, batch_size=None, profiler=None,
+                             scheduler=None, document_tag=None, size_scales=None):
+    """
+    Deteksi kotak karakter untuk banyak gambar area sekaligus (bisa lintas dokumen).
+    Gambar dikirim ke SSD dalam batch berukuran `batch_size`, lalu threshold, NMS,
+    dan filter dari config dijalankan per gambar. Urutan hasil sama dengan urutan input.
+    Dengan `scheduler`, batch dibentuk oleh scheduler bersama dokumen lain yang
+    sedang berjalan (item diberi tag (document_tag, indeks)). `size_scales` (opsional,
+    sejajar input) menyesuaikan filter ukuran kotak untuk gambar dengan DPI berbeda.
+    """
+    if scheduler is not None:
+        with profiling.stage(profiler, "ssd_preprocess"):
+            batch_tensors = [model_preprocess_field_for_ssd(img, transform_ssd) for img in field_images_pil]
+        return model_detect_chars_preprocessed(batch_tensors, [img.size for img in field_images_pil], model_ssd, device_obj,
+                                               profiler=profiler, scheduler=scheduler, document_tag=document_tag,
+                                               size_scales=size_scales)
+    if model_ssd is None: return [[] for _ in field_images_pil]
+    if batch_size is None: batch_size = config.SSD_BATCH_SIZE
+    batch_size = max(1, int(batch_size))
+
+    all_char_boxes = []
+    for start_idx in range(0, len(field_images_pil), batch_size):
+        batch_images = field_images_pil[start_idx:start_idx + batch_size]
+        with profiling.stage(profiler, "ssd_preprocess"):
+            batch_tensors = [model_preprocess_field_for_ssd(img, transform_ssd) for img in batch_images]
+        all_char_boxes.extend(model_detect_chars_preprocessed(
+            batch_tensors, [img.size for img in batch_images], model_ssd, device_obj, profiler=profiler,
+            size_scales=size_scales[start_idx:start_idx + batch_size] if size_scales is not None else None
+        ))
+    return all_char_boxes
+
+def model_preprocess_field_for_ssd(field_image_pil, transform_ssd):
+    # Transformasi SSD untuk satu area; bisa dijalankan terpisah dari inferensi (mis. di thread lain)
+    return transform_ssd(field_image_pil.convert("RGB"))
+
+def model_detect_chars_preprocessed(field_tensors, field_sizes, model_ssd, device_obj, profiler=None, scheduler=None, document_tag=None,
+                                    size_scales=None):
+    # Satu forward pass SSD untuk tensor yang sudah ditransformasi; field_sizes berisi (w, h) asli
+    if size_scales is None: size_scales = [1.0] * len(field_tensors)
+    if scheduler is not None:
+        futures = [
+            scheduler.detect_preprocessed_async(tensor, field_size, (document_tag, item_idx), size_scale)
+            for item_idx, (tensor, field_size, size_scale) in enumerate(zip(field_tensors, field_sizes, size_scales))
+        ]
+        profiling.count(profiler, "fields_detected", len(futures))
+        with profiling.stage(profiler, "scheduler_detect_wait"):
+            return [future.result() for future in futures]
+    if model_ssd is None: return [[] for _ in field_tensors]
+    if len(field_tensors) == 0: return []
+    model_ssd.eval()
+    # SSD torchvision menerima list tensor dengan ukuran berbeda-beda dan
+    # mengembalikan kotak dalam koordinat gambar aslinya masing-masing.
+    with profiling.stage(profiler, "ssd_inference"), torch.no_grad():
+        predictions = model_ssd([tensor.to(device_obj) for tensor in field_tensors])
+    profiling.count(profiler, "ssd_forward_passes")
+    profiling.count(profiler, "fields_detected", len(field_tensors))
+    with profiling.stage(profiler, "ssd_nms_filter"):
+        return [
+            _filter_char_boxes(pred, field_w, field_h, profiler, size_scale)
+            for pred, (field_w, field_h), size_scale in zip(predictions, field_sizes, size_scales)
+        ]
+
+# Hasil klasifikasi crop kosong (kotak tidak diisi): teks tetap "?", tapi confidence None membedakannya
+# dari crop yang ditolak karena terlalu kecil ("?", 0.0), mis. kotak yang terpotong detektor
+BLANK_CHAR_RESULT = ("?", None)
+
+def model_classify_char(char_image_pil, model_classifier, device_obj, transform_classifier, scheduler=None, tag=None):
+    if scheduler is not None: return scheduler.classify_char_async(char_image_pil, tag).result()
     if model_classifier is None: return "?", 0.0
     if char_image_pil.width < config.MIN_CHAR_BOX_WIDTH or char_image_pil.height < config.MIN_CHAR_BOX_HEIGHT:
         return "?", 0.0
     try:
         gray_char = char_image_pil.convert('L')
         stat = ImageStat.Stat(gray_char)
-        if stat.stddev[0] < 7 and stat.mean[0] > 240: 
-            return "?", 0.0 
+        if stat.stddev[0] < config.BLANK_CHAR_MAX_STDDEV and stat.mean[0] > config.BLANK_CHAR_MIN_MEAN: 
+            return BLANK_CHAR_RESULT
     except Exception: pass 
     img_tensor = transform_classifier(char_image_pil.convert("RGB")).unsqueeze(0).to(device_obj)
     model_classifier.eval()
@@ -183,48 +482,227 @@ def model_classify_char(char_image_pil, model_classifier, device_obj, transform_
         predicted_char = config.CHAR_IDX_TO_CLASS.get(predicted_idx.item(), '?') 
     return predicted_char, confidence.item()
 
-def create_excel_report(results_data):
-    wb = Workbook()
-    ws = wb.active
+def _blank_char_mask(char_images_pil, candidate_indices):
+    # Statistik grayscale (mean & stddev populasi, sama seperti ImageStat) untuk semua
+    # crop sekaligus: piksel digabung jadi satu array lalu dijumlah per segmen.
+    if len(candidate_indices) == 0: return np.zeros(0, dtype=bool)
+    gray_arrays = [np.asarray(char_images_pil[i].convert('L'), dtype=np.float64).ravel() for i in candidate_indices]
+    counts = np.array([arr.size for arr in gray_arrays], dtype=np.float64)
+    offsets = np.concatenate(([0], np.cumsum(counts[:-1]))).astype(np.int64)
+    all_pixels = np.concatenate(gray_arrays)
+    sums = np.add.reduceat(all_pixels, offsets)
+    sums_sq = np.add.reduceat(all_pixels * all_pixels, offsets)
+    means = sums / counts
+    stddevs = np.sqrt(np.maximum(sums_sq / counts - means * means, 0.0))
+    return (stddevs < config.BLANK_CHAR_MAX_STDDEV) & (means > config.BLANK_CHAR_MIN_MEAN)
+
+def _chars_to_tensor(char_images_pil):
+    # Resize + ToTensor + Normalize (setara get_char_transform) untuk banyak crop sekaligus
+    target_h, target_w = config.CHAR_IMAGE_SIZE
+    stacked = np.stack([
+        np.asarray(img.convert("RGB").resize((target_w, target_h), Image.BILINEAR)) for img in char_images_pil
+    ])
+    batch_tensor = torch.from_numpy(stacked).permute(0, 3, 1, 2).float().div_(255.0)
+    mean = torch.tensor(CHAR_NORMALIZE_MEAN).view(1, 3, 1, 1)
+    std = torch.tensor(CHAR_NORMALIZE_STD).view(1, 3, 1, 1)
+    return (batch_tensor - mean) / std
+
+def _classifiable_indices(char_images_pil, profiler=None, size_scales=None):
+    # (indeks crop yang cukup besar dan tidak kosong, indeks crop kosong: putih dengan stddev rendah)
+    with profiling.stage(profiler, "char_blank_check"):
+        sizes = np.array([img.size for img in char_images_pil], dtype=np.int64).reshape(-1, 2)
+        scales = np.ones(len(char_images_pil)) if size_scales is None else np.asarray(size_scales, dtype=np.float64)
+        size_ok_mask = (sizes[:, 0] >= config.MIN_CHAR_BOX_WIDTH * scales) & (sizes[:, 1] >= config.MIN_CHAR_BOX_HEIGHT * scales)
+        candidate_indices = np.flatnonzero(size_ok_mask)
+        blank_mask = _blank_char_mask(char_images_pil, candidate_indices)
+        keep_indices = candidate_indices[~blank_mask]
+    profiling.count(profiler, "char_crops", len(char_images_pil))
+    profiling.count(profiler, "small_crops_skipped", len(char_images_pil) - len(candidate_indices))
+    profiling.count(profiler, "blank_crops_skipped", int(blank_mask.sum()))
+    return keep_indices, candidate_indices[blank_mask]
+
+def model_classify_chars_batch(char_images_pil, model_classifier, device_obj, batch_size=None, profiler=None,
+                               scheduler=None, document_tag=None, size_scales=None):
+    """
+    Klasifikasi banyak crop karakter sekaligus (satu area atau satu dokumen penuh).
+    Crop yang terlalu kecil ("?", 0.0) atau kosong (BLANK_CHAR_RESULT) ditolak lewat mask
+    vektor, sisanya dijalankan dalam beberapa forward pass besar. Hasilnya list pasangan
+    (karakter, confidence) yang sama dengan model_classify_char, urut sesuai input.
+    Dengan `scheduler`, crop dikemas ke batch bersama crop dokumen lain. `size_scales`
+    (opsional, sejajar input) menyesuaikan batas ukuran crop dengan DPI gambar asalnya.
+    """
+    if scheduler is not None:
+        futures = [
+            scheduler.classify_char_async(img, (document_tag, item_idx), size_scales[item_idx] if size_scales is not None else 1.0)
+            for item_idx, img in enumerate(char_images_pil)
+        ]
+        with profiling.stage(profiler, "scheduler_classify_wait"):
+            return [future.result() for future in futures]
+    results = [("?", 0.0)] * len(char_images_pil)
+    if model_classifier is None or len(char_images_pil) == 0: return results
+    if batch_size is None: batch_size = config.CHAR_BATCH_SIZE
+    batch_size = max(1, int(batch_size))
+    keep_indices, blank_indices = _classifiable_indices(char_images_pil, profiler, size_scales)
+    for i in blank_indices.tolist(): results[i] = BLANK_CHAR_RESULT
+
+    model_classifier.eval()
+    for start_idx in range(0, len(keep_indices), batch_size):
+        batch_indices = keep_indices[start_idx:start_idx + batch_size]
+        with profiling.stage(profiler, "char_preprocess"):
+            img_tensor = _chars_to_tensor([char_images_pil[i] for i in batch_indices]).to(device_obj)
+        profiling.count(profiler, "char_forward_passes")
+        with profiling.stage(profiler, "char_inference"), torch.no_grad():
+            output = model_classifier(img_tensor)
+            probabilities = torch.softmax(output, dim=1)
+            confidences, predicted_idxs = torch.max(probabilities, 1)
+        for i, conf, pred_idx in zip(batch_indices.tolist(), confidences.tolist(), predicted_idxs.tolist()):
+            results[i] = (config.CHAR_IDX_TO_CLASS.get(pred_idx, '?'), conf)
+    return results
+
+def model_classify_chars_tta(char_variant_groups, model_classifier, device_obj, batch_size=None, profiler=None):
+    """
+    Klasifikasi dengan test-time augmentation: setiap karakter punya beberapa crop
+    varian (mis. kotak digeser atau diperbesar sedikit) dan probabilitas softmax-nya
+    dirata-rata. Crop pertama tiap grup dipakai untuk cek ukuran/kosong seperti
+    model_classify_chars_batch. Mengembalikan list (karakter, confidence) urut input.
+    """
+    results = [("?", 0.0)] * len(char_variant_groups)
+    if model_classifier is None or len(char_variant_groups) == 0: return results
+    if batch_size is None: batch_size = config.CHAR_BATCH_SIZE
+    batch_size = max(1, int(batch_size))
+    keep_indices, blank_indices = _classifiable_indices([group[0] for group in char_variant_groups], profiler)
+    for group_idx in blank_indices.tolist(): results[group_idx] = BLANK_CHAR_RESULT
+
+    flat_images, flat_owners = [], []
+    for group_idx in keep_indices.tolist():
+        flat_images.extend(char_variant_groups[group_idx])
+        flat_owners.extend([group_idx] * len(char_variant_groups[group_idx]))
+    if not flat_images: return results
+
+    model_classifier.eval()
+    probability_sums = None
+    for start_idx in range(0, len(flat_images), batch_size):
+        with profiling.stage(profiler, "char_preprocess"):
+            img_tensor = _chars_to_tensor(flat_images[start_idx:start_idx + batch_size]).to(device_obj)
+        profiling.count(profiler, "char_forward_passes")
+        with profiling.stage(profiler, "char_inference"), torch.no_grad():
+            probabilities = torch.softmax(model_classifier(img_tensor), dim=1).float().cpu()
+        if probability_sums is None: probability_sums = torch.zeros(len(char_variant_groups), probabilities.shape[1])
+        probability_sums.index_add_(0, torch.tensor(flat_owners[start_idx:start_idx + batch_size]), probabilities)
+    variant_counts = torch.tensor([len(group) for group in char_variant_groups], dtype=torch.float32).clamp_(min=1)
+    confidences, predicted_idxs = torch.max(probability_sums / variant_counts[:, None], 1)
+    for group_idx in keep_indices.tolist():
+        results[group_idx] = (config.CHAR_IDX_TO_CLASS.get(predicted_idxs[group_idx].item(), '?'), confidences[group_idx].item())
+    return results
+
+REPORT_COLUMNS = ["Nomor Pertanyaan", "Gambar Pertanyaan", "Hasil Karakter", "Avg. Confidence"]
+
+def _excel_image_from_pil(image_pil, display_height_px, downscale):
+    # Gambar disematkan langsung dari buffer memori (tanpa file PNG sementara)
+    display_width_px = display_height_px * (image_pil.width / image_pil.height if image_pil.height > 0 else 1)
+    if downscale and image_pil.height > display_height_px:
+        # Simpan pada resolusi tampilan saja; encode PNG jauh lebih cepat dan file lebih kecil
+        image_pil = image_pil.resize((max(1, int(round(display_width_px))), display_height_px), Image.BILINEAR, reducing_gap=2.0)
+    png_buffer = io.BytesIO()
+    image_pil.save(png_buffer, format="PNG", compress_level=config.EXCEL_PNG_COMPRESS_LEVEL)
+    png_buffer.seek(0)
+    img_for_excel = XLImage(png_buffer)
+    img_for_excel.height = display_height_px
+    img_for_excel.width = display_width_px
+    return img_for_excel
+
+def _excel_image_for_result(res_data, display_height_px, downscale):
+    # Record ringkas (result_records.FieldResult) sudah membawa PNG crop: disematkan apa adanya tanpa decode/encode ulang
+    crop_png = getattr(res_data, "crop_png", None)
+    if crop_png is not None and not downscale:
+        crop_width, crop_height = res_data.crop_size
+        img_for_excel = XLImage(io.BytesIO(crop_png))
+        img_for_excel.height = display_height_px
+        img_for_excel.width = display_height_px * (crop_width / crop_height if crop_height > 0 else 1)
+        return img_for_excel
+    image_pil = res_data.get("Image_PIL")
+    if image_pil is None: return None
+    return _excel_image_from_pil(image_pil, display_height_px, downscale)
+
+def write_excel_report(results_data, output, write_only=False, include_images=True,
+                       downscale_images=None, document_column=False):
+    """
+    Tulis laporan Excel ke `output` (path atau file-like). `results_data` boleh
+    berupa iterable/generator; dengan `write_only` baris ditulis secara streaming
+    (mode write-only openpyxl) sehingga ekspor banyak dokumen tidak menahan
+    seluruh sel di memori. `document_column` menambahkan kolom "Dokumen" dari
+    kunci "Dokumen" pada setiap hasil.
+    """
+    if downscale_images is None: downscale_images = config.EXCEL_DOWNSCALE_IMAGES
+    display_height_px = config.EXCEL_IMAGE_HEIGHT_PX
+    header_row = list(REPORT_COLUMNS) + (["Dokumen"] if document_column else [])
+
+    wb = Workbook(write_only=write_only)
+    ws = wb.create_sheet("Hasil Ekstraksi") if write_only else wb.active
     ws.title = "Hasil Ekstraksi"
-    ws.append(["Nomor Pertanyaan", "Gambar Pertanyaan", "Hasil Karakter", "Avg. Confidence"]) 
     ws.column_dimensions['A'].width = 25
     ws.column_dimensions['B'].width = 45 
     ws.column_dimensions['C'].width = 30
     ws.column_dimensions['D'].width = 20
-    
-    current_excel_row = 2
-    temp_image_paths_for_cleanup = []
+    if document_column: ws.column_dimensions['E'].width = 40
+    ws.append(header_row) 
 
+    current_excel_row = 2
     for res_data in results_data:
-        ws.row_dimensions[current_excel_row].height = 70 
-        
-        temp_img_path = os.path.join(config.TEMP_PROCESSING_DIR, f"excel_temp_img_{current_excel_row}.png")
-        try:
-            res_data["Image_PIL"].save(temp_img_path)
-            temp_image_paths_for_cleanup.append(temp_img_path)
-            
-            img_for_excel = XLImage(temp_img_path)
-            img_for_excel.height = 80 
-            aspect_ratio = res_data["Image_PIL"].width / res_data["Image_PIL"].height if res_data["Image_PIL"].height > 0 else 1
-            img_for_excel.width = img_for_excel.height * aspect_ratio
-            ws.add_image(img_for_excel, f"B{current_excel_row}")
-        except Exception as e_excel_img:
-            print(f"Error menambah gambar ke excel: {e_excel_img}")
-            ws[f"B{current_excel_row}"] = "Gagal memuat gambar"
-
-        ws[f"A{current_excel_row}"] = res_data["ID_Pertanyaan"] 
-        ws[f"C{current_excel_row}"] = res_data["Teks"]
-        ws[f"D{current_excel_row}"] = res_data["Avg_Conf"]
+        # Pada mode write-only tinggi baris harus diatur sebelum baris ditulis
+        if include_images: ws.row_dimensions[current_excel_row].height = 70 
+
+        image_cell_value = None
+        if include_images and "Image_PIL" in res_data:
+            try:
+                img_for_excel = _excel_image_for_result(res_data, display_height_px, downscale_images)
+                if img_for_excel is not None:
+                    img_for_excel.anchor = f"B{current_excel_row}"
+                    ws.add_image(img_for_excel)
+            except Exception as e_excel_img:
+                print(f"Error menambah gambar ke excel: {e_excel_img}")
+                image_cell_value = "Gagal memuat gambar"
+
+        row_values = [res_data["ID_Pertanyaan"], image_cell_value, res_data["Teks"], res_data["Avg_Conf"]]
+        if document_column: row_values.append(res_data.get("Dokumen", ""))
+        ws.append(row_values)
         current_excel_row += 1
-            
+
+    wb.save(output)
+    return output
+
+def create_excel_report(results_data, write_only=False, include_images=True, downscale_images=None):
     excel_buffer = io.BytesIO()
-    wb.save(excel_buffer)
+    write_excel_report(results_data, excel_buffer, write_only=write_only,
+                       include_images=include_images, downscale_images=downscale_images)
     excel_buffer.seek(0)
-    
-    for img_path in temp_image_paths_for_cleanup:
-        if os.path.exists(img_path):
-            try: os.remove(img_path)
-            except Exception as e_del_excel: print(f"Gagal hapus temp img excel: {e_del_excel}")
-            
     return excel_buffer
+
+def create_tabular_report(results_data, output_format="csv"):
+    """
+    Laporan ringan tanpa gambar dalam format "csv" atau "parquet" (parquet
+    membutuhkan pandas + pyarrow). Mengembalikan BytesIO.
+    """
+    # Kolom standar lebih dulu, lalu kolom tambahan (mis. Dokumen) sesuai urutan kemunculan
+    column_keys = ["ID_Pertanyaan", "Halaman", "Teks", "Avg_Conf"]
+    rows = []
+    for res_data in results_data:
+        rows.append({key: value for key, value in res_data.items() if key != "Image_PIL"})
+        column_keys += [key for key in rows[-1] if key not in column_keys]
+    report_buffer = io.BytesIO()
+    if output_format == "csv":
+        text_buffer = io.StringIO()
+        writer = csv.DictWriter(text_buffer, fieldnames=column_keys)
+        writer.writeheader()
+        writer.writerows(rows)
+        report_buffer.write(text_buffer.getvalue().encode("utf-8"))
+    elif output_format == "parquet":
+        try:
+            import pandas as pd
+        except ImportError as e_import:
+            raise RuntimeError("Ekspor Parquet membutuhkan pandas dan pyarrow (pip install pandas pyarrow).") from e_import
+        pd.DataFrame(rows, columns=column_keys).to_parquet(report_buffer, index=False)
+    else:
+        raise ValueError(f"Format laporan tidak dikenal: {output_format}")
+    report_buffer.seek(0)
+    return report_buffer
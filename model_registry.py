@@ -0,0 +1,102 @@
+# model_registry.py
+# Registry model tingkat proses: setiap model dimuat sekali per device, di-warmup,
+# dan dipakai ulang oleh Streamlit (antar rerun), worker CLI, maupun worker lainnya.
+
+import time
+import threading
+import torch
+import model
+import backends
+import config # Import file config
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+def _warmup_ssd(model_ssd, device_obj):
+    dummy_image = torch.zeros(3, *config.SSD_INPUT_SIZE, device=device_obj)
+    with torch.no_grad():
+        model_ssd([dummy_image])
+
+def _warmup_char_classifier(model_classifier, device_obj):
+    dummy_batch = torch.zeros(1, 3, *config.CHAR_IMAGE_SIZE, device=device_obj)
+    with torch.no_grad():
+        model_classifier(dummy_batch)
+
+_MODEL_SPECS = {
+    "ssd": (lambda device_obj: model.load_ssd_model(config.SSD_MODEL_PATH, config.SSD_NUM_CLASSES, device_obj), _warmup_ssd),
+    "char_classifier": (lambda device_obj: model.load_char_classifier_model(config.CHAR_CLASSIFIER_MODEL_PATH, config.CHAR_NUM_CLASSES, device_obj), _warmup_char_classifier),
+}
+
+def get_model(model_name, device_obj=None, backend=None):
+    """
+    Ambil model dari registry, muat dan warmup saat pertama kali diminta untuk
+    device dan backend inferensi tersebut (default config.INFERENCE_BACKEND, lihat
+    backends.py). Gagal muat (None) tidak di-cache agar bisa dicoba lagi.
+    """
+    if device_obj is None: device_obj = config.DEVICE
+    if backend is None: backend = config.INFERENCE_BACKEND
+    registry_key = (model_name, str(device_obj), backend)
+    entry = _registry.get(registry_key)
+    if entry is not None: return entry["model"]
+
+    with _registry_lock:
+        entry = _registry.get(registry_key)
+        if entry is not None: return entry["model"]
+
+        load_fn, warmup_fn = _MODEL_SPECS[model_name]
+        start_time = time.perf_counter()
+        loaded_model = load_fn(device_obj)
+        if loaded_model is None: return None
+        loaded_model, effective_backend = backends.apply_backend(model_name, loaded_model, backend, device_obj)
+        load_time_s = time.perf_counter() - start_time
+
+        warmup_time_s = 0.0
+        if config.MODEL_WARMUP:
+            start_time = time.perf_counter()
+            try:
+                warmup_fn(loaded_model, device_obj)
+            except Exception as e_warmup:
+                print(f"Warmup model '{model_name}' gagal: {e_warmup}")
+            warmup_time_s = time.perf_counter() - start_time
+
+        _registry[registry_key] = {
+            "model": loaded_model, "backend": effective_backend, "load_time_s": load_time_s,
+            "warmup_time_s": warmup_time_s, "loaded_at": time.time(),
+        }
+        print(f"Model '{model_name}' ({effective_backend}) siap di {device_obj} (muat {load_time_s:.2f}s, warmup {warmup_time_s:.2f}s).")
+        return loaded_model
+
+def get_ssd_model(device_obj=None, backend=None):
+    return get_model("ssd", device_obj, backend)
+
+def get_char_classifier_model(device_obj=None, backend=None):
+    return get_model("char_classifier", device_obj, backend)
+
+def get_models(device_obj=None, backend=None):
+    # Pasangan (model_ssd, model_char_classifier) untuk device dan backend yang diminta
+    return get_ssd_model(device_obj, backend), get_char_classifier_model(device_obj, backend)
+
+def get_effective_backends(device_obj=None, backend=None):
+    # Backend yang benar-benar dipakai (ssd, char_classifier), mis. eager jika artefak int8 belum ada
+    if device_obj is None: device_obj = config.DEVICE
+    if backend is None: backend = config.INFERENCE_BACKEND
+    with _registry_lock:
+        return [
+            _registry[(model_name, str(device_obj), backend)]["backend"] if (model_name, str(device_obj), backend) in _registry else None
+            for model_name in ("ssd", "char_classifier")
+        ]
+
+def get_registry_stats():
+    # Waktu muat dan warmup setiap model yang sudah ada di registry
+    with _registry_lock:
+        return {
+            f"{model_name}@{device_str}/{backend}": {
+                "backend": entry["backend"], "load_time_s": entry["load_time_s"], "warmup_time_s": entry["warmup_time_s"],
+                "loaded_at": entry["loaded_at"],
+            }
+            for (model_name, device_str, backend), entry in _registry.items()
+        }
+
+def clear_registry():
+    with _registry_lock:
+        _registry.clear()
@@ -0,0 +1,366 @@
+# pipeline.py
+# Pipeline produsen/konsumen internal: render halaman, crop + preprocessing area,
+# deteksi SSD, dan klasifikasi karakter berjalan sebagai stage terpisah yang
+# dihubungkan queue berukuran terbatas (backpressure), sehingga inferensi tetap
+# sibuk selagi halaman berikutnya dirender.
+
+import time
+import queue
+import threading
+import model
+import extraction
+import result_cache
+import registration
+import template_grid
+import profiling
+import config # Import file config
+
+# Penanda akhir aliran data di dalam queue
+_END_OF_STREAM = object()
+
+class StageError(Exception):
+    """Error dari fungsi sebuah stage; error aslinya ada di __cause__."""
+    def __init__(self, stage_name, original_error):
+        super().__init__(f"{stage_name}: {original_error}")
+        self.stage_name = stage_name
+
+class _ProgressUpdate:
+    # Progres dari thread stage, dikirim lewat queue output agar callback dipanggil di thread Pipeline.run
+    __slots__ = ("fraction", "text")
+    def __init__(self, fraction, text):
+        self.fraction = fraction
+        self.text = text
+
+class StageStats:
+    """Penghitung per stage: item masuk/keluar, waktu sibuk, dan kedalaman queue input."""
+    def __init__(self, name, num_workers):
+        self.name = name
+        self.num_workers = num_workers
+        self.items_in = 0
+        self.items_out = 0
+        self.batches = 0
+        self.errors = 0
+        self.busy_s = 0.0
+        self.started_at = None
+        self.finished_at = None
+        self.queue_depth_max = 0
+        self.queue_depth_sum = 0
+        self.queue_depth_samples = 0
+        self._lock = threading.Lock()
+
+    def record_queue_depth(self, depth):
+        with self._lock:
+            self.queue_depth_max = max(self.queue_depth_max, depth)
+            self.queue_depth_sum += depth
+            self.queue_depth_samples += 1
+
+    def record_work(self, num_in, num_out, busy_s):
+        with self._lock:
+            self.items_in += num_in
+            self.items_out += num_out
+            self.batches += 1
+            self.busy_s += busy_s
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def to_dict(self):
+        wall_s = 0.0
+        if self.started_at is not None:
+            wall_s = (self.finished_at or time.perf_counter()) - self.started_at
+        return {
+            "stage": self.name, "workers": self.num_workers,
+            "items_in": self.items_in, "items_out": self.items_out, "batches": self.batches,
+            "errors": self.errors, "busy_s": round(self.busy_s, 4), "wall_s": round(wall_s, 4),
+            "throughput_items_per_s": round(self.items_out / wall_s, 2) if wall_s > 0 else 0.0,
+            "utilization": round(self.busy_s / (wall_s * self.num_workers), 3) if wall_s > 0 else 0.0,
+            "queue_depth_max": self.queue_depth_max,
+            "queue_depth_avg": round(self.queue_depth_sum / self.queue_depth_samples, 2) if self.queue_depth_samples else 0.0,
+        }
+
+class Stage:
+    """
+    Satu stage pipeline. `fn` menerima list item (panjang <= batch_size) dan
+    mengembalikan list item keluaran (boleh lebih banyak/sedikit dari input).
+    Item dikumpulkan hingga batch_size atau sampai max_wait_s sejak item pertama.
+    """
+    def __init__(self, name, fn, num_workers=1, batch_size=1, max_wait_s=0.0, queue_size=None):
+        self.name = name
+        self.fn = fn
+        self.num_workers = max(1, int(num_workers))
+        self.batch_size = max(1, int(batch_size))
+        self.max_wait_s = max_wait_s
+        self.in_queue = queue.Queue(maxsize=queue_size if queue_size is not None else config.PIPELINE_QUEUE_SIZE)
+        self.out_queue = None
+        self.stats = StageStats(name, self.num_workers)
+        self._workers_alive = self.num_workers
+        self._alive_lock = threading.Lock()
+
+    def _next_batch(self):
+        # Ambil satu batch; mengembalikan (list item, apakah akhir aliran sudah tercapai)
+        first_item = self.in_queue.get()
+        self.stats.record_queue_depth(self.in_queue.qsize())
+        if first_item is _END_OF_STREAM: return [], True
+        batch_items = [first_item]
+        deadline = time.perf_counter() + self.max_wait_s
+        while len(batch_items) < self.batch_size:
+            remaining_s = deadline - time.perf_counter()
+            try:
+                next_item = self.in_queue.get(timeout=remaining_s) if remaining_s > 0 else self.in_queue.get_nowait()
+            except queue.Empty:
+                break
+            if next_item is _END_OF_STREAM:
+                return batch_items, True
+            batch_items.append(next_item)
+        return batch_items, False
+
+    def _worker_loop(self, owner_pipeline):
+        while True:
+            batch_items, reached_end = self._next_batch()
+            # Setelah pipeline dibatalkan, sisa item hanya dikuras agar semua thread cepat selesai
+            if batch_items and not owner_pipeline.abort_event.is_set():
+                start_time = time.perf_counter()
+                try:
+                    outputs = self.fn(batch_items)
+                except Exception as e_stage:
+                    self.stats.record_error()
+                    owner_pipeline.record_error(self.name, e_stage)
+                    print(f"Error di stage pipeline '{self.name}': {e_stage}")
+                    outputs = []
+                self.stats.record_work(len(batch_items), len(outputs), time.perf_counter() - start_time)
+                for output_item in outputs:
+                    self.out_queue.put(output_item) # Memblokir jika stage berikutnya penuh (backpressure)
+            if reached_end:
+                # Kembalikan penanda untuk worker lain di stage ini; worker terakhir meneruskannya
+                self.in_queue.put(_END_OF_STREAM)
+                with self._alive_lock:
+                    self._workers_alive -= 1
+                    is_last_worker = self._workers_alive == 0
+                if is_last_worker:
+                    self.stats.finished_at = time.perf_counter()
+                    self.out_queue.put(_END_OF_STREAM)
+                return
+
+class Pipeline:
+    """
+    Rangkaian stage yang dihubungkan queue terbatas; hasil stage terakhir dikumpulkan ke list.
+    Error pertama di sebuah stage membatalkan sisa pekerjaan dan dilempar ulang oleh run()
+    sebagai StageError, sehingga hasil parsial tidak pernah dikembalikan.
+    """
+    def __init__(self, stages):
+        self.stages = stages
+        self.output_queue = queue.Queue()
+        for stage, next_stage in zip(stages, stages[1:]):
+            stage.out_queue = next_stage.in_queue
+        stages[-1].out_queue = self.output_queue
+        self.errors = []
+        self.abort_event = threading.Event()
+        self._first_error = None
+        self._error_lock = threading.Lock()
+        self.started_at = None
+        self.finished_at = None
+
+    def record_error(self, stage_name, error):
+        with self._error_lock:
+            self.errors.append(f"{stage_name}: {error}")
+            if self._first_error is None: self._first_error = (stage_name, error)
+        self.abort_event.set()
+
+    def report_progress(self, fraction, text):
+        # Aman dipanggil dari thread stage; callback progres dijalankan di thread pemanggil run()
+        self.output_queue.put(_ProgressUpdate(fraction, text))
+
+    def run(self, source_items, progress_callback=None):
+        """
+        Jalankan semua stage dan kembalikan list hasil stage terakhir. Progres dari
+        report_progress diteruskan ke `progress_callback` di thread ini; jika callback
+        melempar error (mis. job dibatalkan), pipeline dihentikan lalu error itu dilempar ulang.
+        """
+        self.started_at = time.perf_counter()
+        threads = []
+        for stage in self.stages:
+            stage.stats.started_at = self.started_at
+            for worker_idx in range(stage.num_workers):
+                worker_thread = threading.Thread(
+                    target=stage._worker_loop, args=(self,),
+                    name=f"pipeline-{stage.name}-{worker_idx}", daemon=True
+                )
+                worker_thread.start()
+                threads.append(worker_thread)
+
+        # Produsen utama berjalan di thread terpisah agar pengumpulan hasil tidak ikut terblokir
+        def feed_source():
+            for source_item in source_items:
+                if self.abort_event.is_set(): break
+                self.stages[0].in_queue.put(source_item)
+            self.stages[0].in_queue.put(_END_OF_STREAM)
+        feeder_thread = threading.Thread(target=feed_source, name="pipeline-source", daemon=True)
+        feeder_thread.start()
+
+        results = []
+        callback_error = None
+        while True:
+            output_item = self.output_queue.get()
+            if output_item is _END_OF_STREAM: break
+            if isinstance(output_item, _ProgressUpdate):
+                if progress_callback is None or callback_error is not None: continue
+                try:
+                    progress_callback(output_item.fraction, output_item.text)
+                except BaseException as e_callback:
+                    # Tetap kuras queue sampai akhir agar thread stage tidak tertahan
+                    callback_error = e_callback
+                    self.abort_event.set()
+                continue
+            results.append(output_item)
+        feeder_thread.join()
+        for worker_thread in threads:
+            worker_thread.join()
+        self.finished_at = time.perf_counter()
+        if callback_error is not None: raise callback_error
+        if self._first_error is not None:
+            stage_name, stage_error = self._first_error
+            raise StageError(stage_name, stage_error) from stage_error
+        return results
+
+    def get_stats(self):
+        wall_s = (self.finished_at or time.perf_counter()) - (self.started_at or time.perf_counter())
+        return {
+            "wall_s": round(wall_s, 4), "errors": list(self.errors),
+            "stages": [stage.stats.to_dict() for stage in self.stages],
+        }
+
+def run_document_pipeline(pdf_bytes, annotation_layout, model_s, model_c, device_obj, progress_callback=None, profiler=None,
+                          scheduler=None, document_tag=None):
+    """
+    Jalankan ekstraksi satu dokumen (mode "page") sebagai pipeline 4 stage.
+    Dengan `scheduler`, stage deteksi/klasifikasi memakai batch bersama lintas dokumen.
+    Mengembalikan (list item hasil per area, jumlah halaman yang dirender, statistik pipeline,
+    (kunci cache area atau None, list indeks hasil yang diambil dari cache)).
+    Setiap item hasil: (field, gambar area, teks, list confidence), urut sesuai layout.
+    Melempar StageError jika salah satu stage gagal (tidak ada hasil parsial) dan
+    extraction.ExtractionError jika PDF tidak bisa dibaca.
+    """
+    transform_s = model.get_ssd_transform()
+    template_grids = template_grid.get_active_grids(annotation_layout)
+    page_references = registration.get_active_references(annotation_layout)
+    num_pages_total = len(annotation_layout.page_numbers)
+    pages_done = [0]
+    field_cache_hits = [0]
+    grid_fields = [0]
+    field_cache_by_idx = {} # field_idx -> (kunci cache area, apakah diambil dari cache)
+    pages_lock = threading.Lock()
+
+    with model.temp_pdf_file(pdf_bytes) as temp_pdf_path:
+        try:
+            total_pages = model.model_get_pdf_page_count(temp_pdf_path)
+        except Exception as e_count:
+            print(f"Error saat membaca jumlah halaman PDF: {e_count}")
+            raise extraction.ExtractionError("Gagal mengkonversi PDF ke gambar.") from e_count
+
+        def render_pages(page_numbers):
+            rendered = []
+            for page_number in page_numbers:
+                page_image = model.model_render_pdf_page(temp_pdf_path, page_number, profiler=profiler)
+                # Halaman yang ada di PDF tetapi tidak menghasilkan gambar membuat dokumen gagal (bukan dilewati)
+                if page_image is None: raise model.PdfRenderError(f"Halaman {page_number} tidak menghasilkan gambar")
+                rendered.append((page_number, page_image))
+            return rendered
+
+        def crop_and_preprocess(page_items):
+            field_items = []
+            for page_number, page_image in page_items:
+                page_fields = registration.crop_page_fields(annotation_layout, page_number, page_image, page_references, profiler)
+                with profiling.stage(profiler, "field_cache_lookup"):
+                    field_keys = extraction.compute_field_cache_keys(
+                        [field_image_pil for _, field_image_pil in page_fields], [field for field, _ in page_fields], template_grids
+                    )
+                    cached_fields = result_cache.get_fields(field_keys) if field_keys is not None else {}
+                cached_values = [cached_fields.get(field_keys[field_pos]) if field_keys is not None else None for field_pos in range(len(page_fields))]
+                # Pergeseran grid halaman dihitung dari semua area di halaman (termasuk yang ada di cache) agar
+                # kotak sebuah area tidak bergantung isi cache; kotaknya hanya dipakai area yang tidak ada di cache
+                pending_positions = [field_pos for field_pos, cached_value in enumerate(cached_values) if cached_value is None]
+                grid_boxes_per_field = [None] * len(page_fields)
+                if template_grids is not None and pending_positions:
+                    matched_boxes = template_grid.match_fields(
+                        template_grids, [field for field, _ in page_fields], [field_image_pil for _, field_image_pil in page_fields], profiler
+                    )
+                    for field_pos in pending_positions:
+                        grid_boxes_per_field[field_pos] = matched_boxes[field_pos]
+                page_cache_hits = 0
+                page_grid_fields = sum(1 for field_pos in pending_positions if grid_boxes_per_field[field_pos] is not None)
+                for field_pos, (field, field_image_pil) in enumerate(page_fields):
+                    field_key = field_keys[field_pos] if field_keys is not None else None
+                    cached_value = cached_values[field_pos]
+                    grid_boxes = grid_boxes_per_field[field_pos]
+                    # Area dari cache atau grid tidak perlu tensor SSD; diteruskan apa adanya
+                    with profiling.stage(profiler, "ssd_preprocess"):
+                        needs_ssd = cached_value is None and grid_boxes is None
+                        ssd_tensor = model.model_preprocess_field_for_ssd(field_image_pil, transform_s) if needs_ssd else None
+                    if cached_value is not None: page_cache_hits += 1
+                    field_items.append((field, field_image_pil, ssd_tensor, field_key, cached_value, grid_boxes))
+                with pages_lock:
+                    pages_done[0] += 1
+                    field_cache_hits[0] += page_cache_hits
+                    grid_fields[0] += page_grid_fields
+                    field_cache_by_idx.update(
+                        (field.field_idx, (field_keys[field_pos] if field_keys is not None else None, cached_values[field_pos] is not None))
+                        for field_pos, (field, _) in enumerate(page_fields)
+                    )
+                    document_pipeline.report_progress(pages_done[0] / max(1, num_pages_total),
+                                                      f"Pipeline: {pages_done[0]}/{num_pages_total} halaman dirender dan di-crop...")
+            return field_items
+
+        def detect(field_items):
+            pending_items = [item for item in field_items if item[2] is not None]
+            char_boxes_per_field = model.model_detect_chars_preprocessed(
+                [item[2] for item in pending_items], [item[1].size for item in pending_items], model_s, device_obj, profiler=profiler,
+                scheduler=scheduler, document_tag=document_tag
+            ) if pending_items else []
+            char_boxes_by_field_idx = {item[0].field_idx: char_boxes for item, char_boxes in zip(pending_items, char_boxes_per_field)}
+            return [(field, field_image_pil, grid_boxes if grid_boxes is not None else char_boxes_by_field_idx.get(field.field_idx), field_key, cached_value)
+                    for field, field_image_pil, _, field_key, cached_value, grid_boxes in field_items]
+
+        def classify(field_items):
+            pending_items = [item for item in field_items if item[4] is None]
+            with profiling.stage(profiler, "char_crop"):
+                char_images_all, char_owner_field_idx = extraction.collect_char_crops(
+                    [item[1] for item in pending_items], [item[2] for item in pending_items]
+                )
+            char_predictions = model.model_classify_chars_batch(char_images_all, model_c, device_obj, profiler=profiler,
+                                                                scheduler=scheduler, document_tag=document_tag)
+            recognized_strings, confidences_per_field = extraction.assemble_field_texts(
+                len(pending_items), char_owner_field_idx, char_predictions
+            )
+            recognized_by_field_idx = {}
+            new_field_values = {}
+            for pending_idx, item in enumerate(pending_items):
+                recognized_by_field_idx[item[0].field_idx] = (recognized_strings[pending_idx], confidences_per_field[pending_idx])
+                if item[3] is not None:
+                    new_field_values[item[3]] = recognized_by_field_idx[item[0].field_idx]
+            extraction.store_field_values(new_field_values, profiler)
+            profiling.count(profiler, "fields", len(field_items))
+            profiling.count(profiler, "field_cache_hits", len(field_items) - len(pending_items))
+            return [(field, field_image_pil) + (cached_value or recognized_by_field_idx[field.field_idx])
+                    for field, field_image_pil, _, _, cached_value in field_items]
+
+        document_pipeline = Pipeline([
+            Stage("render", render_pages, num_workers=config.PIPELINE_RENDER_WORKERS),
+            Stage("crop", crop_and_preprocess, num_workers=config.PIPELINE_CROP_WORKERS),
+            Stage("detect", detect, num_workers=config.PIPELINE_DETECT_WORKERS,
+                  batch_size=config.SSD_BATCH_SIZE, max_wait_s=config.PIPELINE_MAX_WAIT_S),
+            Stage("classify", classify, num_workers=config.PIPELINE_CLASSIFY_WORKERS,
+                  batch_size=config.PIPELINE_CLASSIFY_FIELDS_PER_BATCH, max_wait_s=config.PIPELINE_MAX_WAIT_S),
+        ])
+        valid_pages = [p for p in annotation_layout.page_numbers if 1 <= p <= total_pages]
+        field_results = document_pipeline.run(valid_pages, progress_callback)
+
+    pages_rendered = document_pipeline.stages[0].stats.items_out
+    field_results.sort(key=lambda item: item[0].field_idx)
+    pipeline_stats = document_pipeline.get_stats()
+    pipeline_stats["field_cache_hits"] = field_cache_hits[0]
+    pipeline_stats["grid_fields"] = grid_fields[0]
+    field_keys = [field_cache_by_idx[field.field_idx][0] for field, _, _, _ in field_results]
+    if None in field_keys: field_keys = None # Cache area dimatikan
+    cached_positions = [result_idx for result_idx, (field, _, _, _) in enumerate(field_results) if field_cache_by_idx[field.field_idx][1]]
+    return field_results, pages_rendered, pipeline_stats, (field_keys, cached_positions)
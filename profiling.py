@@ -0,0 +1,95 @@
+# profiling.py
+# Instrumentasi waktu per stage dan penghitung per dokumen untuk alur ekstraksi.
+# Semua fungsi menerima profiler=None sehingga tanpa profiler biayanya hampir nol.
+
+import json
+import time
+import threading
+import contextlib
+
+class ExtractionProfiler:
+    """
+    Mengumpulkan total waktu dan jumlah panggilan per stage (mis. render_pdf,
+    ssd_inference) serta penghitung (mis. boxes_before_nms, blank_crops_skipped).
+    Aman dipakai dari beberapa thread; pada mode pipeline waktu antar stage
+    bisa tumpang tindih sehingga jumlahnya melebihi waktu total dokumen.
+    """
+    def __init__(self, label=""):
+        self.label = label
+        self.started_at = time.perf_counter()
+        self.finished_at = None
+        self.stage_times = {}
+        self.stage_calls = {}
+        self.counters = {}
+        self.metadata = {}
+        self.torch_trace_path = None
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, stage_name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_s = time.perf_counter() - start_time
+            with self._lock:
+                self.stage_times[stage_name] = self.stage_times.get(stage_name, 0.0) + elapsed_s
+                self.stage_calls[stage_name] = self.stage_calls.get(stage_name, 0) + 1
+
+    def count(self, counter_name, amount=1):
+        with self._lock:
+            self.counters[counter_name] = self.counters.get(counter_name, 0) + int(amount)
+
+    def finish(self):
+        if self.finished_at is None: self.finished_at = time.perf_counter()
+
+    def to_dict(self):
+        total_s = (self.finished_at or time.perf_counter()) - self.started_at
+        with self._lock:
+            stages = {
+                stage_name: {
+                    "total_s": round(stage_s, 4), "calls": self.stage_calls[stage_name],
+                    "pct_of_total": round(100.0 * stage_s / total_s, 1) if total_s > 0 else 0.0,
+                }
+                for stage_name, stage_s in sorted(self.stage_times.items(), key=lambda kv: -kv[1])
+            }
+            return {
+                "label": self.label, "total_s": round(total_s, 4), "stages": stages,
+                "counters": dict(sorted(self.counters.items())), "metadata": dict(self.metadata),
+                "torch_trace": self.torch_trace_path,
+            }
+
+    def to_json(self, output_path=None):
+        json_text = json.dumps(self.to_dict(), indent=2, default=str)
+        if output_path is not None:
+            with open(output_path, "w", encoding="utf-8") as f:
+                f.write(json_text)
+        return json_text
+
+def stage(profiler, stage_name):
+    # Context manager pengukur waktu; tidak melakukan apa pun jika profiler None
+    if profiler is None: return contextlib.nullcontext()
+    return profiler.stage(stage_name)
+
+def count(profiler, counter_name, amount=1):
+    if profiler is not None: profiler.count(counter_name, amount)
+
+@contextlib.contextmanager
+def torch_trace(profiler, trace_path):
+    """
+    Jalankan torch.profiler selama blok dan simpan trace Chrome ke trace_path
+    (bisa dibuka di chrome://tracing atau Perfetto). Tidak aktif jika trace_path None.
+    Operator yang dijalankan di thread worker pipeline bisa tidak ikut terekam,
+    jadi gunakan mode non-pipeline untuk trace inferensi yang lengkap.
+    """
+    if not trace_path:
+        yield
+        return
+    from torch.profiler import profile, ProfilerActivity
+    import torch
+    activities = [ProfilerActivity.CPU]
+    if torch.cuda.is_available(): activities.append(ProfilerActivity.CUDA)
+    with profile(activities=activities, record_shapes=True) as torch_profiler:
+        yield
+    torch_profiler.export_chrome_trace(trace_path)
+    if profiler is not None: profiler.torch_trace_path = trace_path
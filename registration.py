@@ -0,0 +1,280 @@
+# registration.py
+# Registrasi halaman: rotasi, skala, dan pergeseran scan terhadap formulir referensi
+# diestimasi sekali per halaman (NumPy, pada gambar kerja beresolusi rendah) lalu
+# diterapkan ke semua persegi anotasi di halaman itu sebelum crop.
+# Profil referensi per halaman disimpan di samping file anotasi (anotasi_<gender>.reg.json).
+#
+# Contoh (PDF referensi sebaiknya formulir asli yang dipakai saat membuat anotasi):
+#   python registration.py build --pdf data/formulir_kosong_pria.pdf --gender pria
+
+import os
+import sys
+import json
+import math
+import argparse
+import threading
+from collections import namedtuple
+import numpy as np
+from PIL import Image
+import model
+import layout
+import profiling
+import template_grid
+import config # Import file config
+
+# Naikkan jika format file referensi berubah
+REGISTRATION_FORMAT_VERSION = 1
+# Jumlah maksimum piksel gelap dan pembesaran gambar kerja untuk estimasi kemiringan
+_SKEW_MAX_POINTS = 60000
+_SKEW_WORK_SCALE = 2
+
+# Transformasi referensi -> halaman: p_halaman = pusat + scale * R(angle_deg) * (p_ref - pusat) + (dx, dy)
+PageTransform = namedtuple("PageTransform", ["angle_deg", "scale", "dx", "dy", "confidence"])
+
+_reference_cache = {}
+_reference_cache_lock = threading.Lock()
+
+def _work_darkness(page_image_pil, work_size):
+    gray = page_image_pil.convert("L")
+    if gray.size != tuple(work_size): gray = gray.resize(tuple(work_size), Image.BOX)
+    return gray, (255.0 - np.asarray(gray, dtype=np.float32)) / 255.0
+
+def _parabolic_peak(values, best_pos):
+    # Puncak sub-piksel dari tiga titik di sekitar maksimum
+    if best_pos <= 0 or best_pos >= len(values) - 1: return 0.0
+    left, center, right = values[best_pos - 1], values[best_pos], values[best_pos + 1]
+    denom = left - 2.0 * center + right
+    return float(0.5 * (left - right) / denom) if abs(denom) > 1e-12 else 0.0
+
+def estimate_skew_deg(darkness):
+    """
+    Sudut kemiringan garis/baris cetakan (derajat, koordinat gambar dengan y ke
+    bawah) dari ketajaman proyeksi baris: piksel gelap diproyeksikan pada semua
+    sudut kandidat sekaligus, sudut dengan histogram baris paling tajam dipilih.
+    """
+    height, width = darkness.shape
+    ys, xs = np.nonzero(darkness > 0.5)
+    if len(ys) < 100: return 0.0
+    if len(ys) > _SKEW_MAX_POINTS:
+        sample_idx = np.linspace(0, len(ys) - 1, _SKEW_MAX_POINTS).astype(np.int64)
+        ys, xs = ys[sample_idx], xs[sample_idx]
+    max_angle, angle_step = config.REGISTRATION_MAX_ANGLE_DEG, config.REGISTRATION_ANGLE_STEP_DEG
+    angles = np.arange(-max_angle, max_angle + angle_step / 2, angle_step)
+    pad = int(math.ceil(width * math.tan(math.radians(max_angle)))) + 1
+    num_bins = height + 2 * pad
+    projected = ys[None, :] + (xs[None, :] - width / 2.0) * np.tan(np.radians(angles))[:, None]
+    bins = np.clip(np.round(projected).astype(np.int64) + pad, 0, num_bins - 1)
+    bins += np.arange(len(angles))[:, None] * num_bins
+    histograms = np.bincount(bins.ravel(), minlength=len(angles) * num_bins).reshape(len(angles), num_bins).astype(np.float64)
+    sharpness = (histograms * histograms).sum(axis=1)
+    best_pos = int(np.argmax(sharpness))
+    # Proyeksi y + (x - cx) * tan(a) rata saat garis bermiringan -a
+    return -float(angles[best_pos] + _parabolic_peak(sharpness, best_pos) * angle_step)
+
+def _deskew_work_image(gray_work, angle_deg):
+    # Gambar kerja tegak: piksel keluaran q diambil dari pusat + R(angle) * (q - pusat)
+    if abs(angle_deg) < 1e-3: return gray_work
+    cos_a, sin_a = math.cos(math.radians(angle_deg)), math.sin(math.radians(angle_deg))
+    cx, cy = gray_work.width / 2.0, gray_work.height / 2.0
+    affine = (cos_a, -sin_a, cx - cos_a * cx + sin_a * cy, sin_a, cos_a, cy - sin_a * cx - cos_a * cy)
+    return gray_work.transform(gray_work.size, Image.AFFINE, affine, resample=Image.BILINEAR, fillcolor=255)
+
+def _warp_profile(profile, scale):
+    # Profil referensi yang diskalakan terhadap pusatnya
+    positions = np.arange(len(profile), dtype=np.float64)
+    center = len(profile) / 2.0
+    return np.interp((positions - center) / scale + center, positions, profile, left=0.0, right=0.0)
+
+def _best_scale_and_shift(ref_cols, ref_rows, cur_cols, cur_rows):
+    # Skala seragam dan pergeseran (piksel kerja) dengan jumlah korelasi kolom + baris terbesar
+    max_delta, scale_step = config.REGISTRATION_MAX_SCALE_DELTA, config.REGISTRATION_SCALE_STEP
+    scales = np.arange(1.0 - max_delta, 1.0 + max_delta + scale_step / 2, scale_step)
+    best = None
+    scores = []
+    for scale in scales:
+        axis_results = []
+        for ref_profile, cur_profile in ((ref_cols, cur_cols), (ref_rows, cur_rows)):
+            shifts, ncc = template_grid.ncc_all_shifts(_warp_profile(ref_profile, scale), cur_profile,
+                                                       max(1, int(len(ref_profile) * config.REGISTRATION_MAX_SHIFT_FRAC)))
+            best_pos = int(np.argmax(ncc))
+            axis_results.append((float(shifts[best_pos]) + _parabolic_peak(ncc, best_pos), float(ncc[best_pos])))
+        score = axis_results[0][1] + axis_results[1][1]
+        scores.append(score)
+        if best is None or score > best[0]: best = (score, len(scores) - 1, axis_results)
+    _, best_pos, ((shift_x, ncc_x), (shift_y, ncc_y)) = best
+    scale = float(scales[best_pos] + _parabolic_peak(np.array(scores), best_pos) * scale_step)
+    return scale, shift_x, shift_y, min(ncc_x, ncc_y)
+
+def estimate_page_transform(page_image_pil, page_reference):
+    """
+    Estimasi PageTransform halaman terhadap referensinya: kemiringan dari proyeksi
+    baris, lalu skala dan pergeseran dari korelasi profil kolom/baris gambar yang
+    sudah ditegakkan. Pergeseran dikembalikan dalam piksel halaman.
+    """
+    work_w, work_h = page_reference["work_size"]
+    # Kemiringan butuh resolusi lebih tinggi dari profil: 0.1 derajat di gambar kerja 640 px kurang dari 1 px
+    _, skew_darkness = _work_darkness(page_image_pil, (work_w * _SKEW_WORK_SCALE, work_h * _SKEW_WORK_SCALE))
+    angle_deg = estimate_skew_deg(skew_darkness)
+    gray_work, _ = _work_darkness(page_image_pil, (work_w, work_h))
+    upright_darkness = (255.0 - np.asarray(_deskew_work_image(gray_work, angle_deg), dtype=np.float32)) / 255.0
+    scale, shift_x, shift_y, confidence = _best_scale_and_shift(
+        page_reference["col_profile"], page_reference["row_profile"], upright_darkness.mean(axis=0), upright_darkness.mean(axis=1)
+    )
+    # Pergeseran diukur di gambar tegak; di halaman asli vektornya ikut terotasi
+    cos_a, sin_a = math.cos(math.radians(angle_deg)), math.sin(math.radians(angle_deg))
+    page_w, page_h = page_image_pil.size
+    shift_x_px, shift_y_px = shift_x * page_w / work_w, shift_y * page_h / work_h
+    return PageTransform(angle_deg, scale, cos_a * shift_x_px - sin_a * shift_y_px, sin_a * shift_x_px + cos_a * shift_y_px, confidence)
+
+def is_identity(page_transform):
+    # Transformasi yang efeknya di bawah setengah piksel tidak perlu resampling
+    return (abs(page_transform.dx) < 0.5 and abs(page_transform.dy) < 0.5 and
+            abs(page_transform.scale - 1.0) < 1e-4 and abs(page_transform.angle_deg) < 1e-3)
+
+def crop_with_transform(page_image_pil, crop_rect, page_transform):
+    """
+    Crop area berukuran sama dengan persegi anotasi, diambil dari posisi hasil
+    transformasi (satu resampling affine). Bagian di luar halaman diisi putih,
+    jadi kotak di tepi halaman tidak terpotong oleh clamping.
+    """
+    if page_transform is None or is_identity(page_transform): return page_image_pil.crop(crop_rect)
+    x1, y1, x2, y2 = crop_rect
+    page_w, page_h = page_image_pil.size
+    cx, cy = page_w / 2.0, page_h / 2.0
+    cos_a, sin_a = math.cos(math.radians(page_transform.angle_deg)), math.sin(math.radians(page_transform.angle_deg))
+    m00, m01 = page_transform.scale * cos_a, -page_transform.scale * sin_a
+    m10, m11 = page_transform.scale * sin_a, page_transform.scale * cos_a
+    affine = (
+        m00, m01, cx + m00 * (x1 - cx) + m01 * (y1 - cy) + page_transform.dx,
+        m10, m11, cy + m10 * (x1 - cx) + m11 * (y1 - cy) + page_transform.dy,
+    )
+    fill_color = 255 if page_image_pil.mode in ("L", "1") else (255,) * len(page_image_pil.getbands())
+    return page_image_pil.transform((x2 - x1, y2 - y1), Image.AFFINE, affine, resample=Image.BILINEAR, fillcolor=fill_color)
+
+def crop_page_fields(annotation_layout, page_number, page_image_pil, page_references=None, profiler=None):
+    """
+    List (field, gambar area) untuk semua area di halaman ini. Jika referensi
+    halaman tersedia, transformasi diestimasi sekali untuk halaman dan diterapkan
+    ke semua persegi anotasi; estimasi yang ragu (korelasi di bawah
+    REGISTRATION_MIN_CONFIDENCE) memakai crop biasa.
+    """
+    page_transform = None
+    page_reference = page_references.get(page_number) if page_references is not None else None
+    if page_reference is not None:
+        with profiling.stage(profiler, "page_registration"):
+            page_transform = estimate_page_transform(page_image_pil, page_reference)
+        if page_transform.confidence < config.REGISTRATION_MIN_CONFIDENCE:
+            profiling.count(profiler, "pages_unregistered")
+            page_transform = None
+        else:
+            profiling.count(profiler, "pages_registered")
+    # Persegi crop sudah dihitung sebelumnya oleh layout untuk ukuran halaman ini
+    with profiling.stage(profiler, "crop_fields"):
+        return [
+            (field, crop_with_transform(page_image_pil, crop_rect, page_transform))
+            for field, crop_rect in annotation_layout.get_crop_rects(page_number, page_image_pil.size)
+        ]
+
+def build_page_reference(page_image_pil):
+    # Profil kolom/baris gambar kerja dari halaman referensi (dianggap tegak)
+    page_w, page_h = page_image_pil.size
+    work_w = config.REGISTRATION_WORK_WIDTH
+    work_size = (work_w, max(1, int(round(work_w * page_h / page_w))))
+    _, darkness = _work_darkness(page_image_pil, work_size)
+    return {"work_size": work_size, "col_profile": darkness.mean(axis=0), "row_profile": darkness.mean(axis=1)}
+
+def get_reference_path(annotation_path):
+    return os.path.splitext(annotation_path)[0] + ".reg.json"
+
+def save_references(layout_hash, page_references, reference_path):
+    reference_data = {
+        "version": REGISTRATION_FORMAT_VERSION, "layout_hash": layout_hash,
+        "pages": {
+            str(page_number): {
+                "work_size": list(page_reference["work_size"]),
+                "col_profile": [round(float(v), 5) for v in page_reference["col_profile"]],
+                "row_profile": [round(float(v), 5) for v in page_reference["row_profile"]],
+            }
+            for page_number, page_reference in sorted(page_references.items())
+        },
+    }
+    temp_path = f"{reference_path}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(reference_data, f)
+    os.replace(temp_path, reference_path)
+
+def load_references_for_layout(annotation_layout):
+    """
+    Referensi per halaman ({nomor halaman: referensi}) untuk layout anotasi ini,
+    atau None jika file tidak ada atau dibuat dari versi anotasi lain. Di-cache per
+    proses berdasarkan mtime.
+    """
+    reference_path = get_reference_path(annotation_layout.source_path)
+    if not os.path.exists(reference_path): return None
+    file_stat = os.stat(reference_path)
+    cache_key = (reference_path, file_stat.st_mtime_ns, file_stat.st_size)
+    with _reference_cache_lock:
+        if cache_key in _reference_cache: return _reference_cache[cache_key]
+    try:
+        with open(reference_path, "r", encoding="utf-8") as f:
+            reference_data = json.load(f)
+        page_references = None
+        if reference_data.get("version") != REGISTRATION_FORMAT_VERSION:
+            print(f"File referensi '{reference_path}' memakai format lain; buat ulang dengan 'python registration.py build'.")
+        elif reference_data.get("layout_hash") != annotation_layout.file_hash:
+            print(f"File referensi '{reference_path}' dibuat dari anotasi versi lain; registrasi halaman tidak dipakai.")
+        else:
+            page_references = {
+                int(page_number): {
+                    "work_size": tuple(page_reference["work_size"]),
+                    "col_profile": np.asarray(page_reference["col_profile"], dtype=np.float64),
+                    "row_profile": np.asarray(page_reference["row_profile"], dtype=np.float64),
+                }
+                for page_number, page_reference in reference_data["pages"].items()
+            }
+    except (OSError, ValueError, KeyError) as e_reference:
+        print(f"Gagal memuat file referensi '{reference_path}': {e_reference}")
+        page_references = None
+    with _reference_cache_lock:
+        _reference_cache[cache_key] = page_references
+    return page_references
+
+def get_active_references(annotation_layout):
+    # Referensi yang dipakai ekstraksi mode "page"; None jika fitur dimatikan atau file belum dibuat
+    if not config.PAGE_REGISTRATION_ENABLED or annotation_layout is None: return None
+    return load_references_for_layout(annotation_layout)
+
+def build_references(pdf_path, selected_gender_str):
+    """
+    Render halaman-halaman anotasi dari PDF referensi dan simpan profilnya di
+    samping file anotasi. Mengembalikan (jumlah halaman, path file referensi).
+    """
+    annotation_layout = layout.load_layout_for_gender(selected_gender_str)
+    if annotation_layout is None:
+        raise FileNotFoundError(f"File anotasi untuk gender '{selected_gender_str}' tidak ditemukan.")
+    with open(pdf_path, "rb") as f:
+        pdf_bytes = f.read()
+    page_references = {
+        page_number: build_page_reference(page_image_pil)
+        for page_number, page_image_pil in model.model_iter_pdf_pages(pdf_bytes, annotation_layout.page_numbers)
+    }
+    reference_path = get_reference_path(annotation_layout.source_path)
+    save_references(annotation_layout.file_hash, page_references, reference_path)
+    return len(page_references), reference_path
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Registrasi halaman scan terhadap formulir referensi.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Buat file referensi dari PDF formulir")
+    build_parser.add_argument("--pdf", required=True, help="PDF formulir referensi (sebaiknya yang dipakai saat anotasi)")
+    build_parser.add_argument("--gender", default="pria", choices=["pria", "perempuan"])
+    return parser
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    num_pages, reference_path = build_references(args.pdf, args.gender)
+    print(f"Referensi {num_pages} halaman disimpan di: {reference_path}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
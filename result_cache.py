@@ -0,0 +1,253 @@
+# result_cache.py
+# Cache hasil ekstraksi di disk (SQLite), dialamatkan berdasarkan isi:
+# - level dokumen: hash PDF + hash file anotasi + hash bobot model + threshold config
+# - level area: hash piksel crop area + hash bobot model + threshold config
+# Entri dihapus berdasarkan umur dan total ukuran (yang paling lama tidak diakses lebih dulu).
+
+import os
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import threading
+import layout
+import result_records
+import config # Import file config
+
+# Naikkan jika format payload atau arti hasil berubah agar entri lama tidak terpakai
+CACHE_FORMAT_VERSION = 2 # 2: crop kosong bernilai confidence None; dengan eskalasi, cache area berisi hasil akhir
+
+_file_hash_cache = {}
+_file_hash_lock = threading.Lock()
+_connection_local = threading.local()
+
+def _sha256_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+def file_sha256(file_path):
+    # Hash isi file, di-memo per (mtime, ukuran) agar bobot model tidak di-hash ulang tiap request
+    if not os.path.exists(file_path): return "missing"
+    file_stat = os.stat(file_path)
+    stat_key = (os.path.abspath(file_path), file_stat.st_mtime_ns, file_stat.st_size)
+    with _file_hash_lock:
+        cached_hash = _file_hash_cache.get(stat_key)
+    if cached_hash is not None: return cached_hash
+    hasher = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            hasher.update(chunk)
+    with _file_hash_lock:
+        _file_hash_cache[stat_key] = hasher.hexdigest()
+    return _file_hash_cache[stat_key]
+
+def _model_and_config_fingerprint():
+    # Semua hal selain input yang memengaruhi hasil: bobot model, backend inferensi, dan threshold/filter
+    import backends # Import lokal: backends memakai file_sha256 dari modul ini
+    import registration
+    import template_grid
+    fingerprint = {
+        "version": CACHE_FORMAT_VERSION,
+        "ssd_weights": file_sha256(config.SSD_MODEL_PATH),
+        "char_weights": file_sha256(config.CHAR_CLASSIFIER_MODEL_PATH),
+        "backend": backends.get_backend_fingerprint(),
+        # Kotak dari template grid bisa sedikit berbeda dari SSD, jadi file grid ikut menentukan hasil
+        "template_grids": [
+            file_sha256(template_grid.get_grid_path(layout.get_annotation_path(gender))) for gender in ("pria", "perempuan")
+        ] if config.TEMPLATE_GRID_ENABLED else None,
+        "grid_params": [list(config.GRID_PROFILE_SIZE), config.GRID_MAX_SHIFT_FRAC, config.GRID_MIN_CONFIDENCE] if config.TEMPLATE_GRID_ENABLED else None,
+        # Registrasi halaman mengubah piksel crop; kunci area ikut berubah, kunci dokumen perlu penanda ini
+        "page_registration": [
+            file_sha256(registration.get_reference_path(layout.get_annotation_path(gender))) for gender in ("pria", "perempuan")
+        ] + [config.REGISTRATION_MIN_CONFIDENCE, config.REGISTRATION_WORK_WIDTH] if config.PAGE_REGISTRATION_ENABLED else None,
+        # Eskalasi mengganti hasil area yang ragu dengan hasil model presisi penuh
+        "escalation": [
+            config.ESCALATION_MIN_AVG_CONF, config.ESCALATION_DPI, config.ESCALATION_BACKEND, config.ESCALATION_TTA_VARIANTS,
+            config.ESCALATION_TTA_JITTER_FRAC, config.ESCALATION_MAX_FIELDS_FRAC,
+        ] if config.ADAPTIVE_ESCALATION_ENABLED else None,
+        "thresholds": [
+            config.SSD_DETECTION_THRESHOLD, config.SSD_NMS_IOU_THRESHOLD,
+            config.CHAR_CLASSIFICATION_THRESHOLD, config.MIN_CHAR_BOX_WIDTH, config.MIN_CHAR_BOX_HEIGHT,
+            config.MAX_CHAR_BOX_ASPECT_RATIO, config.MIN_CHAR_AREA,
+            config.BLANK_CHAR_MAX_STDDEV, config.BLANK_CHAR_MIN_MEAN, list(config.CHAR_IMAGE_SIZE),
+        ],
+    }
+    return json.dumps(fingerprint, sort_keys=True)
+
+def compute_document_key(pdf_bytes, selected_gender_str, extraction_mode):
+    annotation_path = layout.get_annotation_path(selected_gender_str)
+    render_params = [extraction_mode, config.PDF_RENDER_DPI]
+    if extraction_mode == "region": render_params += [config.REGION_MIN_DPI, config.REGION_MAX_DPI]
+    key_material = "|".join([
+        "doc", _sha256_bytes(pdf_bytes), file_sha256(annotation_path),
+        json.dumps(render_params), _model_and_config_fingerprint(),
+    ])
+    return _sha256_bytes(key_material.encode("utf-8"))
+
+def compute_field_key(field_image_pil, fingerprint=None, field_identity=None):
+    # Hash piksel crop area (mode + ukuran + isi), digabung dengan sidik model/config
+    # `field_identity` (mis. hash layout + indeks area) dipakai jika hasil juga bergantung pada area mana crop ini
+    if fingerprint is None: fingerprint = _model_and_config_fingerprint()
+    pixel_hash = hashlib.sha256()
+    pixel_hash.update(f"{field_image_pil.mode}|{field_image_pil.size}|".encode("utf-8"))
+    pixel_hash.update(field_image_pil.tobytes())
+    key_parts = ["field", pixel_hash.hexdigest(), fingerprint]
+    if field_identity is not None: key_parts.append(str(field_identity))
+    return _sha256_bytes("|".join(key_parts).encode("utf-8"))
+
+def compute_field_keys(field_images_pil, field_identities=None):
+    # Sidik model/config (stat file + json.dumps) dihitung sekali untuk semua area, bukan per area
+    fingerprint = _model_and_config_fingerprint()
+    if field_identities is None: field_identities = [None] * len(field_images_pil)
+    return [
+        compute_field_key(field_image_pil, fingerprint, field_identity)
+        for field_image_pil, field_identity in zip(field_images_pil, field_identities)
+    ]
+
+def _get_connection():
+    # Satu koneksi SQLite per thread; WAL agar pembaca dan penulis antar proses tidak saling kunci
+    connection = getattr(_connection_local, "connection", None)
+    cache_path = os.path.abspath(config.RESULT_CACHE_PATH)
+    if connection is not None and _connection_local.path == cache_path: return connection
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    connection = sqlite3.connect(cache_path, timeout=30)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS documents (key TEXT PRIMARY KEY, payload BLOB, size INTEGER, "
+        "created_at REAL, accessed_at REAL)"
+    )
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS fields (key TEXT PRIMARY KEY, payload TEXT, size INTEGER, "
+        "created_at REAL, accessed_at REAL)"
+    )
+    connection.commit()
+    _connection_local.connection = connection
+    _connection_local.path = cache_path
+    return connection
+
+def encode_results(results_data):
+    # Record sudah membawa PNG crop dan thumbnail, jadi tidak ada encode ulang di sini
+    return [result_records.FieldResult.from_dict(res_data).to_encoded() for res_data in results_data]
+
+def decode_results(encoded_results):
+    # PNG tidak di-decode; gambar baru dibuka saat Image_PIL diminta
+    return [result_records.FieldResult.from_dict(encoded_item) for encoded_item in encoded_results]
+
+def get_document(document_key):
+    """Ambil (list hasil, bytes Excel atau None) dari cache, atau None jika tidak ada/kedaluwarsa."""
+    if not config.RESULT_CACHE_ENABLED: return None
+    try:
+        connection = _get_connection()
+        row = connection.execute("SELECT payload, created_at FROM documents WHERE key = ?", (document_key,)).fetchone()
+        if row is None: return None
+        if time.time() - row[1] > config.RESULT_CACHE_MAX_AGE_S:
+            connection.execute("DELETE FROM documents WHERE key = ?", (document_key,))
+            connection.commit()
+            return None
+        connection.execute("UPDATE documents SET accessed_at = ? WHERE key = ?", (time.time(), document_key))
+        connection.commit()
+        payload = pickle.loads(row[0])
+        return decode_results(payload["results"]), payload.get("excel")
+    except Exception as e_cache:
+        print(f"Gagal membaca cache dokumen: {e_cache}")
+        return None
+
+def put_document(document_key, results_data, excel_bytes=None):
+    if not config.RESULT_CACHE_ENABLED: return
+    try:
+        payload = pickle.dumps({"results": encode_results(results_data), "excel": excel_bytes}, protocol=pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        connection = _get_connection()
+        connection.execute(
+            "INSERT OR REPLACE INTO documents (key, payload, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            (document_key, payload, len(payload), now, now)
+        )
+        connection.commit()
+        evict()
+    except Exception as e_cache:
+        print(f"Gagal menyimpan cache dokumen: {e_cache}")
+
+def get_fields(field_keys):
+    """Ambil hasil per area: dict {key: (teks, list confidence)} untuk key yang ada di cache."""
+    if not config.RESULT_CACHE_ENABLED or not config.FIELD_CACHE_ENABLED or not field_keys: return {}
+    try:
+        connection = _get_connection()
+        min_created_at = time.time() - config.RESULT_CACHE_MAX_AGE_S
+        found = {}
+        unique_keys = list(set(field_keys))
+        for start_idx in range(0, len(unique_keys), 500):
+            chunk_keys = unique_keys[start_idx:start_idx + 500]
+            placeholders = ",".join("?" * len(chunk_keys))
+            rows = connection.execute(
+                f"SELECT key, payload FROM fields WHERE key IN ({placeholders}) AND created_at >= ?",
+                (*chunk_keys, min_created_at)
+            ).fetchall()
+            for key, payload in rows:
+                field_value = json.loads(payload)
+                found[key] = (field_value["text"], field_value["confidences"])
+        if found:
+            now = time.time()
+            connection.executemany("UPDATE fields SET accessed_at = ? WHERE key = ?", [(now, key) for key in found])
+            connection.commit()
+        return found
+    except Exception as e_cache:
+        print(f"Gagal membaca cache area: {e_cache}")
+        return {}
+
+def put_fields(field_values):
+    # field_values: dict {key: (teks, list confidence)}
+    if not config.RESULT_CACHE_ENABLED or not config.FIELD_CACHE_ENABLED or not field_values: return
+    try:
+        now = time.time()
+        rows = []
+        for key, (recognized_string, confidences) in field_values.items():
+            payload = json.dumps({"text": recognized_string, "confidences": [None if c is None else float(c) for c in confidences]})
+            rows.append((key, payload, len(payload), now, now))
+        connection = _get_connection()
+        connection.executemany(
+            "INSERT OR REPLACE INTO fields (key, payload, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)", rows
+        )
+        connection.commit()
+    except Exception as e_cache:
+        print(f"Gagal menyimpan cache area: {e_cache}")
+
+def evict(max_bytes=None, max_age_s=None):
+    """
+    Hapus entri yang lebih tua dari max_age_s, lalu entri yang paling lama tidak
+    diakses sampai total ukuran (dokumen + area) di bawah max_bytes.
+    """
+    if max_bytes is None: max_bytes = config.RESULT_CACHE_MAX_BYTES
+    if max_age_s is None: max_age_s = config.RESULT_CACHE_MAX_AGE_S
+    connection = _get_connection()
+    min_created_at = time.time() - max_age_s
+    for table_name in ("documents", "fields"):
+        connection.execute(f"DELETE FROM {table_name} WHERE created_at < ?", (min_created_at,))
+    connection.commit()
+
+    total_bytes = sum(connection.execute(f"SELECT COALESCE(SUM(size), 0) FROM {t}").fetchone()[0] for t in ("documents", "fields"))
+    if total_bytes <= max_bytes: return
+    # Dokumen jauh lebih besar dari entri area, jadi dikurangi lebih dulu
+    for table_name in ("documents", "fields"):
+        rows = connection.execute(f"SELECT key, size FROM {table_name} ORDER BY accessed_at ASC").fetchall()
+        keys_to_delete = []
+        for key, size in rows:
+            if total_bytes <= max_bytes: break
+            keys_to_delete.append((key,))
+            total_bytes -= size
+        connection.executemany(f"DELETE FROM {table_name} WHERE key = ?", keys_to_delete)
+        connection.commit()
+        if total_bytes <= max_bytes: break
+
+def get_cache_stats():
+    connection = _get_connection()
+    stats = {}
+    for table_name in ("documents", "fields"):
+        count, total_size = connection.execute(f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {table_name}").fetchone()
+        stats[table_name] = {"entries": count, "bytes": total_size}
+    return stats
+
+def clear_cache():
+    connection = _get_connection()
+    for table_name in ("documents", "fields"):
+        connection.execute(f"DELETE FROM {table_name}")
+    connection.commit()
@@ -0,0 +1,149 @@
+# result_records.py
+# Record hasil ekstraksi yang ringkas: kolom teks dalam __slots__, crop area
+# disimpan sekali sebagai PNG terkompresi (di-decode hanya saat dibutuhkan),
+# dan thumbnail kecil untuk tampilan paginasi di UI.
+
+import io
+from PIL import Image
+import config # Import file config
+
+# Kunci dict lama -> nama slot, agar kode yang memakai res_data["Teks"] dst. tetap berjalan
+_TEXT_KEYS = {"ID_Pertanyaan": "question_id", "Halaman": "page", "Teks": "text", "Avg_Conf": "avg_conf"}
+_IMAGE_KEYS = ("Image_PIL", "Image_PNG", "Thumbnail_PNG")
+
+def encode_png(image_pil, compress_level=None):
+    if compress_level is None: compress_level = config.RESULT_PNG_COMPRESS_LEVEL
+    png_buffer = io.BytesIO()
+    image_pil.save(png_buffer, format="PNG", compress_level=compress_level)
+    return png_buffer.getvalue()
+
+def make_thumbnail_png(image_pil):
+    thumbnail_pil = image_pil.copy()
+    thumbnail_pil.thumbnail((config.RESULT_THUMBNAIL_WIDTH, config.RESULT_THUMBNAIL_WIDTH), Image.BILINEAR, reducing_gap=2.0)
+    return encode_png(thumbnail_pil)
+
+class FieldResult:
+    """
+    Hasil satu area pertanyaan. Bisa diakses seperti dict lama
+    (res["Teks"], res["Image_PIL"], res.get(...)); items()/keys() hanya berisi
+    kolom teks (dan kolom tambahan seperti "Dokumen"), bukan gambar.
+    Image_PIL di-decode ulang dari PNG setiap kali diminta dan tidak ditahan.
+    """
+    __slots__ = ("question_id", "page", "text", "avg_conf", "crop_png", "crop_size", "thumbnail_png", "extra")
+
+    def __init__(self, question_id, page, text, avg_conf, crop_png=None, crop_size=None, thumbnail_png=None, extra=None):
+        self.question_id = question_id
+        self.page = page
+        self.text = text
+        self.avg_conf = avg_conf
+        self.crop_png = crop_png
+        self.crop_size = crop_size
+        self.thumbnail_png = thumbnail_png
+        self.extra = extra
+
+    @classmethod
+    def from_image(cls, question_id, page, text, avg_conf, image_pil):
+        # Crop dan thumbnail di-encode sekali di sini; gambar PIL penuh tidak disimpan
+        if image_pil is None: return cls(question_id, page, text, avg_conf)
+        crop_png = encode_png(image_pil)
+        thumbnail_png = crop_png if image_pil.width <= config.RESULT_THUMBNAIL_WIDTH else make_thumbnail_png(image_pil)
+        return cls(question_id, page, text, avg_conf, crop_png, image_pil.size, thumbnail_png)
+
+    @classmethod
+    def from_dict(cls, res_data):
+        # Dari dict lama (Image_PIL) atau hasil encode cache (Image_PNG/Thumbnail_PNG)
+        if isinstance(res_data, FieldResult): return res_data
+        extra = {key: value for key, value in res_data.items() if key not in _TEXT_KEYS and key not in _IMAGE_KEYS} or None
+        text_values = [res_data.get(key) for key in _TEXT_KEYS]
+        if res_data.get("Image_PNG") is not None:
+            crop_png = res_data["Image_PNG"]
+            thumbnail_png = res_data.get("Thumbnail_PNG")
+            with Image.open(io.BytesIO(crop_png)) as image_pil:
+                crop_size = image_pil.size
+                if thumbnail_png is None: # Entri cache lama tanpa thumbnail
+                    thumbnail_png = crop_png if image_pil.width <= config.RESULT_THUMBNAIL_WIDTH else make_thumbnail_png(image_pil)
+            return cls(*text_values, crop_png, crop_size, thumbnail_png, extra)
+        record = cls.from_image(*text_values, res_data.get("Image_PIL"))
+        record.extra = extra
+        return record
+
+    def image(self):
+        """Crop area penuh sebagai PIL (di-decode dari PNG), atau None."""
+        if self.crop_png is None: return None
+        image_pil = Image.open(io.BytesIO(self.crop_png))
+        image_pil.load()
+        return image_pil
+
+    def without_crop(self):
+        # Salinan hanya dengan teks + thumbnail (untuk session state UI)
+        return FieldResult(self.question_id, self.page, self.text, self.avg_conf, None, self.crop_size, self.thumbnail_png,
+                           dict(self.extra) if self.extra else None)
+
+    def to_encoded(self):
+        # Dict siap pickle/cache: kolom teks + PNG crop dan thumbnail apa adanya (tanpa encode ulang)
+        encoded_item = dict(self.items())
+        if self.crop_png is not None: encoded_item["Image_PNG"] = self.crop_png
+        if self.thumbnail_png is not None and self.thumbnail_png is not self.crop_png: encoded_item["Thumbnail_PNG"] = self.thumbnail_png
+        return encoded_item
+
+    def nbytes(self):
+        # Thumbnail bisa berbagi bytes dengan crop (crop yang sudah kecil)
+        thumbnail_nbytes = len(self.thumbnail_png or b"") if self.thumbnail_png is not self.crop_png else 0
+        return len(self.crop_png or b"") + thumbnail_nbytes
+
+    def keys(self):
+        return list(_TEXT_KEYS) + list(self.extra or ())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, key):
+        if key in _TEXT_KEYS or (self.extra and key in self.extra): return True
+        if key in ("Image_PIL", "Image_PNG"): return self.crop_png is not None
+        return key == "Thumbnail_PNG" and self.thumbnail_png is not None
+
+    def __getitem__(self, key):
+        slot_name = _TEXT_KEYS.get(key)
+        if slot_name is not None: return getattr(self, slot_name)
+        if key == "Image_PIL": return self.image()
+        if key == "Image_PNG": return self.crop_png
+        if key == "Thumbnail_PNG": return self.thumbnail_png
+        if self.extra and key in self.extra: return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        slot_name = _TEXT_KEYS.get(key)
+        if slot_name is not None:
+            setattr(self, slot_name, value)
+        elif key in _IMAGE_KEYS:
+            raise KeyError(f"{key} hanya bisa diisi lewat FieldResult.from_image")
+        else:
+            if self.extra is None: self.extra = {}
+            self.extra[key] = value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __repr__(self):
+        return f"FieldResult({self.question_id!r}, halaman={self.page!r}, teks={self.text!r}, conf={self.avg_conf!r})"
+
+def compact_results(results_data):
+    """Record tanpa crop penuh (hanya teks + thumbnail) untuk disimpan di session state."""
+    return [FieldResult.from_dict(res_data).without_crop() for res_data in results_data]
+
+def results_nbytes(results_data):
+    # Perkiraan ukuran gambar yang ditahan list hasil (PNG terkompresi; PIL dihitung mentah)
+    total_bytes = 0
+    for res_data in results_data:
+        if isinstance(res_data, FieldResult):
+            total_bytes += res_data.nbytes()
+        elif res_data.get("Image_PIL") is not None:
+            image_pil = res_data["Image_PIL"]
+            total_bytes += image_pil.width * image_pil.height * len(image_pil.getbands())
+    return total_bytes
@@ -0,0 +1,302 @@
+# template_grid.py
+# Jalur cepat tanpa detektor: posisi kotak karakter setiap area dipelajari sekali dari
+# dokumen referensi (output SSD), disimpan di samping file anotasi (anotasi_<gender>.grid.json),
+# lalu saat ekstraksi karakter dipotong langsung dari grid setelah penyelarasan per halaman.
+# Area yang penyelarasannya ragu tetap memakai SSD.
+#
+# Contoh:
+#   python template_grid.py build --pdf data/referensi/*.pdf --gender pria
+
+import os
+import sys
+import json
+import argparse
+import threading
+import numpy as np
+from PIL import Image
+import model
+import layout
+import profiling
+import config # Import file config
+
+# Naikkan jika format file grid berubah
+GRID_FORMAT_VERSION = 1
+
+_grid_cache = {}
+_grid_cache_lock = threading.Lock()
+
+class TemplateGrids:
+    """
+    Grid kotak karakter per area untuk satu file anotasi. Setiap grid berisi kotak
+    dalam pecahan ukuran area (x1, y1, x2, y2), ukuran area referensi dalam piksel,
+    dan profil proyeksi kolom/baris area referensi untuk penyelarasan.
+    """
+    def __init__(self, layout_hash, grids_by_field_idx, source_path=""):
+        self.layout_hash = layout_hash
+        self.grids_by_field_idx = grids_by_field_idx
+        self.source_path = source_path
+
+    def __len__(self):
+        return len(self.grids_by_field_idx)
+
+    def get(self, field):
+        return self.grids_by_field_idx.get(field.field_idx)
+
+    def to_dict(self):
+        return {
+            "version": GRID_FORMAT_VERSION, "layout_hash": self.layout_hash,
+            "profile_size": list(config.GRID_PROFILE_SIZE),
+            "fields": {
+                str(field_idx): {
+                    "boxes": [[round(v, 5) for v in box] for box in grid["boxes"]], "ref_size": list(grid["ref_size"]),
+                    "col_profile": [round(float(v), 4) for v in grid["col_profile"]],
+                    "row_profile": [round(float(v), 4) for v in grid["row_profile"]],
+                    "support": round(grid["support"], 3),
+                }
+                for field_idx, grid in sorted(self.grids_by_field_idx.items())
+            },
+        }
+
+def field_profiles(field_image_pil):
+    # Profil kegelapan rata-rata per kolom dan per baris pada ukuran profil tetap (tidak bergantung DPI)
+    profile_w, profile_h = config.GRID_PROFILE_SIZE
+    gray = np.asarray(field_image_pil.convert("L").resize((profile_w, profile_h), Image.BILINEAR), dtype=np.float32)
+    darkness = (255.0 - gray) / 255.0
+    return darkness.mean(axis=0), darkness.mean(axis=1)
+
+def ncc_all_shifts(ref_profile, cur_profile, max_shift):
+    """
+    Korelasi ternormalisasi untuk setiap pergeseran -max_shift..max_shift sekaligus
+    (isi `cur` bergeser `shift` titik dari `ref`, hanya bagian yang tumpang tindih).
+    Suku silang dari np.correlate, jumlah per bagian dari prefix sum.
+    """
+    ref_profile = np.asarray(ref_profile, dtype=np.float64)
+    cur_profile = np.asarray(cur_profile, dtype=np.float64)
+    length = len(ref_profile)
+    max_shift = min(max_shift, length - 2)
+    shifts = np.arange(-max_shift, max_shift + 1)
+    cross = np.correlate(cur_profile, ref_profile, mode="full")[length - 1 + shifts]
+    ref_sum, ref_sq = np.concatenate(([0.0], np.cumsum(ref_profile))), np.concatenate(([0.0], np.cumsum(ref_profile ** 2)))
+    cur_sum, cur_sq = np.concatenate(([0.0], np.cumsum(cur_profile))), np.concatenate(([0.0], np.cumsum(cur_profile ** 2)))
+    ref_start, ref_end = np.maximum(0, -shifts), np.minimum(length, length - shifts)
+    cur_start, cur_end = np.maximum(0, shifts), np.minimum(length, length + shifts)
+    overlap = (length - np.abs(shifts)).astype(np.float64)
+    sum_r, sum_c = ref_sum[ref_end] - ref_sum[ref_start], cur_sum[cur_end] - cur_sum[cur_start]
+    var_r = ref_sq[ref_end] - ref_sq[ref_start] - sum_r * sum_r / overlap
+    var_c = cur_sq[cur_end] - cur_sq[cur_start] - sum_c * sum_c / overlap
+    denom = np.sqrt(np.maximum(var_r, 0.0) * np.maximum(var_c, 0.0))
+    ncc = np.where(denom > 1e-9, (cross - sum_r * sum_c / overlap) / np.maximum(denom, 1e-9), 0.0)
+    return shifts, ncc
+
+def _best_shift(ref_profile, cur_profile, max_shift):
+    shifts, ncc = ncc_all_shifts(ref_profile, cur_profile, max_shift)
+    best_pos = int(np.argmax(ncc))
+    return int(shifts[best_pos]), float(ncc[best_pos])
+
+def _ncc_at(ref_profile, cur_profile, shift):
+    shifts, ncc = ncc_all_shifts(ref_profile, cur_profile, abs(shift))
+    return float(ncc[shift + (len(shifts) - 1) // 2]) if abs(shift) <= (len(shifts) - 1) // 2 else 0.0
+
+def learn_field_grids(annotation_layout, field_images_per_doc, char_boxes_per_doc, min_support=None):
+    """
+    Pelajari grid dari beberapa dokumen referensi. `field_images_per_doc` dan
+    `char_boxes_per_doc` berisi satu list per dokumen, sejajar dengan
+    annotation_layout.fields (None untuk area yang tidak ada). Jumlah kotak yang
+    paling sering muncul dipakai; dokumen yang kotaknya paling dekat ke median
+    menjadi referensi (kotak dan profilnya) agar grid dan profil berada di bingkai yang sama.
+    """
+    if min_support is None: min_support = config.GRID_MIN_SUPPORT
+    grids_by_field_idx = {}
+    for field in annotation_layout.fields:
+        observations = []
+        for field_images, char_boxes_list in zip(field_images_per_doc, char_boxes_per_doc):
+            field_image_pil = field_images[field.field_idx]
+            char_boxes = char_boxes_list[field.field_idx]
+            if field_image_pil is None or char_boxes is None: continue
+            field_w, field_h = field_image_pil.size
+            boxes_frac = np.array([[x1 / field_w, y1 / field_h, x2 / field_w, y2 / field_h] for x1, y1, x2, y2 in char_boxes], dtype=np.float64)
+            observations.append((field_image_pil, boxes_frac))
+        if not observations: continue
+
+        box_counts = [len(boxes_frac) for _, boxes_frac in observations]
+        modal_count = max(set(box_counts), key=box_counts.count)
+        modal_observations = [obs for obs in observations if len(obs[1]) == modal_count]
+        support = len(modal_observations) / len(observations)
+        if modal_count == 0 or support < min_support: continue
+
+        median_boxes = np.median(np.stack([boxes_frac for _, boxes_frac in modal_observations]), axis=0)
+        reference_image, reference_boxes = min(modal_observations, key=lambda obs: np.abs(obs[1] - median_boxes).sum())
+        col_profile, row_profile = field_profiles(reference_image)
+        grids_by_field_idx[field.field_idx] = {
+            "boxes": reference_boxes.tolist(), "ref_size": reference_image.size,
+            "col_profile": col_profile, "row_profile": row_profile, "support": support,
+        }
+    return TemplateGrids(annotation_layout.file_hash, grids_by_field_idx, annotation_layout.source_path)
+
+def match_fields(template_grids, fields, field_images, profiler=None):
+    """
+    Kotak karakter dari grid untuk setiap area, atau None jika area harus diproses SSD.
+    Pergeseran dihitung sekali per halaman: median pergeseran terbaik area-area yang
+    yakin (dalam piksel referensi), lalu setiap area dinilai ulang pada pergeseran
+    halaman tersebut; korelasi di bawah GRID_MIN_CONFIDENCE kembali ke SSD.
+    """
+    char_boxes_per_field = [None] * len(fields)
+    if template_grids is None or len(fields) == 0: return char_boxes_per_field
+    profile_w, profile_h = config.GRID_PROFILE_SIZE
+    max_shift_x = max(1, int(profile_w * config.GRID_MAX_SHIFT_FRAC))
+    max_shift_y = max(1, int(profile_h * config.GRID_MAX_SHIFT_FRAC))
+
+    with profiling.stage(profiler, "grid_align"):
+        field_positions_by_page = {}
+        for field_pos, field in enumerate(fields):
+            if field_images[field_pos] is not None and template_grids.get(field) is not None:
+                field_positions_by_page.setdefault(field.page_number, []).append(field_pos)
+
+        for page_field_positions in field_positions_by_page.values():
+            field_states = []
+            page_shifts_ref = []
+            for field_pos in page_field_positions:
+                grid = template_grids.get(fields[field_pos])
+                col_ref, row_ref = np.asarray(grid["col_profile"], dtype=np.float32), np.asarray(grid["row_profile"], dtype=np.float32)
+                col_cur, row_cur = field_profiles(field_images[field_pos])
+                shift_x, ncc_x = _best_shift(col_ref, col_cur, max_shift_x)
+                shift_y, ncc_y = _best_shift(row_ref, row_cur, max_shift_y)
+                ref_w, ref_h = grid["ref_size"]
+                field_states.append((field_pos, grid, col_ref, row_ref, col_cur, row_cur))
+                if min(ncc_x, ncc_y) >= config.GRID_MIN_CONFIDENCE:
+                    page_shifts_ref.append((shift_x * ref_w / profile_w, shift_y * ref_h / profile_h))
+            if not page_shifts_ref: continue
+            page_dx_ref, page_dy_ref = np.median(np.array(page_shifts_ref), axis=0)
+
+            for field_pos, grid, col_ref, row_ref, col_cur, row_cur in field_states:
+                ref_w, ref_h = grid["ref_size"]
+                confidence = min(
+                    _ncc_at(col_ref, col_cur, int(round(page_dx_ref * profile_w / ref_w))),
+                    _ncc_at(row_ref, row_cur, int(round(page_dy_ref * profile_h / ref_h))),
+                )
+                if confidence < config.GRID_MIN_CONFIDENCE: continue
+                field_w, field_h = field_images[field_pos].size
+                dx_px = page_dx_ref * field_w / ref_w
+                dy_px = page_dy_ref * field_h / ref_h
+                field_boxes = []
+                for fx1, fy1, fx2, fy2 in grid["boxes"]:
+                    x1 = max(0, int(round(fx1 * field_w + dx_px)))
+                    y1 = max(0, int(round(fy1 * field_h + dy_px)))
+                    x2 = min(field_w, int(round(fx2 * field_w + dx_px)))
+                    y2 = min(field_h, int(round(fy2 * field_h + dy_px)))
+                    if x2 > x1 and y2 > y1: field_boxes.append([x1, y1, x2, y2])
+                if field_boxes: char_boxes_per_field[field_pos] = field_boxes
+
+    num_matched = sum(1 for boxes in char_boxes_per_field if boxes is not None)
+    profiling.count(profiler, "grid_fields", num_matched)
+    profiling.count(profiler, "grid_fallback_fields", len(fields) - num_matched)
+    return char_boxes_per_field
+
+def get_grid_path(annotation_path):
+    return os.path.splitext(annotation_path)[0] + ".grid.json"
+
+def save_grids(template_grids, grid_path):
+    temp_path = f"{grid_path}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(template_grids.to_dict(), f)
+    os.replace(temp_path, grid_path)
+
+def load_grids_for_layout(annotation_layout):
+    """
+    Grid untuk layout anotasi ini, atau None jika file grid tidak ada atau dibuat
+    dari versi anotasi lain (hash berbeda). Di-cache per proses berdasarkan mtime.
+    """
+    grid_path = get_grid_path(annotation_layout.source_path)
+    if not os.path.exists(grid_path): return None
+    file_stat = os.stat(grid_path)
+    cache_key = (grid_path, file_stat.st_mtime_ns, file_stat.st_size)
+    with _grid_cache_lock:
+        if cache_key in _grid_cache: return _grid_cache[cache_key]
+    try:
+        with open(grid_path, "r", encoding="utf-8") as f:
+            grid_data = json.load(f)
+        template_grids = None
+        if grid_data.get("version") != GRID_FORMAT_VERSION or list(grid_data.get("profile_size", [])) != list(config.GRID_PROFILE_SIZE):
+            print(f"File grid '{grid_path}' memakai format lain; buat ulang dengan 'python template_grid.py build'.")
+        elif grid_data.get("layout_hash") != annotation_layout.file_hash:
+            print(f"File grid '{grid_path}' dibuat dari anotasi versi lain; grid tidak dipakai.")
+        else:
+            template_grids = TemplateGrids(grid_data["layout_hash"], {
+                int(field_idx): {
+                    "boxes": grid["boxes"], "ref_size": tuple(grid["ref_size"]),
+                    "col_profile": np.asarray(grid["col_profile"], dtype=np.float32),
+                    "row_profile": np.asarray(grid["row_profile"], dtype=np.float32), "support": grid["support"],
+                }
+                for field_idx, grid in grid_data["fields"].items()
+            }, grid_path)
+    except (OSError, ValueError, KeyError) as e_grid:
+        print(f"Gagal memuat file grid '{grid_path}': {e_grid}")
+        template_grids = None
+    with _grid_cache_lock:
+        _grid_cache[cache_key] = template_grids
+    return template_grids
+
+def get_active_grids(annotation_layout):
+    # Grid yang dipakai ekstraksi; None jika fitur dimatikan atau grid belum dibuat
+    if not config.TEMPLATE_GRID_ENABLED or annotation_layout is None: return None
+    return load_grids_for_layout(annotation_layout)
+
+def build_template_grids(pdf_paths, selected_gender_str, model_s, device_obj, extraction_mode=None):
+    """
+    Render area dari PDF referensi, deteksi kotak karakter dengan SSD, lalu
+    pelajari dan simpan grid di samping file anotasi. Mengembalikan (grid, path).
+    """
+    import extraction
+    annotation_layout = layout.load_layout_for_gender(selected_gender_str)
+    if annotation_layout is None:
+        raise extraction.ExtractionError(f"File anotasi untuk gender '{selected_gender_str}' tidak ditemukan.")
+    transform_s = model.get_ssd_transform()
+    field_images_per_doc = []
+    char_boxes_per_doc = []
+    for pdf_path in pdf_paths:
+        with open(pdf_path, "rb") as f:
+            pdf_bytes = f.read()
+        field_images, pages_rendered, _ = extraction.render_field_images(pdf_bytes, annotation_layout, extraction_mode)
+        if pages_rendered == 0:
+            print(f"Gagal merender PDF referensi: {pdf_path}")
+            continue
+        present_positions = [i for i, img in enumerate(field_images) if img is not None]
+        detected_boxes = model.model_detect_chars_batch([field_images[i] for i in present_positions], model_s, device_obj, transform_s)
+        char_boxes = [None] * len(field_images)
+        for field_pos, boxes in zip(present_positions, detected_boxes):
+            char_boxes[field_pos] = boxes
+        field_images_per_doc.append(field_images)
+        char_boxes_per_doc.append(char_boxes)
+
+    template_grids = learn_field_grids(annotation_layout, field_images_per_doc, char_boxes_per_doc)
+    grid_path = get_grid_path(annotation_layout.source_path)
+    save_grids(template_grids, grid_path)
+    return template_grids, grid_path
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Pelajari grid kotak karakter per area dari dokumen referensi.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Buat file grid dari PDF referensi")
+    build_parser.add_argument("--pdf", nargs="+", required=True, help="PDF referensi (disarankan 3-10 dokumen)")
+    build_parser.add_argument("--gender", default="pria", choices=["pria", "perempuan"])
+    build_parser.add_argument("--mode", default=config.EXTRACTION_MODE, choices=config.EXTRACTION_MODES)
+    build_parser.add_argument("--device", default=str(config.DEVICE))
+    return parser
+
+def main(argv=None):
+    import torch
+    import model_registry
+    args = build_arg_parser().parse_args(argv)
+    device_obj = torch.device(args.device)
+    # Grid selalu dipelajari dari SSD fp32 agar tidak ikut membawa galat kuantisasi
+    model_s = model_registry.get_ssd_model(device_obj, "eager")
+    if model_s is None:
+        print("Model SSD tidak berhasil dimuat.")
+        return 1
+    template_grids, grid_path = build_template_grids(args.pdf, args.gender, model_s, device_obj, args.mode)
+    num_fields = len(layout.load_layout_for_gender(args.gender))
+    print(f"Grid untuk {len(template_grids)}/{num_fields} area disimpan di: {grid_path}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())